@@ -0,0 +1,215 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import secrets
+import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from firebase_admin import auth as admin_auth
+except ImportError:
+    admin_auth = None
+
+from app import app, db
+from models import AccountImportJob
+from firebase_service import initialize_firebase, build_profile, profile_paths, write_profiles
+
+# Rows per chunk: one get_users lookup (Auth allows 100 identifiers), one import_users call
+# and one multi-path RTDB update each
+ACCOUNT_IMPORT_CHUNK_SIZE = 100
+# Chunks in flight at once
+ACCOUNT_IMPORT_WORKERS = int(os.environ.get('ACCOUNT_IMPORT_WORKERS', '4'))
+ACCOUNT_IMPORT_MAX_ROWS = int(os.environ.get('ACCOUNT_IMPORT_MAX_ROWS', '10000'))
+# Passwords are imported as PBKDF2-SHA256 hashes; Firebase accepts up to 120000 rounds
+ACCOUNT_IMPORT_HASH_ROUNDS = int(os.environ.get('ACCOUNT_IMPORT_HASH_ROUNDS', '100000'))
+
+ROLES = ('driver', 'passenger')
+EXTRA_FIELDS = ('phone', 'notes', 'route', 'plate', 'created_at', 'created_ts')
+_UID_ALPHABET = string.ascii_letters + string.digits
+
+
+class ImportFormatError(ValueError):
+    """The uploaded file could not be read as CSV or JSON accounts"""
+
+
+def parse_accounts(content: str, fmt: str) -> List[Dict[str, Any]]:
+    """Rows of a CSV (with a header line) or a JSON list / {"accounts": [...]} document"""
+    if fmt == 'json':
+        try:
+            data = json.loads(content)
+        except ValueError as e:
+            raise ImportFormatError(f'Invalid JSON: {str(e)}')
+        rows = data.get('accounts') if isinstance(data, dict) else data
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            raise ImportFormatError('JSON must be a list of account objects or {"accounts": [...]}')
+        return rows
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(content.lstrip('\ufeff')))
+        if not reader.fieldnames or 'email' not in [f.strip().lower() for f in reader.fieldnames]:
+            raise ImportFormatError('CSV needs a header line with at least name and email columns')
+        return [{(k or '').strip().lower(): (v or '').strip() for k, v in row.items()} for row in reader]
+    raise ImportFormatError('format must be csv or json')
+
+
+def _validate(rows: List[Dict[str, Any]], default_role: Optional[str]) -> Tuple[List[Dict], List[Dict]]:
+    """Split rows into importable accounts and report entries for invalid or duplicate ones"""
+    accounts, rejected = [], []
+    seen = set()
+    for index, row in enumerate(rows, start=1):
+        email = str(row.get('email') or '').strip().lower()
+        name = str(row.get('name') or '').strip()
+        role = str(row.get('role') or default_role or '').strip().lower()
+        entry = {'row': index, 'email': email or None, 'status': 'invalid', 'uid': None, 'error': None}
+        if not name or not email or '@' not in email:
+            entry['error'] = 'name and a valid email are required'
+        elif role not in ROLES:
+            entry['error'] = 'role must be driver or passenger'
+        elif email in seen:
+            entry['status'] = 'duplicate'
+            entry['error'] = 'email already appears earlier in the file'
+        else:
+            seen.add(email)
+            accounts.append({
+                'row': index, 'email': email, 'name': name, 'role': role,
+                'password': str(row['password']) if row.get('password') else None,
+                'extra': {k: row[k] for k in EXTRA_FIELDS if row.get(k) not in (None, '')}
+            })
+            continue
+        rejected.append(entry)
+    return accounts, rejected
+
+
+def _new_uid() -> str:
+    return ''.join(secrets.choice(_UID_ALPHABET) for _ in range(28))
+
+
+def _import_record(account: Dict, uid: str):
+    options = {'uid': uid, 'email': account['email'], 'display_name': account['name']}
+    if account['password']:
+        salt = secrets.token_bytes(16)
+        options['password_salt'] = salt
+        options['password_hash'] = hashlib.pbkdf2_hmac('sha256', account['password'].encode('utf-8'), salt,
+                                                       ACCOUNT_IMPORT_HASH_ROUNDS)
+    return admin_auth.ImportUserRecord(**options)
+
+
+def _import_chunk(accounts: List[Dict]) -> List[Dict]:
+    """Link existing Auth users, import the new ones in one call, then write every profile at once"""
+    report = {a['row']: {'row': a['row'], 'email': a['email'], 'status': 'failed', 'uid': None, 'error': None}
+              for a in accounts}
+    try:
+        found = admin_auth.get_users([admin_auth.EmailIdentifier(a['email']) for a in accounts])
+        existing = {(user.email or '').lower(): user.uid for user in found.users}
+
+        new_accounts = [a for a in accounts if a['email'] not in existing]
+        uids = {a['row']: existing[a['email']] for a in accounts if a['email'] in existing}
+        if new_accounts:
+            records, row_uids = [], []
+            for account in new_accounts:
+                uid = _new_uid()
+                records.append(_import_record(account, uid))
+                row_uids.append((account['row'], uid))
+            hash_alg = admin_auth.UserImportHash.pbkdf2_sha256(rounds=ACCOUNT_IMPORT_HASH_ROUNDS)
+            result = admin_auth.import_users(records, hash_alg=hash_alg)
+            errors = {error.index: error.reason for error in result.errors}
+            for index, (row, uid) in enumerate(row_uids):
+                if index in errors:
+                    report[row]['error'] = errors[index]
+                else:
+                    uids[row] = uid
+                    report[row]['status'] = 'created'
+
+        updates = {}
+        for account in accounts:
+            uid = uids.get(account['row'])
+            if uid is None:
+                continue
+            report[account['row']]['uid'] = uid
+            updates.update(profile_paths(account['role'], uid,
+                                         build_profile(uid, account['name'], account['email'], account['role'],
+                                                       account['extra'])))
+        write_profiles(updates)
+        for account in accounts:
+            if account['row'] in uids and report[account['row']]['status'] != 'created':
+                report[account['row']]['status'] = 'linked'
+    except Exception as e:
+        # Rows already created in Auth keep status 'created' so a retry links them instead
+        logging.error(f"Account import chunk starting at row {accounts[0]['row']} failed: {str(e)}")
+        for entry in report.values():
+            if entry['status'] == 'created':
+                entry['error'] = f'Profile write failed: {str(e)}'
+            else:
+                entry['status'] = 'failed'
+                entry['error'] = entry['error'] or str(e)
+    return list(report.values())
+
+
+def _count(results: List[Dict]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for entry in results:
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+    return counts
+
+
+def start_import(rows: List[Dict[str, Any]], default_role: Optional[str] = None) -> Dict[str, Any]:
+    """Validate the rows, record an AccountImportJob and import the valid ones in a background thread.
+    Returns {'success', 'job'}; poll the job (GET /api/admin/import_accounts/<id>) for progress and results.
+    """
+    if len(rows) > ACCOUNT_IMPORT_MAX_ROWS:
+        return {'success': False, 'error': f'At most {ACCOUNT_IMPORT_MAX_ROWS} rows per import'}
+    if admin_auth is None or not initialize_firebase():
+        return {'success': False, 'error': 'Firebase admin not initialized'}
+
+    accounts, rejected = _validate(rows, default_role)
+    job = AccountImportJob(total=len(rows), processed=len(rejected), counts=_count(rejected), rows=rejected)
+    if not accounts:
+        job.status = 'done'
+        job.finished_at = datetime.utcnow()
+    db.session.add(job)
+    db.session.commit()
+    if accounts:
+        # Passwords stay in memory only; they are never written to the job row
+        threading.Thread(target=run_import, args=(job.id, accounts), name=f'account-import-{job.id}',
+                         daemon=True).start()
+    return {'success': True, 'job': job}
+
+
+def run_import(job_id: int, accounts: List[Dict]) -> None:
+    """Create or link Auth users for validated rows and upsert their RTDB profiles,
+    recording progress on the job after every chunk. A job whose process exits mid-run
+    stays 'running'; importing the same file again links the rows already created.
+    """
+    with app.app_context():
+        job = db.session.get(AccountImportJob, job_id)
+        results = list(job.rows or [])
+        chunks = [accounts[i:i + ACCOUNT_IMPORT_CHUNK_SIZE] for i in range(0, len(accounts), ACCOUNT_IMPORT_CHUNK_SIZE)]
+        try:
+            with ThreadPoolExecutor(max_workers=min(ACCOUNT_IMPORT_WORKERS, len(chunks)),
+                                    thread_name_prefix='account-import') as pool:
+                for chunk_results in pool.map(_import_chunk, chunks):
+                    results.extend(chunk_results)
+                    job.processed = len(results)
+                    job.counts = _count(results)
+                    db.session.commit()
+            job.status = 'done'
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Account import job {job_id} failed: {str(e)}")
+            job.status = 'failed'
+            job.error = str(e)
+        results.sort(key=lambda r: r['row'])
+        job.rows = results
+        job.processed = len(results)
+        job.counts = _count(results)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        logging.info(f"Account import job {job_id}: {len(results)} rows, {job.counts}")
+
+
+__all__ = ['ImportFormatError', 'parse_accounts', 'start_import', 'run_import', 'ACCOUNT_IMPORT_MAX_ROWS']
@@ -4,9 +4,13 @@ from dotenv import load_dotenv
 load_dotenv()
 import os
 import logging
-from flask import Flask
+from flask import Flask, has_request_context, request
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.sql import Select
 from werkzeug.middleware.proxy_fix import ProxyFix
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
@@ -20,13 +24,27 @@ logging.basicConfig(level=logging.DEBUG)
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+# Bind key of the read-only engine that serves SELECTs issued by GET requests
+READ_BIND = "readonly"
+
+class ReadRoutingSession(FlaskSession):
+    """Sends SELECT statements made while handling a GET/HEAD request to the read-only
+    pool. Flushes, DML and anything run outside a request keep using the primary engine."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and isinstance(clause, Select) and not self._flushing
+                and READ_BIND in self._db.engines
+                and has_request_context() and request.method in ("GET", "HEAD")):
+            return self._db.engines[READ_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(model_class=Base, session_options={"class_": ReadRoutingSession})
 
 # Create the app (single instance)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-CORS(app)  # Enable CORS for all routes
+CORS(app, expose_headers=['X-Next-Cursor', 'Link', 'ETag', 'Last-Modified'])  # Enable CORS for all routes
 
 # Configure the database
 # Ensure a stable, writable sqlite path regardless of working directory
@@ -41,27 +59,94 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_pre_ping": True,
 }
 
+# SQLite concurrency settings. WAL lets API reads run while the scheduler rewrites
+# predictions; busy_timeout makes a second writer wait instead of failing with
+# "database is locked".
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Connections in the read-only pool (0 disables it). READ_DATABASE_URL may point
+# at a replica; for SQLite it defaults to the same file opened query-only.
+SQLITE_READ_POOL_SIZE = int(os.environ.get("SQLITE_READ_POOL_SIZE", "10"))
+IS_SQLITE = app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite")
+# In-memory databases are private to one connection and cannot be shared with a second pool
+IS_SQLITE_FILE = IS_SQLITE and make_url(app.config["SQLALCHEMY_DATABASE_URI"]).database not in (None, "", ":memory:")
+
+read_url = os.environ.get("READ_DATABASE_URL") or (
+    app.config["SQLALCHEMY_DATABASE_URI"] if IS_SQLITE_FILE and SQLITE_READ_POOL_SIZE > 0 else None
+)
+if read_url:
+    app.config["SQLALCHEMY_BINDS"] = {
+        READ_BIND: {
+            "url": read_url,
+            "pool_size": max(SQLITE_READ_POOL_SIZE, 1),
+            "max_overflow": max(SQLITE_READ_POOL_SIZE, 1),
+            "pool_recycle": 300,
+            "pool_pre_ping": True,
+        }
+    }
+
+def _configure_sqlite_engine(engine, readonly=False):
+    """Apply the concurrency pragmas to every new connection of a SQLite engine"""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+            if readonly:
+                cursor.execute("PRAGMA query_only = ON")
+            else:
+                # The journal mode is stored in the database file; readers pick it up from there
+                cursor.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+            cursor.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+        finally:
+            cursor.close()
+
 # Initialize the app with the extension
 db.init_app(app)
 
+with app.app_context():
+    _configure_sqlite_engine(db.engines[None])
+    if READ_BIND in db.engines:
+        _configure_sqlite_engine(db.engines[READ_BIND], readonly=True)
+
+# CLI tools and benchmarks set DISABLE_SCHEDULER=1 before importing the app: no
+# background jobs and no startup prediction run in their process
+SCHEDULER_ENABLED = os.environ.get("DISABLE_SCHEDULER", "").lower() not in ("1", "true", "yes")
+# The migrations CLI sets DISABLE_AUTO_MIGRATIONS=1 so only its `upgrade` command changes the schema
+AUTO_MIGRATIONS = os.environ.get("DISABLE_AUTO_MIGRATIONS", "").lower() not in ("1", "true", "yes")
+
 # Initialize scheduler
 scheduler = BackgroundScheduler()
-scheduler.start()
+if SCHEDULER_ENABLED:
+    scheduler.start()
 
-# Shut down the scheduler when exiting the app
-atexit.register(lambda: scheduler.shutdown())
+    # Shut down the scheduler when exiting the app
+    atexit.register(lambda: scheduler.shutdown())
 
 with app.app_context():
     # Import models to ensure tables are created
     import models
-    db.create_all()
+    if AUTO_MIGRATIONS:
+        db.create_all()
+
+        # Bring tables that already existed up to date (columns, indexes)
+        from migrations import run_migrations
+        run_migrations()
+
+    # Register the session hooks that version tables on every committed write
+    import change_tracking  # noqa: F401
 
     # Import and register routes (import side-effect registers endpoints)
     import routes  # noqa: F401
 
     # Import and setup scheduler
-    from scheduler import setup_daily_prediction_job
-    setup_daily_prediction_job(scheduler)
+    if SCHEDULER_ENABLED:
+        from scheduler import setup_daily_prediction_job
+        setup_daily_prediction_job(scheduler)
 
 # Export for main.py
 __all__ = ['app']
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Backfill predictions for a range of dates.
+
+Splits the range into chunks, scores every (date, stop, hour) of a chunk in a
+single batched model call inside a process pool, and bulk-writes the Prediction
+rows one chunk per transaction. Dates that already have a prediction for every
+stop are skipped, so an interrupted backfill can simply be re-run.
+
+Usage (from backend/):
+    python backfill.py 2024-01-01 2024-12-31
+    python backfill.py 2024-01-01 2024-12-31 --workers 4 --chunk-days 14
+    python backfill.py 2024-06-01 2024-06-30 --force
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy import delete, func, insert
+
+# No scheduler threads or startup prediction run in the CLI (and its forked workers)
+os.environ.setdefault('DISABLE_SCHEDULER', '1')
+
+from app import app, db
+from models import JeepneyStop, Prediction, pack_hourly_curve
+from job_tracking import JobRunTracker
+from change_tracking import log_row_changes
+from scheduler import _heuristic_prediction
+
+try:
+    from ml_pipeline import load_forecasting_model, build_hourly_features, predict_hourly_demand, build_prediction_result  # type: ignore
+except Exception:
+    load_forecasting_model = None
+
+# Loaded once by run_backfill in the parent; forked workers inherit it
+_model = None
+_model_loaded = False
+
+
+def _date_range(start: date, end: date) -> List[date]:
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def _chunked(items: List, size: int) -> List[List]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def find_pending_dates(dates: List[date], stop_count: int) -> List[date]:
+    """Return the dates that do not yet have a prediction for every stop"""
+    complete = {
+        row[0] for row in db.session.query(Prediction.prediction_date)
+        .filter(Prediction.prediction_date.between(dates[0], dates[-1]))
+        .group_by(Prediction.prediction_date)
+        .having(func.count(func.distinct(Prediction.stop_id)) >= stop_count)
+        .all()
+    }
+    return [d for d in dates if d not in complete]
+
+
+def score_chunk(dates: List[date], stops: List[Tuple[int, str]]) -> Tuple[List[Dict], bool]:
+    """Build prediction rows for every stop on every date in the chunk.
+    Runs in a worker process; returns (rows, used_model).
+    """
+    if _model_loaded:
+        model = _model
+    else:
+        # Spawned workers (no fork) load the pickle themselves
+        model = load_forecasting_model() if load_forecasting_model else None
+    pairs = [(d, stop_id, stop_name) for d in dates for stop_id, stop_name in stops]
+    results = []
+
+    if model is not None:
+        # One model call for the whole chunk: 24 feature rows per (date, stop)
+        features = []
+        for d, _, stop_name in pairs:
+            features.extend(build_hourly_features(model, stop_name, d))
+        demand = predict_hourly_demand(model, features)
+        for i, (d, stop_id, stop_name) in enumerate(pairs):
+            results.append((d, stop_id, build_prediction_result(model, stop_name, d, demand[i * 24:(i + 1) * 24])))
+    else:
+        for d, stop_id, stop_name in pairs:
+            results.append((d, stop_id, _heuristic_prediction(stop_name, d)))
+
+    created_at = datetime.utcnow()
+    rows = [
+        {
+            'stop_id': stop_id,
+            'prediction_date': d,
+            'predicted_passengers': data['predicted_passengers'],
+            'peak_hour': data['peak_hour'],
+            'confidence_score': data['confidence_score'],
+            'is_school_dismissal': data['is_school_dismissal'],
+            'is_high_tide': data['is_high_tide'],
+            'is_public_holiday': data['is_public_holiday'],
+            'is_weekend': data['is_weekend'],
+            'message': data['message'],
+            'hourly_curve': pack_hourly_curve(data.get('hourly_demand')),
+            'is_sent': False,
+            'created_at': created_at
+        }
+        for d, stop_id, data in results if data
+    ]
+    return rows, model is not None
+
+
+def write_chunk(dates: List[date], rows: List[Dict]) -> int:
+    """Replace the predictions for the chunk's dates in a single transaction"""
+    try:
+        deleted_ids = db.session.execute(
+            delete(Prediction).where(Prediction.prediction_date.in_(dates)).returning(Prediction.id)
+            .execution_options(skip_change_log=True)
+        ).scalars().all()
+        log_row_changes(db.session, 'prediction', deleted_ids, 'delete')
+        if rows:
+            inserted_ids = db.session.execute(
+                insert(Prediction).returning(Prediction.id).execution_options(skip_change_log=True), rows
+            ).scalars().all()
+            log_row_changes(db.session, 'prediction', inserted_ids, 'upsert')
+        db.session.commit()
+        return len(rows)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def run_backfill(start: date, end: date, workers: int = None, chunk_days: int = 7, force: bool = False) -> Dict:
+    """Generate and store predictions for every date between start and end (inclusive)"""
+    global _model, _model_loaded
+    with app.app_context():
+        with JobRunTracker('backfill_predictions', trigger='backfill', target_date=start) as tracker:
+            stops = [(s.id, s.name) for s in JeepneyStop.query.order_by(JeepneyStop.id).all()]
+            if not stops:
+                tracker.fail('No stops found')
+                return {'success': False, 'error': 'No stops found'}
+
+            dates = _date_range(start, end)
+            pending = dates if force else find_pending_dates(dates, len(stops))
+            tracker.count('dates_requested', len(dates))
+            tracker.count('dates_skipped', len(dates) - len(pending))
+            if not pending:
+                print(f"Nothing to do: all {len(dates)} dates already have predictions (use --force to regenerate)")
+                return {'success': True, 'count': 0, 'dates': 0}
+
+            chunks = _chunked(pending, max(1, chunk_days))
+            print(f"Backfilling {len(pending)} of {len(dates)} dates for {len(stops)} stops "
+                  f"in {len(chunks)} chunks ({len(dates) - len(pending)} already complete)")
+
+            # Load (or train) the model here, once, instead of in every worker
+            with tracker.phase('model_load'):
+                _model = load_forecasting_model() if load_forecasting_model else None
+                _model_loaded = True
+            if _model is None:
+                logging.warning("No forecasting model available; backfilling with the heuristic")
+
+            # Fork keeps the already-imported app and the loaded model; workers never touch the DB
+            context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+            db.engine.dispose()
+            written = 0
+            done = 0
+            started = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                futures = {pool.submit(score_chunk, chunk, stops): chunk for chunk in chunks}
+                for future in as_completed(futures):
+                    chunk = futures[future]
+                    try:
+                        rows, used_model = future.result()
+                    except Exception as e:
+                        tracker.count('chunk_errors')
+                        logging.error(f"Backfill chunk {chunk[0]}..{chunk[-1]} failed: {str(e)}")
+                        continue
+                    if not used_model:
+                        tracker.count('heuristic_chunks')
+                    with tracker.phase('db_write'):
+                        written += write_chunk(chunk, rows)
+                    done += 1
+                    elapsed = time.perf_counter() - started
+                    print(f"[{done}/{len(chunks)}] {chunk[0]}..{chunk[-1]}: {len(rows)} rows "
+                          f"({written} total, {written / elapsed:.0f} rows/s)")
+            tracker.count('predictions_created', written)
+            if tracker.row_counts.get('chunk_errors'):
+                tracker.fail(f"{tracker.row_counts['chunk_errors']} chunks failed; re-run to resume")
+            return {'success': tracker.status != 'failed', 'count': written, 'dates': len(pending), 'job_run_id': tracker.run_id}
+
+
+def _parse_date(value: str) -> date:
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid date '{value}'. Use YYYY-MM-DD")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backfill passenger predictions for a date range.')
+    parser.add_argument('start', type=_parse_date, help='First date (YYYY-MM-DD)')
+    parser.add_argument('end', type=_parse_date, help='Last date, inclusive (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--chunk-days', type=int, default=7, help='Dates scored per worker task (default: 7)')
+    parser.add_argument('--force', action='store_true', help='Regenerate dates that already have predictions')
+    args = parser.parse_args(argv)
+
+    if args.end < args.start:
+        parser.error('end date must not be before start date')
+
+    logging.getLogger().setLevel(logging.WARNING)
+    result = run_backfill(args.start, args.end, workers=args.workers, chunk_days=args.chunk_days, force=args.force)
+    if not result['success']:
+        print(f"Backfill incomplete: {result.get('error', 'see logs')}")
+        return 1
+    print(f"Done: wrote {result['count']} predictions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
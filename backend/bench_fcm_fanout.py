@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark of FCM delivery against a local fake FCM endpoint.
+
+Starts a threaded HTTP server that answers like the FCM v1 send API after a
+fixed latency and fails a share of requests with 503/429, then delivers the
+same messages:
+  sequential - the previous path: requests.post per message, no session, no timeout
+  fan-out    - FcmSender: pooled keep-alive session, bounded concurrency, retries
+  topic      - FCM_DELIVERY_MODE=topic: batched topic subscription, then one publish
+
+Usage (from backend/):
+    python bench_fcm_fanout.py
+    python bench_fcm_fanout.py --messages 2000 --latency-ms 50 --workers 64 --error-rate 0.05
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import fcm_sender
+from fcm_sender import FcmSender, build_message, build_topic_message
+
+
+def start_fake_fcm(latency_ms: float, error_rate: float):
+    """Fake FCM endpoint on a free local port; returns (server, url, stats)"""
+    stats = {'requests': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, like FCM
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(latency_ms / 1000)
+            with lock:
+                stats['requests'] += 1
+            roll = random.random()
+            if roll < error_rate:
+                with lock:
+                    stats['errors'] += 1
+                status = 429 if roll < error_rate / 2 else 503
+                body = json.dumps({'error': {'code': status, 'status': 'UNAVAILABLE',
+                                             'details': [{'errorCode': 'QUOTA_EXCEEDED' if status == 429 else 'UNAVAILABLE'}]}})
+            else:
+                status = 200
+                body = json.dumps({'name': f'projects/bench/messages/{stats["requests"]}'})
+            data = body.encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            if status == 429:
+                self.send_header('Retry-After', '0')
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/v1/projects/bench/messages:send', stats
+
+
+def sequential(url: str, payloads):
+    sent = 0
+    for payload in payloads:
+        response = requests.post(url, json=payload, headers={'Authorization': 'Bearer bench'})
+        sent += response.status_code == 200
+    return sent
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark FCM fan-out against a local fake endpoint')
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=20, help='fake FCM response latency')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='share of requests answered 429/503')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--skip-sequential', action='store_true')
+    args = parser.parse_args(argv)
+
+    # Keep retry pauses short so the benchmark measures the transport
+    fcm_sender.FCM_BACKOFF_BASE = 0.01
+    server, url, stats = start_fake_fcm(args.latency_ms, args.error_rate)
+    payloads = [build_message(f'bench-token-{i}', 'Peak time at 7:00 AM, expecting 42 passengers.')
+                for i in range(args.messages)]
+
+    print(f"{args.messages} messages, {args.latency_ms:g} ms server latency, {args.error_rate:.0%} 429/503")
+    print(f"{'path':<12} {'sent':>6} {'failed':>7} {'retries':>8} {'seconds':>8} {'msg/s':>8} {'requests':>9}")
+    if not args.skip_sequential:
+        started = time.perf_counter()
+        sent = sequential(url, payloads)
+        seconds = time.perf_counter() - started
+        print(f"{'sequential':<12} {sent:>6} {args.messages - sent:>7} {0:>8} {seconds:>8.2f} "
+              f"{args.messages / seconds:>8.1f} {args.messages:>9}")
+
+    sender = FcmSender(url, lambda: 'bench', max_workers=args.workers)
+    before = stats['requests']
+    _, report = sender.fan_out(payloads)
+    print(f"{'fan-out':<12} {report['sent']:>6} {report['failed']:>7} {report['retries']:>8} "
+          f"{report['duration_ms'] / 1000:>8.2f} {report['messages_per_s']:>8.1f} {stats['requests'] - before:>9}")
+
+    # Subscription is a one-off per token; later broadcasts only cost the publish
+    fcm_sender.FCM_IID_ENDPOINT = url.rsplit('/v1/', 1)[0] + '/iid/v1'
+    before = stats['requests']
+    started = time.perf_counter()
+    outcome = sender.manage_topic('forecasts', [p['message']['token'] for p in payloads])
+    published = sender.send(build_topic_message('forecasts', 'Peak time at 7:00 AM, expecting 42 passengers.'))
+    seconds = time.perf_counter() - started
+    reached = sum(1 for error in outcome.values() if error is None) if published['ok'] else 0
+    print(f"{'topic':<12} {reached:>6} {args.messages - reached:>7} {published['attempts'] - 1:>8} "
+          f"{seconds:>8.2f} {args.messages / seconds:>8.1f} {stats['requests'] - before:>9}")
+    server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
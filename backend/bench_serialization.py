@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the list endpoint serialization paths.
+
+Seeds a scratch SQLite database with predictions and users, then measures rows
+per second for /api/predictions and /api/users with:
+  orm      - the previous path: ORM objects, to_dict() per row, jsonify()
+  columns  - the current path: column-only SELECT, memoized date strings, fast encoder
+  endpoint - the real endpoint through the Flask test client
+
+Usage (from backend/):
+    python bench_serialization.py
+    python bench_serialization.py --predictions 20000 --users 5000 --repeat 5
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# Never benchmark against the real database file, dataset or model
+if 'DATABASE_URL' not in os.environ:
+    _scratch_dir = tempfile.mkdtemp(prefix='jeepni-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_scratch_dir, 'bench.db')}"
+    os.environ.setdefault('CHANGE_VERSION_DIR', os.path.join(_scratch_dir, 'versions'))
+    os.environ.setdefault('DATASET_FILE', os.path.join(_scratch_dir, 'passenger_demand_data.csv'))
+    os.environ.setdefault('FORECAST_MODEL_PATH', os.path.join(_scratch_dir, 'passenger_forecasting_model.pkl'))
+os.environ.setdefault('DISABLE_SCHEDULER', '1')
+
+from flask import jsonify
+
+from app import app, db
+from models import JeepneyStop, Prediction, UserNumber
+from prediction_queries import prediction_page, rows_to_dicts
+from serialization import dumps, IsoStrings, ORJSON_AVAILABLE
+
+
+def seed(predictions: int, users: int):
+    stop_ids = [s.id for s in JeepneyStop.query.all()]
+    have = db.session.query(Prediction).count()
+    start = date.today() - timedelta(days=predictions // max(len(stop_ids), 1) + 1)
+    rows = []
+    for i in range(max(predictions - have, 0)):
+        rows.append({
+            'stop_id': stop_ids[i % len(stop_ids)],
+            'prediction_date': start + timedelta(days=i // len(stop_ids)),
+            'predicted_passengers': 50 + i % 200,
+            'peak_hour': 7 + i % 12,
+            'confidence_score': 0.8,
+            'is_school_dismissal': i % 3 == 0,
+            'is_high_tide': i % 5 == 0,
+            'is_public_holiday': False,
+            'is_weekend': i % 7 in (5, 6),
+            'message': 'Expected passengers: moderate demand around the peak hour',
+            'is_sent': i % 2 == 0,
+            'created_at': datetime.utcnow(),
+        })
+    if rows:
+        db.session.execute(db.insert(Prediction), rows)
+    have = db.session.query(UserNumber).count()
+    users_rows = [
+        {'phone_number': f'+6391{i:08d}', 'is_active': True, 'created_at': datetime.utcnow()}
+        for i in range(have, users)
+    ]
+    if users_rows:
+        db.session.execute(db.insert(UserNumber), users_rows)
+    db.session.commit()
+
+
+def _timed(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+        db.session.remove()
+    return best
+
+
+def predictions_orm(limit):
+    predictions = (Prediction.query.order_by(Prediction.prediction_date.desc(), Prediction.id.asc())
+                   .limit(limit).all())
+    return jsonify([p.to_dict() for p in predictions]).get_data()
+
+
+def predictions_columns(limit):
+    rows, _ = prediction_page({}, limit)
+    return dumps(rows_to_dicts(rows))
+
+
+def users_orm():
+    users = UserNumber.query.filter_by(is_active=True).all()
+    return jsonify([u.to_dict() for u in users]).get_data()
+
+
+def users_columns():
+    rows = db.session.execute(
+        db.select(UserNumber.id, UserNumber.phone_number, UserNumber.is_active, UserNumber.created_at)
+        .where(UserNumber.is_active == True)  # noqa: E712
+    ).all()
+    iso = IsoStrings()
+    return dumps([
+        {'id': user_id, 'phone_number': phone_number, 'is_active': is_active, 'created_at': iso(created_at)}
+        for user_id, phone_number, is_active, created_at in rows
+    ])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark list endpoint serialization')
+    parser.add_argument('--predictions', type=int, default=10000, help='prediction rows to seed and serialize')
+    parser.add_argument('--users', type=int, default=5000, help='user rows to seed and serialize')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per case; the best is reported')
+    args = parser.parse_args(argv)
+
+    client = app.test_client()
+    with app.app_context():
+        seed(args.predictions, args.users)
+        # The API caps a page at 1000 rows; the direct cases serialize the whole set
+        n_predictions = db.session.query(Prediction).count()
+        n_users = db.session.query(UserNumber).filter_by(is_active=True).count()
+        page = min(n_predictions, 1000)
+
+        cases = [
+            ('predictions', 'orm', n_predictions, lambda: predictions_orm(n_predictions)),
+            ('predictions', 'columns', n_predictions, lambda: predictions_columns(n_predictions)),
+            ('predictions', 'endpoint', page, lambda: client.get(f'/api/predictions?limit={page}').get_data()),
+            ('users', 'orm', n_users, users_orm),
+            ('users', 'columns', n_users, users_columns),
+            ('users', 'endpoint', n_users, lambda: client.get(f'/api/users?_={time.time_ns()}').get_data()),
+        ]
+        print(f"encoder: {'orjson' if ORJSON_AVAILABLE else 'json (install orjson for the fast path)'}")
+        print(f"{'endpoint':<12} {'path':<9} {'rows':>7} {'best ms':>9} {'rows/s':>10}")
+        baseline = {}
+        for name, path, count, fn in cases:
+            seconds = _timed(fn, args.repeat)
+            rate = count / seconds if seconds else 0
+            note = ''
+            if path == 'orm':
+                baseline[name] = rate
+            elif path == 'columns' and baseline.get(name):
+                note = f'  x{rate / baseline[name]:.1f}'
+            print(f"{name:<12} {path:<9} {count:>7} {seconds * 1000:>9.1f} {rate:>10.0f}{note}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
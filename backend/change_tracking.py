@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import DATA_DIR
+from models import ChangeLog
+
+# One small stamp file per table, shared by every worker process on the host.
+# Reading a version is a stat() call (plus a tiny read when the file changed),
+# so conditional GETs can be answered without touching the database.
+VERSION_DIR = os.environ.get('CHANGE_VERSION_DIR', os.path.join(DATA_DIR, 'versions'))
+
+_lock = threading.Lock()
+_cache: Dict[str, Tuple[int, int]] = {}  # table -> (file mtime_ns, version)
+
+
+def _stamp_path(table: str) -> str:
+    return os.path.join(VERSION_DIR, f'{table}.version')
+
+
+def get_version(table: str) -> int:
+    """Current change version of a table (0 if it was never written through the ORM)"""
+    path = _stamp_path(table)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+    cached = _cache.get(table)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+    try:
+        with open(path, 'r', encoding='ascii') as handle:
+            version = int(handle.read().strip() or 0)
+    except (OSError, ValueError):
+        return cached[1] if cached else 0
+    _cache[table] = (mtime_ns, version)
+    return version
+
+
+def bump_versions(tables: Iterable[str]):
+    """Advance the version of each table. Versions are nanosecond stamps that only move
+    forward, so concurrent bumps from different workers still produce a new value."""
+    os.makedirs(VERSION_DIR, exist_ok=True)
+    with _lock:
+        for table in tables:
+            version = max(get_version(table) + 1, time.time_ns())
+            path = _stamp_path(table)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='ascii') as handle:
+                    handle.write(str(version))
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logging.error(f"Failed to bump change version for {table}: {str(e)}")
+
+
+def version_timestamp(version: int) -> datetime:
+    """The wall-clock time a version was stamped (used for Last-Modified)"""
+    if version <= 0:
+        return datetime(2000, 1, 1, tzinfo=timezone.utc)
+    return datetime.fromtimestamp(version / 1e9, tz=timezone.utc)
+
+
+# Tables whose row-level changes are written to ChangeLog for delta sync
+CHANGE_LOG_TABLES = {'jeepney_stop', 'prediction'}
+
+
+def log_row_changes(session, table: str, row_ids: Iterable[int], op: str):
+    """Append ChangeLog entries in the session's current transaction.
+    Used by bulk write paths that pass skip_change_log=True to their statements."""
+    rows = [{'table_name': table, 'row_id': row_id, 'op': op, 'changed_at': datetime.utcnow()} for row_id in row_ids]
+    if rows:
+        session.connection().execute(ChangeLog.__table__.insert(), rows)
+    _pending_tables(session).add(table)
+
+
+# ---- Session hooks: every committed ORM write bumps the tables it touched ----
+
+def _pending_tables(session) -> set:
+    return session.info.setdefault('changed_tables', set())
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed_tables(session, flush_context):
+    tables = _pending_tables(session)
+    log_rows = []
+    now = datetime.utcnow()
+    for objs, op in ((session.new, 'upsert'), (session.dirty, 'upsert'), (session.deleted, 'delete')):
+        for obj in objs:
+            table = getattr(obj, '__table__', None)
+            if table is None:
+                continue
+            if op == 'upsert' and obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            tables.add(table.name)
+            if table.name in CHANGE_LOG_TABLES:
+                log_rows.append({'table_name': table.name, 'row_id': obj.id, 'op': op, 'changed_at': now})
+    if log_rows:
+        # Core insert on the flush's own connection: same transaction, no nested flush
+        session.connection().execute(ChangeLog.__table__.insert(), log_rows)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_tables(orm_execute_state):
+    # Bulk insert()/update()/delete() statements and Query.delete()/update() skip the flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is None:
+            return
+        session = orm_execute_state.session
+        _pending_tables(session).add(table.name)
+        if table.name in CHANGE_LOG_TABLES and not orm_execute_state.execution_options.get('skip_change_log'):
+            # Affected row ids are unknown here; sync clients refetch the whole table
+            session.connection().execute(ChangeLog.__table__.insert(), [
+                {'table_name': table.name, 'row_id': None, 'op': 'reset', 'changed_at': datetime.utcnow()}
+            ])
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_committed_tables(session):
+    tables = session.info.pop('changed_tables', None)
+    if tables:
+        bump_versions(tables)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back_tables(session):
+    session.info.pop('changed_tables', None)
+
+
+__all__ = ['get_version', 'bump_versions', 'version_timestamp', 'log_row_changes', 'CHANGE_LOG_TABLES']
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression check for the hot endpoints.
+
+Calls each hot GET route through the Flask test client, captures the SELECT
+statements it sends, and runs EXPLAIN QUERY PLAN on them. Exits with status 1
+if any of them reads a watched table with a full table scan, i.e. a query that
+would slow down linearly as the prediction history grows. Run it after adding
+a query or changing an index.
+
+Usage (from backend/):
+    python check_query_plans.py            # against a scratch SQLite database
+    python check_query_plans.py --verbose  # print every plan
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import threading
+from datetime import date
+
+# Plans depend only on the schema; use a scratch database (and dataset/model paths) unless one is given
+if 'DATABASE_URL' not in os.environ:
+    _scratch_dir = tempfile.mkdtemp(prefix='jeepni-plans-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_scratch_dir, 'plans.db')}"
+    os.environ.setdefault('CHANGE_VERSION_DIR', os.path.join(_scratch_dir, 'versions'))
+    os.environ.setdefault('DATASET_FILE', os.path.join(_scratch_dir, 'passenger_demand_data.csv'))
+    os.environ.setdefault('FORECAST_MODEL_PATH', os.path.join(_scratch_dir, 'passenger_forecasting_model.pkl'))
+os.environ.setdefault('DISABLE_SCHEDULER', '1')
+
+from sqlalchemy import event
+
+from app import app, db
+from models import Prediction
+from response_cache import response_cache
+
+# Tables that grow without bound (or are filtered on every request)
+WATCHED_TABLES = {'prediction', 'user_number', 'model_metrics', 'change_log', 'job_run', 'stop_observation'}
+
+HOT_ROUTES = [
+    '/api/predictions/today',
+    '/api/predictions',
+    '/api/predictions?stop_id=1',
+    '/api/predictions?is_sent=false',
+    '/api/predictions/{today}',
+    '/api/predictions/curves',
+    '/api/dashboard/summary',
+    '/api/users',
+    '/api/model/metrics',
+    '/api/jobs/runs',
+    '/api/sync?since=1',
+]
+
+# "SCAN prediction" or "SCAN p" with no index; "SCAN x USING [COVERING] INDEX" walks an index in order
+_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?$')
+
+
+def _send_job_statement():
+    """The unsent-predictions lookup of the send job, which has no GET route"""
+    return Prediction.query.filter_by(prediction_date=date.today(), is_sent=False)
+
+
+def capture_statements():
+    """Run the hot routes and return the (route, sql, params) of every SELECT they issued"""
+    statements = []
+    current = {'route': None}
+    main_thread = threading.get_ident()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # Only the statements of the routes below, not background threads
+        if threading.get_ident() == main_thread and current['route'] and statement.lstrip().upper().startswith('SELECT'):
+            statements.append((current['route'], statement, parameters))
+
+    client = app.test_client()
+    # Cached responses would hide the queries behind them
+    response_cache.invalidate()
+    with app.app_context():
+        # GET requests read through the read-only engine, everything else through the primary one
+        engines = list(db.engines.values())
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            for route in HOT_ROUTES:
+                current['route'] = route.format(today=date.today().isoformat())
+                client.get(current['route'])
+            current['route'] = 'send job'
+            _send_job_statement().all()
+        finally:
+            for engine in engines:
+                event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return statements
+
+
+def find_full_scans(statements, verbose=False):
+    problems = []
+    seen = set()
+    with app.app_context():
+        with db.engine.connect() as conn:
+            for route, statement, parameters in statements:
+                if (route, statement) in seen:
+                    continue
+                seen.add((route, statement))
+                plan = [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+                if verbose:
+                    print(f"{route}\n  {' '.join(statement.split())}\n    " + '\n    '.join(plan))
+                for detail in plan:
+                    match = _FULL_SCAN.match(detail)
+                    if match and match.group(1) in WATCHED_TABLES:
+                        problems.append((route, detail, ' '.join(statement.split())))
+    return problems
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Fail if a hot route does a full table scan')
+    parser.add_argument('--verbose', action='store_true', help='print every captured statement and its plan')
+    args = parser.parse_args(argv)
+
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        print('The plan check reads SQLite EXPLAIN QUERY PLAN output; point DATABASE_URL at SQLite')
+        return 2
+    statements = capture_statements()
+    problems = find_full_scans(statements, args.verbose)
+    for route, detail, statement in problems:
+        print(f"FULL SCAN  {route}: {detail}\n    {statement}")
+    print(f"Checked {len(statements)} statements from {len(HOT_ROUTES) + 1} hot paths: "
+          f"{'OK' if not problems else f'{len(problems)} full table scan(s)'}")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
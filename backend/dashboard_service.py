@@ -0,0 +1,101 @@
+import threading
+from datetime import date
+from typing import Dict, Optional
+
+from sqlalchemy import case, func
+
+from app import db
+from models import Prediction, UserNumber, ModelMetrics
+from change_tracking import get_version
+from prediction_queries import MAX_PAGE_SIZE, rows_to_dicts, prediction_page
+
+# Tables the summary is built from; a committed write to any of them invalidates it
+SUMMARY_TABLES = ('prediction', 'jeepney_stop', 'user_number', 'model_metrics')
+
+_cache_lock = threading.Lock()
+_cache: Dict[date, tuple] = {}  # summary date -> (table versions, summary)
+
+
+def _summary_counts(summary_date: date) -> Dict:
+    """Counters and the active model metrics in a single SELECT"""
+    prediction_stats = (
+        db.select(
+            func.count(Prediction.id).label('predictions_count'),
+            func.coalesce(func.sum(case((Prediction.is_sent == True, 1), else_=0)), 0).label('sent_count'),  # noqa: E712
+            func.coalesce(func.sum(Prediction.predicted_passengers), 0).label('total_passengers'),
+        )
+        .where(Prediction.prediction_date == summary_date)
+        .subquery()
+    )
+    users_count = (
+        db.select(func.count(UserNumber.id))
+        .where(UserNumber.is_active == True)  # noqa: E712
+        .scalar_subquery()
+    )
+    # The aggregate subquery always yields exactly one row; the metrics are outer-joined onto it
+    stmt = (
+        db.select(
+            prediction_stats.c.predictions_count,
+            prediction_stats.c.sent_count,
+            prediction_stats.c.total_passengers,
+            users_count.label('users_count'),
+            ModelMetrics.id.label('metrics_id'),
+            ModelMetrics.model_version,
+            ModelMetrics.r2_score,
+            ModelMetrics.mae,
+            ModelMetrics.rmse,
+            ModelMetrics.training_date,
+        )
+        .select_from(prediction_stats)
+        .outerjoin(ModelMetrics, ModelMetrics.is_active == True)  # noqa: E712
+        .order_by(ModelMetrics.training_date.desc())
+        .limit(1)
+    )
+    row = db.session.execute(stmt).one()
+    metrics = None
+    if row.metrics_id is not None:
+        metrics = {
+            'id': row.metrics_id,
+            'model_version': row.model_version,
+            'r2_score': row.r2_score,
+            'mae': row.mae,
+            'rmse': row.rmse,
+            'training_date': row.training_date.isoformat() if row.training_date else None,
+            'is_active': True
+        }
+    return {
+        'predictions_count': row.predictions_count,
+        'sent_count': int(row.sent_count),
+        'total_passengers': int(row.total_passengers),
+        'users_count': row.users_count,
+        'model_metrics': metrics
+    }
+
+
+def build_dashboard_summary(summary_date: date) -> Dict:
+    """Compute the dashboard summary: one aggregate SELECT plus one joined predictions SELECT"""
+    summary = _summary_counts(summary_date)
+    rows, _ = prediction_page({}, MAX_PAGE_SIZE, prediction_date=summary_date)
+    summary['date'] = summary_date.isoformat()
+    summary['predictions'] = rows_to_dicts(rows)
+    return summary
+
+
+def get_dashboard_summary(summary_date: Optional[date] = None) -> Dict:
+    """Return the cached summary for the date, rebuilding it only after a write to one of SUMMARY_TABLES"""
+    summary_date = summary_date or date.today()
+    versions = tuple(get_version(t) for t in SUMMARY_TABLES)
+    with _cache_lock:
+        cached = _cache.get(summary_date)
+        if cached and cached[0] == versions:
+            return cached[1]
+    summary = build_dashboard_summary(summary_date)
+    with _cache_lock:
+        # Keep today's and a handful of recently viewed dates
+        if len(_cache) >= 32:
+            _cache.clear()
+        _cache[summary_date] = (versions, summary)
+    return summary
+
+
+__all__ = ['get_dashboard_summary', 'build_dashboard_summary', 'SUMMARY_TABLES']
@@ -0,0 +1,381 @@
+"""
+Queued, rate-paced delivery of prediction broadcasts.
+
+A broadcast is written to the database as one DeliveryTask per recipient before
+anything is sent. A worker holding the broadcast's lease claims the most urgent
+pending tasks in batches (stops whose peak hour comes soonest first), marks them
+'sending', sends them through the provider senders (which are paced by their
+token buckets), and records the outcome. Each committed batch is a checkpoint:
+an interrupted broadcast resumes from the remaining pending tasks, and tasks
+caught in flight become 'unconfirmed' instead of being sent a second time.
+Every run takes the lease under its own token and renews it while a batch is
+being sent, so no other run (in this process or another) can take it over.
+
+Bulk SMS jobs (enqueue_sms) use the same queue with one shared message; their
+tasks are claimed in larger batches and sent as concurrent 1000-number calls.
+"""
+
+import logging
+import os
+import socket
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from app import app, db
+from models import DeliveryBroadcast, DeliveryTask, Prediction, UserNumber
+from job_tracking import JobRunTracker
+from firebase_service import fcm_sender, group_messages, prune_dead_tokens
+from fcm_sender import build_message, dead_tokens
+from sms_sender import sms_sender, normalize_number, prepare_recipients, SEMAPHORE_MAX_RECIPIENTS, SMS_MAX_WORKERS
+
+DELIVERY_BATCH_SIZE = int(os.environ.get('DELIVERY_BATCH_SIZE', '200'))
+# A bulk SMS batch keeps every SMS worker busy with a full provider-sized chunk
+SMS_BATCH_SIZE = SEMAPHORE_MAX_RECIPIENTS * SMS_MAX_WORKERS
+# Rows per INSERT when queueing large audiences
+_INSERT_BATCH = 5000
+DELIVERY_LEASE_SECONDS = int(os.environ.get('DELIVERY_LEASE_SECONDS', '120'))
+# A sending batch renews its lease this often, well before it expires
+_LEASE_HEARTBEAT_SECONDS = DELIVERY_LEASE_SECONDS / 3
+# Send SMS to users without an FCM token instead of only logging the message (costs credits)
+DELIVERY_SMS_FALLBACK = os.environ.get('DELIVERY_SMS_FALLBACK', '0').lower() in ('1', 'true', 'yes')
+
+_WORKER_PREFIX = f'{socket.gethostname()}:{os.getpid()}'
+
+
+def hours_until_peak(peak_hour: Optional[int], now_hour: int) -> int:
+    """Task priority: hours until the stop's peak; peaks already past today go last"""
+    if peak_hour is None:
+        return 24
+    return (peak_hour - now_hour) % 24
+
+
+def enqueue_broadcast(predictions: List[Prediction], prediction_date: Optional[date] = None,
+                      now: Optional[datetime] = None) -> Optional[DeliveryBroadcast]:
+    """Queue one task per recipient of the given predictions; the caller commits.
+    Returns None when there are no active users.
+    """
+    users = UserNumber.query.filter_by(is_active=True).all()
+    if not users:
+        return None
+    now_hour = (now or datetime.now()).hour
+    peak = {p.stop_id: p.peak_hour for p in predictions}
+    sms_enabled = DELIVERY_SMS_FALLBACK and sms_sender.configured
+
+    broadcast = DeliveryBroadcast(prediction_date=prediction_date, status='queued', messages=[])
+    db.session.add(broadcast)
+    db.session.flush()
+
+    bodies, rows, seen = [], [], set()
+    for key, group in group_messages(users, predictions).items():
+        message_index = len(bodies)
+        bodies.append(group['body'])
+        priority = min((hours_until_peak(peak.get(stop_id), now_hour) for stop_id in key), default=24)
+        for user in group['users']:
+            number = normalize_number(user.phone_number) if sms_enabled and not user.firebase_token else None
+            if user.firebase_token:
+                channel, recipient = 'fcm', user.firebase_token
+            elif number:
+                channel, recipient = 'sms', number
+            else:
+                channel, recipient = 'log', user.phone_number
+            if (channel, recipient) in seen:
+                continue
+            seen.add((channel, recipient))
+            rows.append({'broadcast_id': broadcast.id, 'channel': channel, 'recipient': recipient,
+                         'user_id': user.id, 'message_index': message_index, 'priority': priority,
+                         'status': 'pending', 'attempts': 0})
+
+    broadcast.messages = bodies
+    broadcast.total = len(rows)
+    if rows:
+        db.session.execute(db.insert(DeliveryTask), rows)
+    return broadcast
+
+
+def enqueue_sms(numbers: Iterable, message: str, sender_name: Optional[str] = None,
+                include_active_users: bool = False) -> Dict:
+    """Queue a bulk SMS job for the given numbers, optionally plus every active user's number.
+    Numbers are normalized and deduplicated in one pass; the caller commits.
+    Returns {'broadcast', 'total', 'duplicates', 'invalid'}.
+    """
+    numbers = list(numbers)
+    if include_active_users:
+        numbers += db.session.execute(
+            db.select(UserNumber.phone_number).where(UserNumber.is_active.is_(True))
+        ).scalars().all()
+    valid, invalid, duplicates = prepare_recipients(numbers)
+
+    broadcast = DeliveryBroadcast(kind='sms', sender_name=sender_name, status='queued', messages=[message],
+                                  total=len(valid))
+    db.session.add(broadcast)
+    db.session.flush()
+    for i in range(0, len(valid), _INSERT_BATCH):
+        db.session.execute(db.insert(DeliveryTask), [
+            {'broadcast_id': broadcast.id, 'channel': 'sms', 'recipient': number, 'message_index': 0,
+             'priority': 0, 'status': 'pending', 'attempts': 0}
+            for number in valid[i:i + _INSERT_BATCH]
+        ])
+    return {'broadcast': broadcast, 'total': len(valid), 'duplicates': duplicates, 'invalid': invalid}
+
+
+def _lease_token() -> str:
+    """Lease owner for one run_broadcast call; never shared with another run"""
+    return f'{_WORKER_PREFIX}:{uuid.uuid4().hex}'
+
+
+def _claim(broadcast_id: int, owner: str) -> bool:
+    """Take the broadcast's lease; False when it is done or another run holds an unexpired lease"""
+    now = datetime.utcnow()
+    result = db.session.execute(
+        db.update(DeliveryBroadcast)
+        .where(DeliveryBroadcast.id == broadcast_id, DeliveryBroadcast.status != 'done',
+               db.or_(DeliveryBroadcast.lease_until.is_(None), DeliveryBroadcast.lease_until < now))
+        .values(lease_owner=owner, lease_until=now + timedelta(seconds=DELIVERY_LEASE_SECONDS))
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _renew(broadcast_id: int, owner: str) -> bool:
+    """Extend a lease this run holds; False once another run has taken it over"""
+    result = db.session.execute(
+        db.update(DeliveryBroadcast)
+        .where(DeliveryBroadcast.id == broadcast_id, DeliveryBroadcast.lease_owner == owner)
+        .values(lease_until=datetime.utcnow() + timedelta(seconds=DELIVERY_LEASE_SECONDS))
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _release(broadcast_id: int, owner: str):
+    db.session.execute(
+        db.update(DeliveryBroadcast)
+        .where(DeliveryBroadcast.id == broadcast_id, DeliveryBroadcast.lease_owner == owner)
+        .values(lease_owner=None, lease_until=None)
+    )
+    db.session.commit()
+
+
+class _LeaseHeartbeat:
+    """Renew a run's lease from a background thread while a batch is being sent,
+    however long provider retries and pacing keep it in flight"""
+
+    def __init__(self, broadcast_id: int, owner: str, interval: float = _LEASE_HEARTBEAT_SECONDS):
+        self.broadcast_id = broadcast_id
+        self.owner = owner
+        self.interval = interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'delivery-lease-{broadcast_id}', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                # Its own app context, so its own session
+                with app.app_context():
+                    if not _renew(self.broadcast_id, self.owner):
+                        self.lost = True
+                        return
+            except Exception as e:
+                logging.error(f"Error renewing lease of broadcast {self.broadcast_id}: {str(e)}")
+
+
+def _deliver_fcm(tasks, bodies, sender_name=None) -> Dict[int, Dict]:
+    payloads = [build_message(task.recipient, bodies[task.message_index]) for task in tasks]
+    results, _ = fcm_sender.fan_out(payloads)
+    prune_dead_tokens(dead_tokens(results))
+    outcome = {}
+    for task, r in zip(tasks, results):
+        if r['ok']:
+            outcome[task.id] = {'status': 'sent', 'error_code': None}
+        elif r['error_code'] == 'CIRCUIT_OPEN':
+            # Never attempted; back in the queue for the next run
+            outcome[task.id] = {'status': 'pending', 'error_code': r['error_code']}
+        else:
+            outcome[task.id] = {'status': 'failed', 'error_code': r['error_code']}
+    return outcome
+
+
+def _deliver_sms(tasks, bodies, sender_name=None) -> Dict[int, Dict]:
+    """One Semaphore call per message body and provider-sized chunk, SMS_MAX_WORKERS calls at a time"""
+    by_message = defaultdict(list)
+    for task in tasks:
+        by_message[task.message_index].append(task)
+    chunks = [(message_index, group[i:i + SEMAPHORE_MAX_RECIPIENTS])
+              for message_index, group in by_message.items()
+              for i in range(0, len(group), SEMAPHORE_MAX_RECIPIENTS)]
+
+    def send(chunk):
+        message_index, chunk_tasks = chunk
+        return chunk_tasks, sms_sender.send([task.recipient for task in chunk_tasks], bodies[message_index],
+                                            sender_name)
+
+    outcome = {}
+    with ThreadPoolExecutor(max_workers=min(SMS_MAX_WORKERS, len(chunks)) or 1,
+                            thread_name_prefix='sms-send') as pool:
+        for chunk_tasks, result in pool.map(send, chunks):
+            accepted, unconfirmed = set(result['accepted']), set(result['unconfirmed'])
+            deferred = set(result['deferred'])
+            for task in chunk_tasks:
+                if task.recipient in accepted:
+                    outcome[task.id] = {'status': 'sent', 'error_code': None}
+                elif task.recipient in deferred:
+                    outcome[task.id] = {'status': 'pending', 'error_code': result['error']}
+                elif task.recipient in unconfirmed:
+                    outcome[task.id] = {'status': 'unconfirmed', 'error_code': result['error']}
+                else:
+                    outcome[task.id] = {'status': 'failed', 'error_code': result['error'] or 'REJECTED'}
+    return outcome
+
+
+def _deliver_log(tasks, bodies, sender_name=None) -> Dict[int, Dict]:
+    for task in tasks:
+        # For demo purposes, log the message that would be sent
+        logging.info(f"Would send to {task.recipient}: {bodies[task.message_index]}")
+    return {task.id: {'status': 'sent', 'error_code': None} for task in tasks}
+
+
+_CHANNELS = {'fcm': _deliver_fcm, 'sms': _deliver_sms, 'log': _deliver_log}
+
+
+def broadcast_counts(broadcast_id: int) -> Dict[str, int]:
+    return dict(db.session.execute(
+        db.select(DeliveryTask.status, db.func.count())
+        .where(DeliveryTask.broadcast_id == broadcast_id).group_by(DeliveryTask.status)
+    ).all())
+
+
+def run_broadcast(broadcast_id: int, trigger: str = 'manual') -> Dict:
+    """Deliver a broadcast's pending tasks, most urgent first, checkpointing after every batch"""
+    try:
+        with app.app_context():
+            owner = _lease_token()
+            if not _claim(broadcast_id, owner):
+                return {'success': False, 'error': 'Broadcast is done or being delivered by another worker'}
+            broadcast = db.session.get(DeliveryBroadcast, broadcast_id)
+            bodies = broadcast.messages or []
+            sender_name = broadcast.sender_name
+            batch_size = SMS_BATCH_SIZE if broadcast.kind == 'sms' else DELIVERY_BATCH_SIZE
+            job_name = 'sms_job' if broadcast.kind == 'sms' else 'delivery'
+            with JobRunTracker(job_name, trigger=trigger, target_date=broadcast.prediction_date) as tracker:
+                # Tasks left 'sending' by an interrupted run may already have gone out
+                interrupted = db.session.execute(
+                    db.update(DeliveryTask)
+                    .where(DeliveryTask.broadcast_id == broadcast_id, DeliveryTask.status == 'sending')
+                    .values(status='unconfirmed')
+                ).rowcount
+                tracker.count('unconfirmed_after_interruption', interrupted or 0)
+                broadcast.status = 'running'
+                broadcast.started_at = broadcast.started_at or datetime.utcnow()
+                db.session.commit()
+
+                while True:
+                    tasks = db.session.execute(
+                        db.select(DeliveryTask.id, DeliveryTask.channel, DeliveryTask.recipient,
+                                  DeliveryTask.message_index)
+                        .where(DeliveryTask.broadcast_id == broadcast_id, DeliveryTask.status == 'pending')
+                        .order_by(DeliveryTask.priority, DeliveryTask.id)
+                        .limit(batch_size)
+                    ).all()
+                    if not tasks:
+                        break
+                    ids = [task.id for task in tasks]
+                    db.session.execute(
+                        db.update(DeliveryTask).where(DeliveryTask.id.in_(ids))
+                        .values(status='sending', attempts=DeliveryTask.attempts + 1)
+                    )
+                    db.session.commit()
+
+                    outcome = {}
+                    by_channel = defaultdict(list)
+                    for task in tasks:
+                        by_channel[task.channel].append(task)
+                    with _LeaseHeartbeat(broadcast_id, owner) as heartbeat:
+                        for channel, channel_tasks in by_channel.items():
+                            with tracker.phase(f'send_{channel}'):
+                                outcome.update(_CHANNELS[channel](channel_tasks, bodies, sender_name))
+                            tracker.count(f'{channel}_tasks', len(channel_tasks))
+
+                    now = datetime.utcnow()
+                    db.session.execute(db.update(DeliveryTask), [
+                        {'id': task_id, 'status': result['status'], 'error_code': result['error_code'],
+                         'sent_at': now if result['status'] == 'sent' else None}
+                        for task_id, result in outcome.items()
+                    ])
+                    db.session.commit()
+                    deferred = sum(1 for result in outcome.values() if result['status'] == 'pending')
+                    if deferred:
+                        # A provider's circuit is open: hand the broadcast back to the resume job
+                        tracker.count('deferred', deferred)
+                        _release(broadcast_id, owner)
+                        logging.warning(f"Broadcast {broadcast_id} paused: {deferred} sends deferred, provider unavailable")
+                        return {'success': False, 'broadcast_id': broadcast_id, 'deferred': deferred,
+                                'error': 'Provider unavailable; delivery resumes later'}
+                    # The outcomes above are recorded either way: they are what was actually sent
+                    if heartbeat.lost or not _renew(broadcast_id, owner):
+                        raise RuntimeError('Lost the delivery lease to another worker')
+
+                counts = broadcast_counts(broadcast_id)
+                for status, count in counts.items():
+                    tracker.count(status, count)
+                broadcast.status = 'done'
+                broadcast.finished_at = datetime.utcnow()
+                broadcast.lease_owner = None
+                broadcast.lease_until = None
+                db.session.commit()
+            logging.info(f"Broadcast {broadcast_id} delivered: {counts}")
+            return {'success': True, 'broadcast_id': broadcast_id, 'counts': counts, 'job_run_id': tracker.run_id}
+    except Exception as e:
+        logging.error(f"Error delivering broadcast {broadcast_id}: {str(e)}")
+        return {'success': False, 'error': str(e)}
+
+
+def start_broadcast(broadcast_id: int) -> threading.Thread:
+    """Deliver a broadcast in a background thread"""
+    thread = threading.Thread(target=run_broadcast, args=(broadcast_id,), name=f'delivery-{broadcast_id}',
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+def resume_broadcasts() -> List[int]:
+    """Continue broadcasts whose worker stopped (no lease or an expired one); run by the scheduler"""
+    with app.app_context():
+        ids = db.session.execute(
+            db.select(DeliveryBroadcast.id)
+            .where(DeliveryBroadcast.status != 'done',
+                   db.or_(DeliveryBroadcast.lease_until.is_(None), DeliveryBroadcast.lease_until < datetime.utcnow()))
+            .order_by(DeliveryBroadcast.id)
+        ).scalars().all()
+    resumed = []
+    for broadcast_id in ids:
+        if run_broadcast(broadcast_id, trigger='resume').get('success'):
+            resumed.append(broadcast_id)
+    return resumed
+
+
+def broadcast_status(broadcast: DeliveryBroadcast) -> Dict:
+    counts = broadcast_counts(broadcast.id)
+    channels = dict(db.session.execute(
+        db.select(DeliveryTask.channel, db.func.count())
+        .where(DeliveryTask.broadcast_id == broadcast.id).group_by(DeliveryTask.channel)
+    ).all())
+    return {**broadcast.to_dict(), 'counts': counts, 'channels': channels,
+            'progress': round(1 - counts.get('pending', 0) / broadcast.total, 4) if broadcast.total else 1.0}
+
+
+__all__ = ['enqueue_broadcast', 'enqueue_sms', 'run_broadcast', 'start_broadcast', 'resume_broadcasts', 'broadcast_status',
+           'hours_until_peak']
@@ -0,0 +1,121 @@
+from datetime import date
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+
+from app import db
+from models import ChangeLog, JeepneyStop, Prediction
+from serialization import IsoStrings
+
+# Changes returned per response; clients keep calling with the returned version while more=true
+SYNC_PAGE_SIZE = 5000
+
+# Row layouts of the sync payload; each row is an array in this field order
+SYNC_FIELDS = {
+    'stops': ['id', 'name', 'latitude', 'longitude', 'description'],
+    'predictions': ['id', 'stop_id', 'prediction_date', 'predicted_passengers', 'peak_hour',
+                    'confidence_score', 'is_school_dismissal', 'is_high_tide', 'is_public_holiday',
+                    'is_weekend', 'message', 'is_sent', 'sent_at'],
+}
+_TABLE_KEYS = {'jeepney_stop': 'stops', 'prediction': 'predictions'}
+
+
+def _stop_rows(ids: Optional[List[int]] = None) -> List[list]:
+    query = db.select(JeepneyStop.id, JeepneyStop.name, JeepneyStop.latitude, JeepneyStop.longitude,
+                      JeepneyStop.description).order_by(JeepneyStop.id)
+    if ids is not None:
+        query = query.where(JeepneyStop.id.in_(ids))
+    return [list(row) for row in db.session.execute(query).all()]
+
+
+def _prediction_rows(since_date: date, ids: Optional[List[int]] = None) -> List[list]:
+    query = db.select(
+        Prediction.id, Prediction.stop_id, Prediction.prediction_date, Prediction.predicted_passengers,
+        Prediction.peak_hour, Prediction.confidence_score, Prediction.is_school_dismissal,
+        Prediction.is_high_tide, Prediction.is_public_holiday, Prediction.is_weekend, Prediction.message,
+        Prediction.is_sent, Prediction.sent_at
+    ).where(Prediction.prediction_date >= since_date).order_by(Prediction.id)
+    if ids is not None:
+        query = query.where(Prediction.id.in_(ids))
+    iso = IsoStrings()
+    rows = []
+    for row in db.session.execute(query).all():
+        row = list(row)
+        row[2] = iso(row[2])
+        row[12] = iso(row[12])
+        rows.append(row)
+    return rows
+
+
+def _load_rows(key: str, since_date: date, ids: Optional[List[int]] = None) -> List[list]:
+    if key == 'stops':
+        return _stop_rows(ids)
+    return _prediction_rows(since_date, ids)
+
+
+def current_version() -> int:
+    """Highest change version ever issued, even when those log entries have been pruned"""
+    if db.session.get_bind(ChangeLog.__mapper__).dialect.name == 'sqlite':
+        issued = db.session.execute(
+            db.text("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+        ).scalar()
+        if issued is not None:
+            return issued
+    return db.session.query(func.max(ChangeLog.id)).scalar() or 0
+
+
+def build_sync_payload(since: int, since_date: date) -> Dict:
+    """Changes to stops and predictions (dated since_date or later) after change version `since`.
+    since=0 returns a full snapshot. Deleted rows are sent as bare ids.
+    """
+    payload = {'since': since, 'fields': SYNC_FIELDS, 'more': False, 'full': []}
+    oldest = db.session.query(func.min(ChangeLog.id)).scalar()
+    version = current_version()
+    # A new client, one older than the retained change log, or one holding a version
+    # this database never issued (e.g. after a restore) gets full tables
+    # (an empty log means everything up to `version` was pruned)
+    first_retained = oldest if oldest is not None else version + 1
+    if since <= 0 or since > version or since < first_retained - 1:
+        payload['version'] = version
+        payload['full'] = list(SYNC_FIELDS)
+        for key in SYNC_FIELDS:
+            payload[key] = {'upserted': _load_rows(key, since_date), 'deleted': []}
+        return payload
+
+    changes = db.session.execute(
+        db.select(ChangeLog.id, ChangeLog.table_name, ChangeLog.row_id, ChangeLog.op)
+        .where(ChangeLog.id > since)
+        .order_by(ChangeLog.id)
+        .limit(SYNC_PAGE_SIZE + 1)
+    ).all()
+    if len(changes) > SYNC_PAGE_SIZE:
+        changes = changes[:SYNC_PAGE_SIZE]
+        payload['more'] = True
+    payload['version'] = changes[-1].id if changes else since
+
+    # Collapse to the last operation per row
+    latest: Dict[str, Dict[int, str]] = {key: {} for key in SYNC_FIELDS}
+    reset = set()
+    for change in changes:
+        key = _TABLE_KEYS.get(change.table_name)
+        if key is None:
+            continue
+        if change.op == 'reset':
+            reset.add(key)
+        else:
+            latest[key][change.row_id] = change.op
+
+    for key in SYNC_FIELDS:
+        if key in reset:
+            payload['full'].append(key)
+            payload[key] = {'upserted': _load_rows(key, since_date), 'deleted': []}
+            continue
+        upsert_ids = [row_id for row_id, op in latest[key].items() if op == 'upsert']
+        # Rows deleted by a later transaction simply come back missing here; their delete entry follows
+        upserted = _load_rows(key, since_date, upsert_ids) if upsert_ids else []
+        deleted = [row_id for row_id, op in latest[key].items() if op == 'delete']
+        payload[key] = {'upserted': upserted, 'deleted': deleted}
+    return payload
+
+
+__all__ = ['build_sync_payload', 'current_version', 'SYNC_FIELDS', 'SYNC_PAGE_SIZE']
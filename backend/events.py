@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional, Set
+
+from app import app, db
+from models import JeepneyStop, Prediction
+from change_tracking import get_version
+
+# How often the watcher checks the table version stamps (a stat() per table, no DB access)
+EVENTS_POLL_SECONDS = float(os.environ.get('EVENTS_POLL_SECONDS', '1'))
+# Comment line sent to idle clients so proxies keep the connection open
+EVENTS_HEARTBEAT_SECONDS = int(os.environ.get('EVENTS_HEARTBEAT_SECONDS', '25'))
+
+TOPICS = ('predictions', 'stops')
+_TOPIC_TABLES = {
+    'predictions': ('prediction', 'jeepney_stop'),
+    'stops': ('jeepney_stop',),
+}
+
+# Compact row layouts sent in diffs; clients zip these with each row array
+PREDICTION_FIELDS = ['id', 'stop_id', 'stop_name', 'peak_hour', 'predicted_passengers', 'is_sent', 'message']
+STOP_FIELDS = ['id', 'name', 'latitude', 'longitude', 'description']
+
+
+class EventBroker:
+    """In-process pub/sub for server-sent events.
+
+    A single watcher thread per worker polls the change version stamps, which every
+    worker process shares, and when a table moves it computes one compact diff and
+    fans it out to the queues of the connected clients. Idle clients cost a blocked
+    queue read and a heartbeat line every EVENTS_HEARTBEAT_SECONDS.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[queue.Queue, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._snapshots: Dict[str, Dict] = {}
+        self._versions: Dict[str, tuple] = {}
+        self._snapshot_date: Optional[date] = None
+        self.published = 0
+
+    def subscribe(self, topics: Set[str]) -> queue.Queue:
+        q = queue.Queue(maxsize=100)
+        with self._lock:
+            self._subscribers[q] = topics
+            self._ensure_watcher()
+        return q
+
+    def unsubscribe(self, q: queue.Queue):
+        with self._lock:
+            self._subscribers.pop(q, None)
+
+    def publish(self, topic: str, payload: Dict):
+        message = format_event(topic, payload, event_id=payload.get('version'))
+        with self._lock:
+            subscribers = [q for q, topics in self._subscribers.items() if topic in topics]
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # A client that stopped reading gets a resync instead of an unbounded backlog
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait(format_event('resync', {'topic': topic}))
+        self.published += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'pid': os.getpid(), 'subscribers': len(self._subscribers), 'published': self.published}
+
+    # ---- watcher ----
+
+    def _ensure_watcher(self):
+        if self._watcher is None or not self._watcher.is_alive():
+            self._watcher = threading.Thread(target=self._watch, name='sse-watcher', daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        with app.app_context():
+            for topic in TOPICS:
+                self._versions[topic] = self._topic_version(topic)
+                self._snapshots[topic] = self._load_snapshot(topic)
+            while True:
+                time.sleep(EVENTS_POLL_SECONDS)
+                with self._lock:
+                    if not self._subscribers:
+                        continue
+                try:
+                    self._check_for_changes()
+                except Exception as e:
+                    logging.error(f"SSE watcher failed to compute diff: {str(e)}")
+                finally:
+                    db.session.remove()
+
+    def _topic_version(self, topic: str) -> tuple:
+        versions = tuple(get_version(t) for t in _TOPIC_TABLES[topic])
+        if topic == 'predictions':
+            return versions + (date.today(),)
+        return versions
+
+    def _check_for_changes(self):
+        for topic in TOPICS:
+            version = self._topic_version(topic)
+            if version == self._versions.get(topic):
+                continue
+            self._versions[topic] = version
+            snapshot = self._load_snapshot(topic)
+            diff = _diff(self._snapshots.get(topic, {}), snapshot)
+            self._snapshots[topic] = snapshot
+            if not diff['upserted'] and not diff['removed'] and not diff.get('reset'):
+                continue
+            diff['version'] = format(max(v for v in version if isinstance(v, int)), 'x')
+            if topic == 'predictions':
+                diff['date'] = self._snapshot_date.isoformat()
+                diff['fields'] = PREDICTION_FIELDS
+            else:
+                diff['fields'] = STOP_FIELDS
+            self.publish(topic, diff)
+
+    def _load_snapshot(self, topic: str) -> Dict:
+        if topic == 'predictions':
+            today = date.today()
+            rows = db.session.execute(
+                db.select(Prediction.id, Prediction.stop_id, JeepneyStop.name, Prediction.peak_hour,
+                          Prediction.predicted_passengers, Prediction.is_sent, Prediction.message)
+                .join(JeepneyStop, JeepneyStop.id == Prediction.stop_id)
+                .where(Prediction.prediction_date == today)
+            ).all()
+            snapshot = {row[0]: list(row) for row in rows}
+            if self._snapshot_date not in (None, today):
+                # Day rolled over: clients should drop yesterday's rows rather than diff them
+                snapshot['__reset__'] = True
+            self._snapshot_date = today
+            return snapshot
+        rows = db.session.execute(
+            db.select(JeepneyStop.id, JeepneyStop.name, JeepneyStop.latitude, JeepneyStop.longitude,
+                      JeepneyStop.description)
+        ).all()
+        return {row[0]: list(row) for row in rows}
+
+
+def _diff(old: Dict, new: Dict) -> Dict:
+    """Rows added or changed (as field arrays) and ids removed between two snapshots"""
+    reset = bool(new.pop('__reset__', False))
+    if reset:
+        return {'reset': True, 'upserted': list(new.values()), 'removed': []}
+    upserted = [row for key, row in new.items() if old.get(key) != row]
+    removed = [key for key in old if key not in new]
+    return {'upserted': upserted, 'removed': removed}
+
+
+def format_event(event: str, data: Dict, event_id: Optional[str] = None) -> str:
+    lines = []
+    if event_id:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, separators=(",", ":"))}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream_events(topics: Set[str]):
+    """Generator for an SSE response: a hello event, then diffs and heartbeats until the client leaves"""
+    q = broker.subscribe(topics)
+    try:
+        yield 'retry: 5000\n\n'
+        yield format_event('hello', {'topics': sorted(topics)})
+        while True:
+            try:
+                yield q.get(timeout=EVENTS_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+    finally:
+        broker.unsubscribe(q)
+
+
+broker = EventBroker()
+
+
+__all__ = ['broker', 'stream_events', 'format_event', 'TOPICS', 'PREDICTION_FIELDS', 'STOP_FIELDS']
@@ -0,0 +1,236 @@
+import logging
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from http_clients import CircuitOpenError, ServiceClient
+
+# Concurrent requests per fan-out, and the HTTP connection pool sized to match
+FCM_MAX_WORKERS = int(os.environ.get('FCM_MAX_WORKERS', '32'))
+FCM_CONNECT_TIMEOUT = float(os.environ.get('FCM_CONNECT_TIMEOUT', '3'))
+FCM_READ_TIMEOUT = float(os.environ.get('FCM_READ_TIMEOUT', '10'))
+# Retries after the first attempt for 429/5xx and connection errors
+FCM_MAX_RETRIES = int(os.environ.get('FCM_MAX_RETRIES', '3'))
+FCM_BACKOFF_BASE = float(os.environ.get('FCM_BACKOFF_BASE', '0.5'))
+FCM_BACKOFF_MAX = float(os.environ.get('FCM_BACKOFF_MAX', '20'))
+
+# Instance ID API used for batched topic (un)subscription, up to 1000 tokens per call
+FCM_IID_ENDPOINT = os.environ.get('FCM_IID_ENDPOINT', 'https://iid.googleapis.com/iid/v1')
+IID_BATCH_SIZE = 1000
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Error codes meaning the token will never work again (NOT_FOUND comes from the Instance ID API)
+DEAD_TOKEN_ERRORS = {'UNREGISTERED', 'NOT_FOUND'}
+# Also token-specific, but only when other messages of the same fan-out were accepted;
+# otherwise the payload itself was rejected
+INVALID_TOKEN_ERRORS = {'INVALID_ARGUMENT'}
+
+
+def _message(target: Dict, body: str, title: str) -> Dict:
+    return {
+        "message": {
+            **target,
+            "notification": {
+                "title": title,
+                "body": body
+            },
+            "data": {
+                "timestamp": datetime.now().isoformat(),
+                "type": "passenger_forecast"
+            }
+        }
+    }
+
+
+def build_message(token: str, body: str, title: str = "Jeepney Passenger Forecast") -> Dict:
+    """FCM HTTP v1 payload for one device token"""
+    return _message({"token": token}, body, title)
+
+
+def build_topic_message(topic: str, body: str, title: str = "Jeepney Passenger Forecast") -> Dict:
+    """FCM HTTP v1 payload published once to every device subscribed to a topic"""
+    return _message({"topic": topic}, body, title)
+
+
+def error_code(response) -> Optional[str]:
+    """FCM error code of a failed response (e.g. UNREGISTERED), falling back to the status name"""
+    try:
+        error = response.json().get('error', {})
+    except ValueError:
+        return None
+    for detail in error.get('details', []) or []:
+        if detail.get('errorCode'):
+            return detail['errorCode']
+    return error.get('status')
+
+
+def classify_error(code: Optional[str]) -> str:
+    """'dead_token', 'invalid' (dead only if others succeeded) or 'transient' (token kept for retry)"""
+    if code in DEAD_TOKEN_ERRORS:
+        return 'dead_token'
+    if code in INVALID_TOKEN_ERRORS:
+        return 'invalid'
+    return 'transient'
+
+
+def dead_tokens(results: List[Dict]) -> List[str]:
+    """Tokens of failed send results that should be dropped from the user table"""
+    any_ok = any(r['ok'] for r in results)
+    dead = []
+    for r in results:
+        if r['ok'] or not r.get('token'):
+            continue
+        kind = classify_error(r['error_code'])
+        if kind == 'dead_token' or (kind == 'invalid' and any_ok):
+            dead.append(r['token'])
+    return dead
+
+
+def _retry_delay(attempt: int, retry_after: Optional[str]) -> float:
+    """Honour Retry-After when given, otherwise exponential backoff with full jitter"""
+    if retry_after:
+        try:
+            return min(float(retry_after), FCM_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(FCM_BACKOFF_MAX, FCM_BACKOFF_BASE * (2 ** attempt)))
+
+
+class FcmSender:
+    """Sends FCM HTTP v1 messages over one pooled keep-alive session.
+
+    send() delivers a single message with timeouts and retries; fan_out() sends
+    many through a bounded thread pool; manage_topic() (un)subscribes tokens to a
+    topic in batched calls. Send results are dicts:
+    {'token', 'ok', 'status', 'error_code', 'attempts'} (token is the topic for topic messages).
+    """
+
+    def __init__(self, endpoint: str, token_provider: Callable[[], Optional[str]],
+                 max_workers: int = FCM_MAX_WORKERS, max_retries: int = FCM_MAX_RETRIES,
+                 timeout: Tuple[float, float] = (FCM_CONNECT_TIMEOUT, FCM_READ_TIMEOUT), limiter=None,
+                 client: Optional[ServiceClient] = None):
+        self.endpoint = endpoint
+        self.token_provider = token_provider
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        # Optional TokenBucket; every attempt, retries included, takes one token
+        self.limiter = limiter
+        # Connection pool, circuit breaker and latency metrics
+        self.client = client or ServiceClient('fcm', pool_size=max_workers, timeout=timeout)
+
+    @property
+    def session(self) -> requests.Session:
+        return self.client.session
+
+    def _post(self, url: str, payload: Dict, headers: Optional[Dict] = None, endpoint: Optional[str] = None) -> Dict:
+        """POST with the current access token, retrying 429/5xx and connection errors.
+        Returns {'ok', 'status', 'error_code', 'attempts', 'response'}; error_code is
+        CIRCUIT_OPEN, without retries, while FCM is failing fast.
+        """
+        result = {'ok': False, 'status': None, 'error_code': None, 'attempts': 0, 'response': None}
+        for attempt in range(self.max_retries + 1):
+            result['attempts'] = attempt + 1
+            access_token = self.token_provider()
+            if not access_token:
+                result['error_code'] = 'NO_ACCESS_TOKEN'
+                return result
+            retry_after = None
+            if self.limiter is not None:
+                self.limiter.acquire()
+            try:
+                response = self.client.post(url, endpoint=endpoint, json=payload, timeout=self.timeout, headers={
+                    'Authorization': f'Bearer {access_token}',
+                    'Content-Type': 'application/json',
+                    **(headers or {})
+                })
+                result['status'] = response.status_code
+                result['response'] = response
+                if response.status_code == 200:
+                    result['ok'] = True
+                    result['error_code'] = None
+                    return result
+                result['error_code'] = error_code(response)
+                if response.status_code not in _RETRY_STATUSES:
+                    return result
+                retry_after = response.headers.get('Retry-After')
+            except CircuitOpenError:
+                result['status'] = None
+                result['error_code'] = 'CIRCUIT_OPEN'
+                return result
+            except requests.RequestException as e:
+                result['status'] = None
+                result['error_code'] = type(e).__name__
+            if attempt < self.max_retries:
+                time.sleep(_retry_delay(attempt, retry_after))
+        return result
+
+    def send(self, payload: Dict) -> Dict:
+        message = payload.get('message', {})
+        result = self._post(self.endpoint, payload, endpoint='messages:send')
+        result.pop('response')
+        result['token'] = message.get('token') or message.get('topic')
+        return result
+
+    def manage_topic(self, topic: str, tokens: List[str], subscribe: bool = True) -> Dict[str, Optional[str]]:
+        """Subscribe (or unsubscribe) tokens to a topic in batches of IID_BATCH_SIZE.
+        Returns {token: None on success, else the error code}.
+        """
+        action = 'batchAdd' if subscribe else 'batchRemove'
+        outcome: Dict[str, Optional[str]] = {}
+        for i in range(0, len(tokens), IID_BATCH_SIZE):
+            batch = tokens[i:i + IID_BATCH_SIZE]
+            result = self._post(f'{FCM_IID_ENDPOINT}:{action}',
+                                {'to': f'/topics/{topic}', 'registration_tokens': batch},
+                                headers={'access_token_auth': 'true'}, endpoint=f'iid:{action}')
+            if not result['ok']:
+                logging.error(f"FCM {action} to {topic} failed for {len(batch)} tokens: "
+                              f"status {result['status']}, {result['error_code']}")
+                outcome.update({token: result['error_code'] or 'REQUEST_FAILED' for token in batch})
+                continue
+            try:
+                per_token = result['response'].json().get('results', [])
+            except ValueError:
+                per_token = []
+            for index, token in enumerate(batch):
+                entry = per_token[index] if index < len(per_token) else {}
+                outcome[token] = entry.get('error') if isinstance(entry, dict) else None
+        return outcome
+
+    def fan_out(self, payloads: Iterable[Dict]) -> Tuple[List[Dict], Dict]:
+        """Send every payload with at most max_workers in flight.
+        Returns (results in input order, summary report).
+        """
+        payloads = list(payloads)
+        started = time.perf_counter()
+        if not payloads:
+            return [], {'sent': 0, 'failed': 0, 'retries': 0, 'duration_ms': 0.0, 'messages_per_s': 0.0,
+                        'failures': {}}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(payloads)),
+                                thread_name_prefix='fcm-send') as pool:
+            results = list(pool.map(self.send, payloads))
+        duration = time.perf_counter() - started
+        sent = sum(1 for r in results if r['ok'])
+        report = {
+            'sent': sent,
+            'failed': len(results) - sent,
+            'retries': sum(r['attempts'] - 1 for r in results),
+            'duration_ms': round(duration * 1000, 1),
+            'messages_per_s': round(len(results) / duration, 1) if duration else None
+        }
+        failures = [r for r in results if not r['ok']]
+        report['failures'] = dict(Counter(classify_error(r['error_code']) for r in failures))
+        if failures:
+            logging.error(f"FCM fan-out: {len(failures)} of {len(results)} messages failed "
+                          f"(first: status {failures[0]['status']}, {failures[0]['error_code']})")
+        return results, report
+
+
+__all__ = ['FcmSender', 'build_message', 'build_topic_message', 'error_code', 'classify_error', 'dead_tokens']
@@ -1,8 +1,10 @@
 import os
 import json
 import logging
-import requests
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
 
 try:
@@ -15,13 +17,16 @@ except ImportError:
     FIREBASE_AVAILABLE = False
     logging.warning("Firebase Admin SDK not available. Install with: pip install firebase-admin google-auth")
 
-from models import UserNumber, Prediction
+from models import UserNumber, Prediction, StopSubscription, RetiredTopicToken
+from token_bucket import TokenBucket
+from http_clients import get_client
+from fcm_sender import FCM_MAX_WORKERS, FCM_CONNECT_TIMEOUT, FCM_READ_TIMEOUT, FcmSender, IID_BATCH_SIZE, build_message, build_topic_message, classify_error, dead_tokens
 
 # Firebase project configuration
 FIREBASE_PROJECT_ID = "jeepni-6b6fb"
 RTDB_URL = "https://jeepni-6b6fb-default-rtdb.firebaseio.com"
 FIREBASE_CREDENTIALS_PATH = "firebase_credentials.json"
-FCM_ENDPOINT = f"https://fcm.googleapis.com/v1/projects/{FIREBASE_PROJECT_ID}/messages:send"
+FCM_ENDPOINT = os.environ.get('FCM_ENDPOINT', f"https://fcm.googleapis.com/v1/projects/{FIREBASE_PROJECT_ID}/messages:send")
 
 def initialize_firebase():
     """Initialize Firebase Admin SDK with HTTP v1 API support"""
@@ -52,76 +57,353 @@ def initialize_firebase():
         logging.error(f"Failed to initialize Firebase: {e}")
         return False
 
+# Refresh the OAuth token this long before it expires; callers never get a token
+# with less time left than FCM_TOKEN_MIN_TTL_SECONDS
+FCM_TOKEN_REFRESH_AHEAD_SECONDS = int(os.environ.get('FCM_TOKEN_REFRESH_AHEAD_SECONDS', '600'))
+FCM_TOKEN_MIN_TTL_SECONDS = int(os.environ.get('FCM_TOKEN_MIN_TTL_SECONDS', '60'))
+FCM_SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+
+class AccessTokenCache:
+    """Thread-safe cache of the service account OAuth2 access token.
+
+    The credentials file is read once (again only if it changes on disk). A cached
+    token is returned until it is within FCM_TOKEN_REFRESH_AHEAD_SECONDS of expiry;
+    from then on one background thread refreshes it while callers keep using the
+    current token. Only when the token is missing or nearly expired do callers
+    wait, and then a single refresh is shared by all of them.
+    """
+
+    def __init__(self, credentials_path: str = FIREBASE_CREDENTIALS_PATH,
+                 refresh_ahead: int = FCM_TOKEN_REFRESH_AHEAD_SECONDS, min_ttl: int = FCM_TOKEN_MIN_TTL_SECONDS):
+        self.credentials_path = credentials_path
+        self.refresh_ahead = refresh_ahead
+        self.min_ttl = min_ttl
+        self._credentials = None
+        self._credentials_mtime = None
+        self._refresh_lock = threading.Lock()
+        self._background_lock = threading.Lock()
+        self._background = None
+        self._retry_at = 0.0
+        # Token endpoint calls go through the shared client: keep-alive pool, circuit breaker, metrics
+        self._session = get_client('google_oauth', pool_size=2).as_session(endpoint='token')
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.background_refreshes = 0
+        self.cache_hits = 0
+        self.last_refresh_ms = None
+        self.total_refresh_ms = 0.0
+
+    def _seconds_left(self) -> float:
+        creds = self._credentials
+        if creds is None or not creds.token or creds.expiry is None:
+            return 0.0
+        return (creds.expiry - datetime.utcnow()).total_seconds()
+
+    def get_token(self) -> Optional[str]:
+        left = self._seconds_left()
+        if left > self.min_ttl:
+            self.cache_hits += 1
+            if left < self.refresh_ahead:
+                self._refresh_in_background()
+            return self._credentials.token
+        with self._refresh_lock:
+            # Another caller may have refreshed while we waited for the lock;
+            # after a failed refresh, wait a few seconds before hitting the token endpoint again
+            if self._seconds_left() <= self.min_ttl and time.monotonic() >= self._retry_at:
+                self._refresh()
+            else:
+                self.cache_hits += 1
+            return self._credentials.token if self._seconds_left() > 0 else None
+
+    def _refresh_in_background(self):
+        if self._background is not None and self._background.is_alive():
+            return
+        with self._background_lock:
+            if self._background is not None and self._background.is_alive():
+                return
+            self._background = threading.Thread(target=self._background_refresh, name='fcm-token-refresh', daemon=True)
+            self._background.start()
+
+    def _background_refresh(self):
+        with self._refresh_lock:
+            if self._seconds_left() < self.refresh_ahead:
+                self.background_refreshes += 1
+                self._refresh()
+
+    def _load_credentials(self):
+        mtime = os.path.getmtime(self.credentials_path)
+        if self._credentials is None or mtime != self._credentials_mtime:
+            self._credentials = service_account.Credentials.from_service_account_file(
+                self.credentials_path, scopes=FCM_SCOPES
+            )
+            self._credentials_mtime = mtime
+        return self._credentials
+
+    def _refresh(self):
+        """Caller holds _refresh_lock"""
+        started = time.perf_counter()
+        try:
+            if not FIREBASE_AVAILABLE:
+                raise RuntimeError('google-auth is not installed')
+            if not os.path.exists(self.credentials_path):
+                raise FileNotFoundError(f'Firebase credentials file not found: {self.credentials_path}')
+            self._load_credentials().refresh(Request(session=self._session))
+            self.refreshes += 1
+        except Exception as e:
+            self.refresh_failures += 1
+            self._retry_at = time.monotonic() + 5
+            logging.error(f"Error getting access token: {e}")
+        finally:
+            self.last_refresh_ms = round((time.perf_counter() - started) * 1000, 1)
+            self.total_refresh_ms += self.last_refresh_ms
+
+    def stats(self) -> Dict[str, Any]:
+        attempts = self.refreshes + self.refresh_failures
+        return {
+            'refreshes': self.refreshes,
+            'background_refreshes': self.background_refreshes,
+            'refresh_failures': self.refresh_failures,
+            'cache_hits': self.cache_hits,
+            'last_refresh_ms': self.last_refresh_ms,
+            'avg_refresh_ms': round(self.total_refresh_ms / attempts, 1) if attempts else None,
+            'expires_in_seconds': max(int(self._seconds_left()), 0)
+        }
+
+
+access_token_cache = AccessTokenCache()
+
+
 def get_access_token():
-    """Get OAuth2 access token for Firebase HTTP v1 API"""
+    """Get OAuth2 access token for Firebase HTTP v1 API (cached, see AccessTokenCache)"""
+    return access_token_cache.get_token()
+
+# FCM allows 600,000 messages per minute per project; stay well below it by default
+FCM_RATE_PER_SECOND = float(os.environ.get('FCM_RATE_PER_SECOND', '1000'))
+fcm_rate_limiter = TokenBucket(FCM_RATE_PER_SECOND, float(os.environ.get('FCM_BURST', '0')) or None)
+
+# Pooled, retrying sender shared by single sends and broadcasts
+fcm_sender = FcmSender(FCM_ENDPOINT, get_access_token, limiter=fcm_rate_limiter,
+                       client=get_client('fcm', pool_size=FCM_MAX_WORKERS,
+                                         timeout=(FCM_CONNECT_TIMEOUT, FCM_READ_TIMEOUT)))
+
+# 'token' sends the broadcast to every device token; 'topic' publishes it once to
+# FCM_BROADCAST_TOPIC, which registered tokens are subscribed to in batches
+FCM_DELIVERY_MODE = os.environ.get('FCM_DELIVERY_MODE', 'token').lower()
+FCM_BROADCAST_TOPIC = os.environ.get('FCM_BROADCAST_TOPIC', 'forecasts')
+# Also publish each stop's prediction to its stop_<id> topic (clients subscribe to those themselves)
+FCM_STOP_TOPICS = os.environ.get('FCM_STOP_TOPICS', '0').lower() in ('1', 'true', 'yes')
+# Registrations within this many seconds share one subscription call
+FCM_TOPIC_SUBSCRIBE_DELAY = float(os.environ.get('FCM_TOPIC_SUBSCRIBE_DELAY', '5'))
+
+_subscribe_timer = None
+_subscribe_lock = threading.Lock()
+
+# Dead tokens cleared by this worker; each one is a request no longer made on every broadcast
+token_pruning_stats = {'dead_tokens_pruned': 0, 'prune_runs': 0}
+
+
+def prune_dead_tokens(tokens: List[str]) -> int:
+    """Clear dead FCM tokens from user_number in batches; the users themselves stay active.
+    Rows are matched by token value, so a user who has registered a new token keeps it.
+    """
+    tokens = list(set(tokens))
+    if not tokens:
+        return 0
+    from app import db
+    cleared = 0
+    for i in range(0, len(tokens), 500):
+        cleared += db.session.execute(
+            db.update(UserNumber).where(UserNumber.firebase_token.in_(tokens[i:i + 500]))
+            .values(firebase_token=None, topic_subscribed_at=None)
+        ).rowcount or 0
+    db.session.commit()
+    token_pruning_stats['dead_tokens_pruned'] += cleared
+    token_pruning_stats['prune_runs'] += 1
+    logging.warning(f"Cleared {cleared} unregistered or invalid FCM tokens")
+    return cleared
+
+
+def stop_topic(stop_id: int) -> str:
+    return f'stop_{stop_id}'
+
+
+def subscribe_pending_tokens() -> Dict[str, int]:
+    """Subscribe active tokens that are not on the broadcast topic yet, IID_BATCH_SIZE per call"""
+    from app import db
+    pending = db.session.execute(
+        db.select(UserNumber.id, UserNumber.firebase_token)
+        .where(UserNumber.is_active.is_(True), UserNumber.firebase_token.isnot(None),
+               UserNumber.firebase_token != '', UserNumber.topic_subscribed_at.is_(None))
+    ).all()
+    if not pending:
+        return {'subscribed': 0, 'failed': 0, 'requests': 0, 'dead_tokens_pruned': 0}
+    tokens = list({token for _, token in pending})
+    outcome = fcm_sender.manage_topic(FCM_BROADCAST_TOPIC, tokens)
+    subscribed = [user_id for user_id, token in pending if outcome.get(token, 'MISSING') is None]
+    now = datetime.utcnow()
+    for i in range(0, len(subscribed), 500):
+        db.session.execute(db.update(UserNumber).where(UserNumber.id.in_(subscribed[i:i + 500]))
+                           .values(topic_subscribed_at=now))
+    db.session.commit()
+    failed = len(pending) - len(subscribed)
+    if failed:
+        logging.error(f"{failed} of {len(pending)} tokens could not be subscribed to topic {FCM_BROADCAST_TOPIC}")
+    pruned = prune_dead_tokens(dead_tokens([
+        {'token': token, 'ok': error is None, 'error_code': error} for token, error in outcome.items()
+    ]))
+    return {'subscribed': len(subscribed), 'failed': failed, 'requests': -(-len(tokens) // IID_BATCH_SIZE),
+            'dead_tokens_pruned': pruned}
+
+
+def retire_topic_token(user: UserNumber):
+    """Queue the user's token for removal from the broadcast topic (when it is subscribed).
+    Call before replacing or deactivating the token; the caller commits.
+    """
+    from app import db
+    if not user.firebase_token or user.topic_subscribed_at is None:
+        return
+    exists = db.session.execute(
+        db.select(RetiredTopicToken.id).where(RetiredTopicToken.token == user.firebase_token)
+    ).first()
+    if exists is None:
+        db.session.add(RetiredTopicToken(token=user.firebase_token))
+    user.topic_subscribed_at = None
+
+
+def unsubscribe_retired_tokens() -> Dict[str, int]:
+    """Remove replaced and deactivated tokens from the broadcast topic, IID_BATCH_SIZE per call.
+    Tokens an active user holds again are kept subscribed; transient failures are retried next run.
+    """
+    from app import db
+    retired = db.session.execute(db.select(RetiredTopicToken.token)).scalars().all()
+    if not retired:
+        return {'unsubscribed': 0, 'failed': 0, 'requests': 0}
+    in_use = set()
+    for i in range(0, len(retired), 500):
+        in_use.update(db.session.execute(
+            db.select(UserNumber.firebase_token)
+            .where(UserNumber.is_active.is_(True), UserNumber.firebase_token.in_(retired[i:i + 500]))
+        ).scalars().all())
+    tokens = [token for token in retired if token not in in_use]
+    outcome = fcm_sender.manage_topic(FCM_BROADCAST_TOPIC, tokens, subscribe=False) if tokens else {}
+    # Dead tokens no longer receive anything, so they count as removed too
+    done = [token for token in retired
+            if token in in_use or outcome.get(token, 'MISSING') is None
+            or classify_error(outcome.get(token)) != 'transient']
+    for i in range(0, len(done), 500):
+        db.session.execute(db.delete(RetiredTopicToken).where(RetiredTopicToken.token.in_(done[i:i + 500])))
+    db.session.commit()
+    failed = len(retired) - len(done)
+    if failed:
+        logging.error(f"{failed} retired tokens could not be unsubscribed from topic {FCM_BROADCAST_TOPIC}; retrying later")
+    return {'unsubscribed': len(done) - len(in_use), 'failed': failed,
+            'requests': -(-len(tokens) // IID_BATCH_SIZE)}
+
+
+def _subscribe_pending_in_background():
+    from app import app
     try:
-        if not os.path.exists(FIREBASE_CREDENTIALS_PATH):
-            logging.error("Firebase credentials file not found")
-            return None
-            
-        # Load service account credentials
-        credentials_info = service_account.Credentials.from_service_account_file(
-            FIREBASE_CREDENTIALS_PATH,
-            scopes=['https://www.googleapis.com/auth/cloud-platform']
-        )
-        
-        # Refresh token to get access token
-        request = Request()
-        credentials_info.refresh(request)
-        
-        return credentials_info.token
-        
+        with app.app_context():
+            unsubscribe_retired_tokens()
+            subscribe_pending_tokens()
     except Exception as e:
-        logging.error(f"Error getting access token: {e}")
-        return None
+        logging.error(f"Error subscribing tokens to topic {FCM_BROADCAST_TOPIC}: {str(e)}")
+
+
+def schedule_topic_subscription():
+    """Subscribe newly registered tokens (and unsubscribe retired ones) after
+    FCM_TOPIC_SUBSCRIBE_DELAY, batched into one call each. Tokens still pending at
+    the next broadcast are handled before it is published.
+    """
+    global _subscribe_timer
+    with _subscribe_lock:
+        if _subscribe_timer is not None and _subscribe_timer.is_alive():
+            return
+        _subscribe_timer = threading.Timer(FCM_TOPIC_SUBSCRIBE_DELAY, _subscribe_pending_in_background)
+        _subscribe_timer.daemon = True
+        _subscribe_timer.start()
+
 
 def send_message_to_token(token: str, message: str, title: str = "Jeepney Passenger Forecast") -> bool:
     """Send a message to a specific Firebase token using HTTP v1 API"""
     try:
-        # Get access token
-        access_token = get_access_token()
-        if not access_token:
-            logging.error("Failed to get access token")
-            return False
-        
-        # Prepare headers
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        # Prepare message payload for HTTP v1 API
-        payload = {
-            "message": {
-                "token": token,
-                "notification": {
-                    "title": title,
-                    "body": message
-                },
-                "data": {
-                    "timestamp": datetime.now().isoformat(),
-                    "type": "passenger_forecast"
-                }
-            }
-        }
-        
-        # Send HTTP POST request
-        response = requests.post(FCM_ENDPOINT, headers=headers, json=payload)
-        
-        if response.status_code == 200:
-            logging.info(f"Message sent successfully via HTTP v1 API: {response.json()}")
+        result = fcm_sender.send(build_message(token, message, title))
+        if result['ok']:
+            logging.info("Message sent successfully via HTTP v1 API")
             return True
-        else:
-            logging.error(f"Failed to send message. Status: {response.status_code}, Response: {response.text}")
-            return False
+        logging.error(f"Failed to send message. Status: {result['status']}, Error: {result['error_code']}")
+        prune_dead_tokens(dead_tokens([result]))
+        return False
         
     except Exception as e:
         logging.error(f"Error sending message to token {token}: {str(e)}")
         return False
 
+# Stops per notification; longer messages risk the FCM payload limit
+MAX_STOPS_PER_MESSAGE = 5
+
+
+def stop_subscribers(stop_ids: List[int]) -> Dict[int, List[int]]:
+    """Inverted index stop_id -> ids of the active users subscribed to that stop"""
+    from app import db
+    index = defaultdict(list)
+    if not stop_ids:
+        return index
+    rows = db.session.execute(
+        db.select(StopSubscription.stop_id, StopSubscription.user_id)
+        .join(UserNumber, UserNumber.id == StopSubscription.user_id)
+        .where(StopSubscription.stop_id.in_(stop_ids), UserNumber.is_active.is_(True))
+    ).all()
+    for stop_id, user_id in rows:
+        index[stop_id].append(user_id)
+    return index
+
+
+def group_messages(users: List[UserNumber], predictions: List[Prediction]) -> Dict[Tuple[int, ...], Dict]:
+    """Group users by the stops their notification covers: {stop ids: {'body', 'users'}}.
+    Subscribed users get their stops that have a prediction (none, if no stop matches);
+    users without subscriptions get the first MAX_STOPS_PER_MESSAGE predictions.
+    Each distinct body is built once and shared by its group.
+    """
+    from app import db
+    by_stop = {}
+    for prediction in predictions:
+        by_stop.setdefault(prediction.stop_id, prediction)
+    user_stops = defaultdict(list)
+    for stop_id, user_ids in stop_subscribers(list(by_stop)).items():
+        for user_id in user_ids:
+            user_stops[user_id].append(stop_id)
+    subscribed = set(db.session.execute(db.select(StopSubscription.user_id).distinct()).scalars())
+    order = {stop_id: i for i, stop_id in enumerate(by_stop)}
+    default_key = tuple(by_stop)[:MAX_STOPS_PER_MESSAGE]
+
+    groups = {}
+    for user in users:
+        if user.id in user_stops:
+            key = tuple(sorted(user_stops[user.id], key=order.get)[:MAX_STOPS_PER_MESSAGE])
+        elif user.id in subscribed:
+            continue
+        else:
+            key = default_key
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {'body': "\n\n".join(by_stop[stop_id].message for stop_id in key), 'users': []}
+        group['users'].append(user)
+    return groups
+
+
 def send_predictions_to_all_users(predictions: List[Prediction]) -> Dict[str, Any]:
-    """Send predictions to all registered users using HTTP v1 API"""
+    """Send predictions to all registered users using HTTP v1 API.
+    Messages go out concurrently through fcm_sender; see FCM_MAX_WORKERS.
+    Each user gets only the stops they subscribe to (see group_messages). With
+    FCM_DELIVERY_MODE=topic one message per topic is published instead of one per token.
+    """
     try:
+        topic_mode = FCM_DELIVERY_MODE == 'topic'
+        unsubscription = unsubscribe_retired_tokens() if topic_mode else None
+        subscription = subscribe_pending_tokens() if topic_mode else None
+
         # Get all active users
         users = UserNumber.query.filter_by(is_active=True).all()
         
@@ -130,37 +412,70 @@ def send_predictions_to_all_users(predictions: List[Prediction]) -> Dict[str, An
         
         # Create consolidated message from predictions
         message_lines = []
-        for prediction in predictions[:5]:  # Limit to 5 predictions to avoid message length limits
+        for prediction in predictions[:MAX_STOPS_PER_MESSAGE]:  # Limit predictions to avoid message length limits
             message_lines.append(prediction.message)
         
         full_message = "\n\n".join(message_lines)
         
-        successful_sends = 0
-        failed_sends = 0
+        with_token = sum(1 for user in users if user.firebase_token)
+        # The topic broadcast reaches every subscriber with the same content
+        groups = {None: {'body': full_message, 'users': users}} if topic_mode else group_messages(users, predictions)
         
-        for user in users:
-            try:
+        payloads = []
+        no_token = 0
+        subscribers = 0
+        message_bytes = 0
+        for group in groups.values():
+            body = group['body']
+            body_bytes = len(body.encode('utf-8'))
+            for user in group['users']:
                 if user.firebase_token:
-                    success = send_message_to_token(user.firebase_token, full_message)
-                    if success:
-                        successful_sends += 1
-                    else:
-                        failed_sends += 1
+                    if not topic_mode:
+                        payloads.append(build_message(user.firebase_token, body))
+                        message_bytes += body_bytes
+                    elif user.topic_subscribed_at is not None:
+                        subscribers += 1
                 else:
-                    # For demo purposes, log the message that would be sent
-                    logging.info(f"Would send to {user.phone_number}: {full_message}")
-                    successful_sends += 1
-                    
-            except Exception as e:
-                logging.error(f"Error sending to user {user.phone_number}: {str(e)}")
-                failed_sends += 1
+                    # Not reachable until the user registers a token; not a successful send
+                    logging.info(f"No token for {user.phone_number}, skipping")
+                    no_token += 1
+        
+        if topic_mode:
+            payloads = [build_topic_message(FCM_BROADCAST_TOPIC, full_message)]
+            if FCM_STOP_TOPICS:
+                payloads += [build_topic_message(stop_topic(p.stop_id), p.message) for p in predictions]
+        
+        results, report = fcm_sender.fan_out(payloads)
+        report['mode'] = FCM_DELIVERY_MODE
+        if topic_mode:
+            # Every subscriber is reached by the one broadcast publish
+            reached = subscribers if results[0]['ok'] else 0
+            successful_sends = reached
+            failed_sends = subscribers - reached + subscription['failed']
+            report['topic_subscription'] = subscription
+            report['topic_unsubscription'] = unsubscription
+            report['requests_saved_by_topic'] = max(subscribers - len(payloads), 0)
+        else:
+            successful_sends = report['sent']
+            failed_sends = report['failed']
+            # Transient failures keep their token for the next broadcast
+            pruned = prune_dead_tokens(dead_tokens(results))
+            report['dead_tokens_pruned'] = pruned
+            report['requests_saved_per_broadcast'] = pruned
+            report['distinct_messages'] = len(groups)
+            report['users_without_matching_stops'] = len(users) - sum(len(g['users']) for g in groups.values())
+            report['message_bytes'] = message_bytes
+            # Compared with sending everyone the same first predictions
+            report['message_bytes_saved'] = with_token * len(full_message.encode('utf-8')) - message_bytes
         
         return {
             'success': True,
             'users_count': len(users),
             'successful_sends': successful_sends,
             'failed_sends': failed_sends,
-            'message': f'Sent to {successful_sends} users, {failed_sends} failed'
+            'no_token': no_token,
+            'delivery': report,
+            'message': f'Sent to {successful_sends} users, {failed_sends} failed, {no_token} without a token'
         }
         
     except Exception as e:
@@ -173,6 +488,9 @@ def register_user_token(phone_number: str, firebase_token: str) -> bool:
         user = UserNumber.query.filter_by(phone_number=phone_number).first()
         
         if user:
+            if user.firebase_token != firebase_token:
+                # The old token would keep receiving topic broadcasts
+                retire_topic_token(user)
             user.firebase_token = firebase_token
         else:
             user = UserNumber(phone_number=phone_number, firebase_token=firebase_token)
@@ -182,6 +500,9 @@ def register_user_token(phone_number: str, firebase_token: str) -> bool:
         from app import db
         db.session.commit()
         
+        if FCM_DELIVERY_MODE == 'topic' and user.topic_subscribed_at is None:
+            schedule_topic_subscription()
+        
         logging.info(f"Firebase token updated for user {phone_number}")
         return True
         
@@ -190,19 +511,36 @@ def register_user_token(phone_number: str, firebase_token: str) -> bool:
         return False
 
 # Export functions
-__all__ = ['initialize_firebase', 'send_message_to_token', 'send_predictions_to_all_users', 'register_user_token', 'write_user_profile', 'write_role_profile', 'create_user_and_profiles', 'update_user_fields']
+__all__ = ['initialize_firebase', 'get_access_token', 'access_token_cache', 'send_message_to_token', 'send_predictions_to_all_users', 'register_user_token', 'subscribe_pending_tokens', 'retire_topic_token', 'unsubscribe_retired_tokens', 'schedule_topic_subscription', 'prune_dead_tokens', 'group_messages', 'profile_paths', 'write_profiles', 'build_profile', 'create_user_and_profiles', 'update_user_fields']
 
 # ---- Admin RTDB helpers ----
-def write_user_profile(uid: str, profile: dict) -> None:
-    if not initialize_firebase():
-        raise RuntimeError('Firebase admin not initialized')
-    admin_db.reference(f'all_users/{uid}').set(profile)
+def profile_paths(role: str, uid: str, profile: dict) -> dict:
+    """Multi-path update entries that replace both the all_users and the role node of a user"""
+    path = 'drivers' if role == 'driver' else 'passengers'
+    return {f'all_users/{uid}': profile, f'{path}/{uid}': profile}
 
-def write_role_profile(role: str, uid: str, profile: dict) -> None:
+def write_profiles(updates: dict) -> None:
+    """Apply profile_paths() entries of one or more users in a single atomic RTDB round trip"""
     if not initialize_firebase():
         raise RuntimeError('Firebase admin not initialized')
-    path = 'drivers' if role == 'driver' else 'passengers'
-    admin_db.reference(f'{path}/{uid}').set(profile)
+    if updates:
+        admin_db.reference('/').update(updates)
+
+def build_profile(uid: str, name: str, email: str, role: str, extra: dict | None = None) -> dict:
+    extra = extra or {}
+    profile = {
+        'uid': uid,
+        'name': name,
+        'email': email,
+        'role': role,
+        'created_at': extra.get('created_at') or (datetime.utcnow().isoformat()),
+        'created_ts': extra.get('created_ts') or int(datetime.utcnow().timestamp() * 1000),
+    }
+    # include optional fields
+    for k in ['phone','notes','route','plate']:
+        if k in extra:
+            profile[k] = extra[k]
+    return profile
 
 def create_user_and_profiles(*, name: str, email: str, password: str | None, role: str, extra: dict | None = None) -> dict:
     """Create or fetch an Auth user, then upsert RTDB profiles.
@@ -210,7 +548,6 @@ def create_user_and_profiles(*, name: str, email: str, password: str | None, rol
     """
     if not initialize_firebase():
         raise RuntimeError('Firebase admin not initialized')
-    extra = extra or {}
     # 1) Create or get user by email
     created = False
     try:
@@ -221,22 +558,8 @@ def create_user_and_profiles(*, name: str, email: str, password: str | None, rol
         created = True
 
     uid = user.uid
-    # 2) Build profile and upsert to DB
-    profile = {
-        'uid': uid,
-        'name': name,
-        'email': email,
-        'role': role,
-        'created_at': extra.get('created_at') or (datetime.utcnow().isoformat()),
-        'created_ts': extra.get('created_ts') or int(datetime.utcnow().timestamp() * 1000),
-    }
-    # include optional fields
-    for k in ['phone','notes','route','plate']:
-        if k in extra:
-            profile[k] = extra[k]
-
-    write_user_profile(uid, profile)
-    write_role_profile(role, uid, profile)
+    # 2) Build profile and upsert both nodes in one multi-path write
+    write_profiles(profile_paths(role, uid, build_profile(uid, name, email, role, extra)))
     return {'uid': uid, 'created': created}
 
 def update_user_fields(uid: str, fields: dict) -> None:
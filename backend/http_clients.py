@@ -0,0 +1,255 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Consecutive failures (5xx, timeouts, connection errors) that open a provider's circuit
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+# Seconds an open circuit fails fast before one trial request is let through
+CIRCUIT_RESET_SECONDS = float(os.environ.get('CIRCUIT_RESET_SECONDS', '30'))
+# Latency samples kept per endpoint for the percentiles
+_LATENCY_SAMPLES = 512
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling a provider whose circuit is open"""
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures; after `reset_timeout`
+    seconds one trial request is allowed (half open) and its outcome closes or reopens it.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.times_opened += 1
+                    logging.warning(f"Circuit for {self.name} opened after {self.failures} consecutive failures")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'times_opened': self.times_opened,
+            'rejected': self.rejected
+        }
+
+
+class EndpointMetrics:
+    """Call count, errors and latency percentiles of one endpoint"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = deque(maxlen=_LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def record(self, elapsed_ms: float, error: bool):
+        with self._lock:
+            self.calls += 1
+            self.errors += error
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+            self.samples.append(elapsed_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ordered = sorted(self.samples)
+
+        def pick(q):
+            return round(ordered[min(int(len(ordered) * q), len(ordered) - 1)], 1) if ordered else None
+
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'avg_ms': round(self.total_ms / self.calls, 1) if self.calls else None,
+            'p50_ms': pick(0.5),
+            'p95_ms': pick(0.95),
+            'max_ms': round(self.max_ms, 1)
+        }
+
+
+class ServiceClient:
+    """Shared access to one external provider: a keep-alive connection pool, a circuit
+    breaker, per-endpoint latency metrics and a TTL cache for idempotent reads.
+
+    request() raises CircuitOpenError (a requests.RequestException) without touching
+    the network while the provider's circuit is open. 5xx answers and transport
+    errors count as failures; 4xx answers are the caller's problem and do not.
+    """
+
+    def __init__(self, name: str, pool_size: int = 10, timeout: Tuple[float, float] = (3, 10),
+                 failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.endpoints: Dict[str, EndpointMetrics] = {}
+        self._cache: Dict[Any, Tuple[float, Any]] = {}
+        self._cache_locks: Dict[Any, threading.Lock] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def _metrics(self, endpoint: str) -> EndpointMetrics:
+        metrics = self.endpoints.get(endpoint)
+        if metrics is None:
+            with self._lock:
+                metrics = self.endpoints.setdefault(endpoint, EndpointMetrics())
+        return metrics
+
+    def request(self, method: str, url: str, endpoint: Optional[str] = None, **kwargs) -> requests.Response:
+        """Send a request through the pool; `endpoint` labels the metrics (default: the URL path)"""
+        endpoint = endpoint or f"{method.upper()} {urlparse(url).path}"
+        if not self.breaker.allow():
+            raise CircuitOpenError(f'{self.name} is unavailable (circuit open)')
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self._metrics(endpoint).record((time.perf_counter() - started) * 1000, True)
+            self.breaker.record_failure()
+            raise
+        failed = response.status_code >= 500
+        self._metrics(endpoint).record((time.perf_counter() - started) * 1000, failed)
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def as_session(self, endpoint: Optional[str] = None) -> '_ClientSession':
+        """Session-like view for libraries that take a requests.Session (such as the
+        google-auth transport), so their calls also go through the breaker and metrics"""
+        return _ClientSession(self, endpoint)
+
+    def cached(self, key, ttl: float, load: Callable[[], Any]) -> Any:
+        """Value of load() cached for ttl seconds; concurrent misses of one key share a single load.
+        Exceptions are not cached.
+        """
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.cache_hits += 1
+            return entry[1]
+        with self._lock:
+            key_lock = self._cache_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.cache_hits += 1
+                return entry[1]
+            self.cache_misses += 1
+            value = load()
+            self._cache[key] = (time.monotonic() + ttl, value)
+            return value
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'circuit': self.breaker.stats(),
+            'cache': {'hits': self.cache_hits, 'misses': self.cache_misses, 'entries': len(self._cache)},
+            'endpoints': {name: metrics.stats() for name, metrics in sorted(self.endpoints.items())}
+        }
+
+
+class _ClientSession:
+    def __init__(self, client: ServiceClient, endpoint: Optional[str]):
+        self.client = client
+        self.endpoint = endpoint
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        return self.client.request(method, url, endpoint=self.endpoint, **kwargs)
+
+    def close(self):
+        pass
+
+
+_clients: Dict[str, ServiceClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(name: str, **options) -> ServiceClient:
+    """The process-wide client of a provider; options only apply when it is first created"""
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = ServiceClient(name, **options)
+    return client
+
+
+def client_stats() -> Dict[str, Any]:
+    return {name: client.stats() for name, client in sorted(_clients.items())}
+
+
+__all__ = ['ServiceClient', 'CircuitBreaker', 'CircuitOpenError', 'get_client', 'client_stats']
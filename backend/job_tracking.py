@@ -0,0 +1,145 @@
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, date
+from typing import Dict, Optional
+
+from app import db
+from models import JobRun
+
+_PAGE_KB = os.sysconf('SC_PAGE_SIZE') // 1024 if hasattr(os, 'sysconf') else 4
+
+
+def current_rss_kb() -> Optional[int]:
+    """This process's resident memory right now in KB; None without /proc (macOS, Windows)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_KB
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class JobRunTracker:
+    """Collect per-phase timings, row counts and peak memory for one job run
+    and persist them as a JobRun row. peak_memory_kb is how far the process's RSS
+    rose above its level at the start of the run, sampled at the end of every phase
+    and of the run; work running concurrently in the same process is included.
+
+    Usage:
+        with JobRunTracker('daily_predictions', trigger='scheduled') as tracker:
+            with tracker.phase('inference'):
+                ...
+            tracker.count('predictions_created')
+    """
+
+    def __init__(self, job_name: str, trigger: str = 'manual', target_date: Optional[date] = None):
+        self.job_name = job_name
+        self.trigger = trigger
+        self.target_date = target_date
+        self.phase_timings: Dict[str, float] = {}
+        self.row_counts: Dict[str, int] = {}
+        self.status = 'running'
+        self.error = None
+        self.run_id = None
+        self._started = None
+        self._started_at = None
+        self._rss_start = None
+        self._rss_peak = None
+
+    def __enter__(self):
+        self._started_at = datetime.utcnow()
+        self._started = time.perf_counter()
+        self._rss_start = self._rss_peak = current_rss_kb()
+        self._save_start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.fail(str(exc))
+        self._finish()
+        # Never swallow the original exception
+        return False
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a block and add it to the accumulated total for the phase"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.phase_timings[name] = self.phase_timings.get(name, 0.0) + elapsed_ms
+            self._sample_rss()
+
+    def count(self, name: str, amount: int = 1):
+        """Increment a row counter"""
+        self.row_counts[name] = self.row_counts.get(name, 0) + amount
+
+    def _sample_rss(self):
+        rss = current_rss_kb()
+        if rss is not None and self._rss_peak is not None:
+            self._rss_peak = max(self._rss_peak, rss)
+
+    def fail(self, error: str):
+        """Mark the run as failed; the row is written when the tracker exits"""
+        self.status = 'failed'
+        self.error = error
+
+    def _save_start(self):
+        try:
+            run = JobRun(
+                job_name=self.job_name,
+                trigger=self.trigger,
+                target_date=self.target_date,
+                status='running',
+                started_at=self._started_at
+            )
+            db.session.add(run)
+            db.session.commit()
+            self.run_id = run.id
+        except Exception as e:
+            logging.error(f"Failed to record start of job {self.job_name}: {str(e)}")
+            db.session.rollback()
+
+    def _finish(self):
+        duration_ms = (time.perf_counter() - self._started) * 1000
+        self._sample_rss()
+        peak_memory_kb = self._rss_peak - self._rss_start if self._rss_start is not None else None
+        if self.status == 'running':
+            self.status = 'success'
+
+        logging.info(
+            f"Job {self.job_name} ({self.trigger}) finished with status {self.status} in {duration_ms:.1f} ms; "
+            f"phases={ {k: round(v, 1) for k, v in self.phase_timings.items()} } rows={self.row_counts}"
+        )
+        try:
+            # The job may have left the session in a failed state
+            db.session.rollback()
+            run = db.session.get(JobRun, self.run_id) if self.run_id else None
+            if run is None:
+                run = JobRun(job_name=self.job_name, trigger=self.trigger, started_at=self._started_at)
+                db.session.add(run)
+            run.target_date = self.target_date
+            run.status = self.status
+            run.error = self.error
+            run.phase_timings = {k: round(v, 3) for k, v in self.phase_timings.items()}
+            run.row_counts = dict(self.row_counts)
+            run.peak_memory_kb = peak_memory_kb
+            run.duration_ms = round(duration_ms, 3)
+            run.finished_at = datetime.utcnow()
+            db.session.commit()
+            self.run_id = run.id
+        except Exception as e:
+            logging.error(f"Failed to record job run for {self.job_name}: {str(e)}")
+            db.session.rollback()
+
+
+def track_phase(tracker: Optional[JobRunTracker], name: str):
+    """Return tracker.phase(name), or a no-op context when no tracker is given"""
+    if tracker is None:
+        return nullcontext()
+    return tracker.phase(name)
+
+
+__all__ = ['JobRunTracker', 'track_phase']
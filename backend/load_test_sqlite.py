@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Concurrent read/write load test for the SQLite engine configuration.
+
+A writer keeps deleting and rewriting four years of predictions (what a backfill
+does), while reader processes (like gunicorn workers) request
+/api/predictions/<date> through the Flask test client. Each configuration runs in
+its own process on a fresh scratch database, because the engine settings are
+read at import time:
+
+  legacy  rollback journal, synchronous=FULL, no read pool (the old defaults)
+  wal     WAL, synchronous=NORMAL, busy_timeout and the read-only pool
+
+Usage (from backend/):
+    python load_test_sqlite.py
+    python load_test_sqlite.py --seconds 20 --readers 8 --days 365 --hold-ms 200
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+MODES = {
+    'legacy': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'SQLITE_READ_POOL_SIZE': '0'},
+    'wal': {'SQLITE_JOURNAL_MODE': 'WAL', 'SQLITE_SYNCHRONOUS': 'NORMAL', 'SQLITE_READ_POOL_SIZE': '10'},
+}
+
+
+def run_worker(seconds: float, readers: int, days: int, hold_ms: float) -> dict:
+    """Runs inside the child process; the environment already selects the mode"""
+    from datetime import date, datetime, timedelta
+    from sqlalchemy import delete
+
+    import multiprocessing
+
+    from app import app, db
+    from models import JeepneyStop, Prediction
+
+    start = date.today() + timedelta(days=365)
+    dates = [start + timedelta(days=i) for i in range(days)]
+    with app.app_context():
+        stop_ids = [s.id for s in JeepneyStop.query.all()]
+
+    def rewrite(hold=0.0):
+        db.session.execute(delete(Prediction).where(Prediction.prediction_date.in_(dates)))
+        # The scheduler keeps its transaction open while it scores the stops
+        time.sleep(hold)
+        db.session.execute(db.insert(Prediction), [
+            {'stop_id': stop_id, 'prediction_date': d, 'predicted_passengers': 40 + i, 'peak_hour': 7,
+             'confidence_score': 0.9, 'message': 'load test', 'is_sent': False, 'created_at': datetime.utcnow()}
+            for i, d in enumerate(dates) for stop_id in stop_ids
+        ])
+        db.session.commit()
+
+    with app.app_context():
+        rewrite()
+
+    context = multiprocessing.get_context('fork')
+    stop = context.Event()
+    results = context.Queue()
+    lock = threading.Lock()
+    stats = {'reads': 0, 'read_errors': 0, 'writes': 0, 'write_errors': 0, 'latencies': []}
+
+    def writer():
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    rewrite(hold_ms / 1000)
+                    with lock:
+                        stats['writes'] += 1
+                except Exception:
+                    db.session.rollback()
+                    with lock:
+                        stats['write_errors'] += 1
+
+    def reader(index):
+        # Connections inherited from the parent must not be shared with it
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+        client = app.test_client()
+        reads, errors, latencies = 0, 0, []
+        i = index
+        while not stop.is_set():
+            i += 1
+            started = time.perf_counter()
+            response = client.get(f'/api/predictions/{dates[i % len(dates)].isoformat()}')
+            if response.status_code == 200:
+                reads += 1
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+        results.put((reads, errors, latencies))
+
+    processes = [context.Process(target=reader, args=(n,)) for n in range(readers)]
+    for process in processes:
+        process.start()
+    thread = threading.Thread(target=writer)
+    thread.start()
+    time.sleep(seconds)
+    stop.set()
+    thread.join()
+    for _ in processes:
+        reads, errors, latencies = results.get()
+        stats['reads'] += reads
+        stats['read_errors'] += errors
+        stats['latencies'].extend(latencies)
+    for process in processes:
+        process.join()
+
+    latencies = sorted(stats.pop('latencies')) or [0]
+    stats['reads_per_s'] = round(stats['reads'] / seconds, 1)
+    stats['writes_per_s'] = round(stats['writes'] / seconds, 2)
+    stats['p50_ms'] = round(latencies[len(latencies) // 2] * 1000, 1)
+    stats['p95_ms'] = round(latencies[int(len(latencies) * 0.95)] * 1000, 1)
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Concurrent read/write load test for SQLite modes')
+    parser.add_argument('--seconds', type=float, default=10, help='duration of each run')
+    parser.add_argument('--readers', type=int, default=4, help='concurrent reader processes, like gunicorn workers')
+    parser.add_argument('--days', type=int, default=1500, help='prediction dates rewritten per write transaction')
+    parser.add_argument('--hold-ms', type=float, default=0,
+                        help='time each write transaction stays open after its delete')
+    parser.add_argument('--modes', default='legacy,wal', help='comma separated: ' + ','.join(MODES))
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_worker(args.seconds, args.readers, args.days, args.hold_ms)))
+        return 0
+
+    print(f"{'mode':<8} {'reads/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'read err':>9} {'writes/s':>9} {'write err':>10}")
+    for mode in args.modes.split(','):
+        scratch = tempfile.mkdtemp(prefix=f'jeepni-load-{mode}-')
+        env = dict(os.environ, **MODES[mode],
+                   DATABASE_URL=f"sqlite:///{os.path.join(scratch, 'load.db')}",
+                   CHANGE_VERSION_DIR=os.path.join(scratch, 'versions'),
+                   DATASET_FILE=os.path.join(scratch, 'passenger_demand_data.csv'),
+                   FORECAST_MODEL_PATH=os.path.join(scratch, 'passenger_forecasting_model.pkl'),
+                   DISABLE_SCHEDULER='1')
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', '--seconds', str(args.seconds),
+             '--readers', str(args.readers), '--days', str(args.days), '--hold-ms', str(args.hold_ms)],
+            env=env, capture_output=True, text=True
+        )
+        lines = [line for line in result.stdout.splitlines() if line.startswith('{')]
+        if result.returncode != 0 or not lines:
+            print(f"{mode:<8} failed:\n{result.stderr[-2000:]}")
+            continue
+        s = json.loads(lines[-1])
+        print(f"{mode:<8} {s['reads_per_s']:>9} {s['p50_ms']:>8} {s['p95_ms']:>8} {s['read_errors']:>9} "
+              f"{s['writes_per_s']:>9} {s['write_errors']:>10}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Schema migrations for existing databases.
+
+db.create_all() creates missing tables (with the indexes declared on the models)
+but never changes a table that already exists. Changes to existing tables are
+written here as numbered migrations; each runs once, in order, in its own
+transaction, and is recorded in the schema_migrations table. Pending migrations
+are applied on startup.
+
+Usage (from backend/):
+    python migrations.py            # list applied and pending migrations
+    python migrations.py upgrade    # apply pending migrations
+"""
+
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.schema import CreateTable
+
+if __name__ == '__main__':
+    # Only `upgrade` may change the database: no scheduler or startup prediction run,
+    # and no automatic create_all/migrations when the app is imported below
+    os.environ.setdefault('DISABLE_SCHEDULER', '1')
+    os.environ.setdefault('DISABLE_AUTO_MIGRATIONS', '1')
+
+from app import db
+
+MIGRATIONS: List[Tuple[int, str, Callable]] = []
+
+
+def migration(version: int, description: str):
+    """Register a migration function taking an open connection"""
+    def decorator(f):
+        MIGRATIONS.append((version, description, f))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return f
+    return decorator
+
+
+@migration(1, 'Add nullable columns added to the models before migrations existed')
+def _add_missing_columns(conn):
+    inspector = inspect(conn)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            logging.info(f"Added column {table.name}.{column.name}")
+
+
+@migration(2, 'Indexes for the hot query patterns and one prediction per stop and day')
+def _hot_query_indexes(conn):
+    # Keep the newest prediction of any duplicated (stop, date) before the unique index goes on
+    removed = conn.execute(text(
+        'DELETE FROM prediction WHERE id NOT IN '
+        '(SELECT MAX(id) FROM prediction GROUP BY stop_id, prediction_date)'
+    )).rowcount
+    if removed:
+        logging.warning(f"Removed {removed} duplicate predictions before adding uq_prediction_stop_date")
+        # Row ids are gone; sync clients refetch the table
+        conn.execute(text(
+            "INSERT INTO change_log (table_name, row_id, op, changed_at) VALUES ('prediction', NULL, 'reset', :now)"
+        ), {'now': datetime.utcnow()})
+    for statement in (
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_prediction_stop_date ON prediction (stop_id, prediction_date)',
+        'CREATE INDEX IF NOT EXISTS ix_prediction_date_sent ON prediction (prediction_date, is_sent)',
+        'CREATE INDEX IF NOT EXISTS ix_user_number_is_active ON user_number (is_active)',
+        'CREATE INDEX IF NOT EXISTS ix_model_metrics_active_training ON model_metrics (is_active, training_date)',
+        'CREATE INDEX IF NOT EXISTS ix_job_run_started_at ON job_run (started_at)',
+    ):
+        conn.execute(text(statement))
+    return ['prediction'] if removed else []
+
+
+@migration(3, 'Add user_number.topic_subscribed_at for topic delivery')
+def _topic_subscription_column(conn):
+    _add_missing_columns(conn)
+
+
+@migration(4, 'Add delivery_broadcast.kind and sender_name for bulk SMS jobs')
+def _sms_job_columns(conn):
+    _add_missing_columns(conn)
+
+
+@migration(5, 'Rebuild change_log with AUTOINCREMENT so pruned versions are never reused')
+def _change_log_autoincrement(conn):
+    if conn.dialect.name != 'sqlite':
+        return
+    ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'change_log'")).scalar()
+    if ddl is None or 'AUTOINCREMENT' in ddl.upper():
+        return
+    # SQLite cannot alter a primary key in place: copy into a new table and swap it in
+    from models import ChangeLog
+    create = str(CreateTable(ChangeLog.__table__).compile(dialect=conn.dialect))
+    conn.execute(text(create.replace('CREATE TABLE change_log', 'CREATE TABLE change_log_new', 1)))
+    conn.execute(text(
+        'INSERT INTO change_log_new (id, table_name, row_id, op, changed_at) '
+        'SELECT id, table_name, row_id, op, changed_at FROM change_log'
+    ))
+    conn.execute(text('DROP TABLE change_log'))
+    conn.execute(text('ALTER TABLE change_log_new RENAME TO change_log'))
+
+
+def _ensure_migrations_table():
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations '
+            '(version INTEGER PRIMARY KEY, description VARCHAR(200), applied_at TIMESTAMP)'
+        ))
+
+
+def applied_versions(create: bool = True) -> set:
+    """Versions recorded in schema_migrations; with create=False a missing table reads as none"""
+    if create:
+        _ensure_migrations_table()
+    elif not inspect(db.engine).has_table('schema_migrations'):
+        return set()
+    with db.engine.connect() as conn:
+        return {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def run_migrations() -> List[int]:
+    """Apply pending migrations in order; returns the versions applied by this call"""
+    done = applied_versions()
+    applied = []
+    changed_tables = set()
+    for version, description, apply in MIGRATIONS:
+        if version in done:
+            continue
+        try:
+            with db.engine.begin() as conn:
+                # Claim the version first so a second worker starting at the same time
+                # fails on the primary key instead of running the migration twice
+                conn.execute(text(
+                    'INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)'
+                ), {'v': version, 'd': description, 't': datetime.utcnow()})
+                changed_tables.update(apply(conn) or [])
+        except (IntegrityError, OperationalError) as e:
+            logging.warning(f"Migration {version} not applied here (another process may be applying it): {str(e)}")
+            break
+        logging.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+    if changed_tables:
+        from change_tracking import bump_versions
+        bump_versions(changed_tables)
+    return applied
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Database schema migrations')
+    parser.add_argument('command', nargs='?', default='status', choices=['status', 'upgrade'])
+    args = parser.parse_args(argv)
+
+    from app import app
+    with app.app_context():
+        if args.command == 'upgrade':
+            # The same steps the app runs on startup
+            db.create_all()
+            applied = run_migrations()
+            print(f"Applied {len(applied)} migration(s)" + (f": {applied}" if applied else ''))
+        done = applied_versions(create=args.command == 'upgrade')
+        for version, description, _ in MIGRATIONS:
+            print(f"{'applied' if version in done else 'pending':<8} {version:>3}  {description}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,14 +3,16 @@ import numpy as np
 from datetime import datetime, date, timedelta
 import pickle
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 import os
+import threading
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 import xgboost as xgb
 from data_generator import PassengerDataGenerator
 from models import ModelMetrics
 from app import db, app
+from job_tracking import track_phase
 import random
 
 class PassengerForecastingModel:
@@ -165,7 +167,7 @@ def train_forecasting_model():
     try:
         # Resolve paths relative to this file to avoid CWD issues
         base_dir = os.path.dirname(os.path.abspath(__file__))
-        data_file = os.path.join(base_dir, 'passenger_demand_data.csv')
+        data_file = os.environ.get('DATASET_FILE') or os.path.join(base_dir, 'passenger_demand_data.csv')
         
         if not os.path.exists(data_file):
             logging.info("Generating new dataset...")
@@ -195,7 +197,7 @@ def train_forecasting_model():
         test_metrics = model.evaluate_model(X_test, y_test)
         
         # Save model
-        model_path = os.path.join(base_dir, 'passenger_forecasting_model.pkl')
+        model_path = get_model_path()
         model.save_model(model_path)
         
         # Save metrics to database
@@ -222,71 +224,122 @@ def train_forecasting_model():
         logging.error(f"Error in model training: {str(e)}")
         return {'success': False, 'error': str(e)}
 
-def generate_prediction_for_stop(stop, prediction_date: date) -> Optional[Dict[str, Any]]:
-    """Generate prediction for a specific stop and date"""
-    try:
-        # Resolve model path relative to this file
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        model_path = os.path.join(base_dir, 'passenger_forecasting_model.pkl')
-        # Load model
-        model = PassengerForecastingModel()
-        if not model.load_model(model_path):
+_model_cache_lock = threading.Lock()
+_model_cache = {'mtime': None, 'model': None}
+
+def get_model_path() -> str:
+    """Resolve the trained model path relative to this file (FORECAST_MODEL_PATH overrides it)"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.environ.get('FORECAST_MODEL_PATH') or os.path.join(base_dir, 'passenger_forecasting_model.pkl')
+
+def load_forecasting_model() -> Optional[PassengerForecastingModel]:
+    """Load the trained model once and reuse it until the pickle changes on disk.
+    Trains a new model when none exists yet.
+    """
+    model_path = get_model_path()
+    with _model_cache_lock:
+        if not os.path.exists(model_path):
             logging.error("Model not found, training new model...")
             train_result = train_forecasting_model()
             if not train_result['success']:
                 return None
-            model.load_model(model_path)
-        
+        mtime = os.path.getmtime(model_path)
+        if _model_cache['model'] is not None and _model_cache['mtime'] == mtime:
+            return _model_cache['model']
+        model = PassengerForecastingModel()
+        if not model.load_model(model_path):
+            return None
+        _model_cache['model'] = model
+        _model_cache['mtime'] = mtime
+        return model
+
+def _add_lag_features(features: Dict) -> Dict:
+    """Add lag features (simplified - in production these would come from historical data)"""
+    # Add more randomness to ensure different predictions each time
+    features['lag_1_hour_demand'] = random.randint(3, 28)
+    features['lag_24_hour_demand'] = random.randint(3, 28)
+    features['rolling_3_hour_avg_demand'] = random.randint(5, 25)
+    features['rolling_6_hour_avg_demand'] = random.randint(5, 25)
+    return features
+
+def build_hourly_features(model: PassengerForecastingModel, stop_name: str, prediction_date: date,
+                          lag_features: Optional[Dict] = None) -> List[Dict]:
+    """Build the feature dicts for every hour of the prediction date.
+    Uses the given observed lag/rolling values when provided, random placeholders otherwise.
+    """
+    dt = datetime.combine(prediction_date, datetime.min.time())
+    hourly_features = []
+    for hour in range(24):
+        features = model.data_generator.generate_features(dt.replace(hour=hour), stop_name)
+        if lag_features:
+            features.update(lag_features)
+        else:
+            _add_lag_features(features)
+        hourly_features.append(features)
+    return hourly_features
+
+def predict_hourly_demand(model: PassengerForecastingModel, hourly_features: List[Dict]) -> List[int]:
+    """Predict passenger demand for all hours in a single model call"""
+    if model.model is None:
+        raise ValueError("Model not trained or loaded")
+    feature_array = np.array(
+        [[features.get(col, 0) for col in model.feature_columns] for features in hourly_features],
+        dtype=float
+    )
+    predictions = model.model.predict(feature_array)
+    return [max(0, int(round(value))) for value in predictions]
+
+def build_prediction_result(model: PassengerForecastingModel, stop_name: str, prediction_date: date,
+                            hourly_demand: List[int]) -> Dict[str, Any]:
+    """Turn an hourly demand curve into the prediction payload stored per stop"""
+    # Find peak hour
+    peak_hour, peak_passengers = max(enumerate(hourly_demand), key=lambda x: x[1])
+
+    # Generate features for peak hour
+    peak_dt = datetime.combine(prediction_date, datetime.min.time()).replace(hour=peak_hour)
+    peak_features = _add_lag_features(model.data_generator.generate_features(peak_dt, stop_name))
+
+    # Generate contextual message
+    message = generate_contextual_message(
+        stop_name,
+        peak_hour,
+        peak_passengers,
+        peak_features
+    )
+
+    return {
+        'predicted_passengers': peak_passengers,
+        'peak_hour': peak_hour,
+        'confidence_score': 0.95,  # High confidence for demo
+        'is_school_dismissal': peak_features['is_school_dismissal_time'] == 1,
+        'is_high_tide': peak_features['is_hightide'] == 1,
+        'is_public_holiday': peak_features['is_public_holiday'] == 1,
+        'is_weekend': peak_features['is_weekend'] == 1,
+        'message': message,
+        'hourly_demand': list(hourly_demand)
+    }
+
+def generate_prediction_for_stop(stop, prediction_date: date, model: Optional[PassengerForecastingModel] = None,
+                                 tracker=None) -> Optional[Dict[str, Any]]:
+    """Generate prediction for a specific stop and date.
+    Pass an already loaded model to skip the load; pass a JobRunTracker to time each phase.
+    """
+    try:
+        if model is None:
+            with track_phase(tracker, 'model_load'):
+                model = load_forecasting_model()
+            if model is None:
+                return None
+
         # Generate features for the prediction date
-        dt = datetime.combine(prediction_date, datetime.min.time())
-        
+        with track_phase(tracker, 'feature_build'):
+            hourly_features = build_hourly_features(model, stop.name, prediction_date)
+
         # Find peak hour by checking all hours
-        peak_predictions = []
-        for hour in range(24):
-            current_dt = dt.replace(hour=hour)
-            features = model.data_generator.generate_features(current_dt, stop.name)
-            
-            # Add lag features (simplified - in production these would come from historical data)
-            # Add more randomness to ensure different predictions each time
-            features['lag_1_hour_demand'] = random.randint(3, 28)
-            features['lag_24_hour_demand'] = random.randint(3, 28)
-            features['rolling_3_hour_avg_demand'] = random.randint(5, 25)
-            features['rolling_6_hour_avg_demand'] = random.randint(5, 25)
-            
-            prediction = model.predict_passenger_demand(features)
-            peak_predictions.append((hour, prediction))
-        
-        # Find peak hour
-        peak_hour, peak_passengers = max(peak_predictions, key=lambda x: x[1])
-        
-        # Generate features for peak hour
-        peak_dt = dt.replace(hour=peak_hour)
-        peak_features = model.data_generator.generate_features(peak_dt, stop.name)
-        
-        # Add lag features with randomness for varied predictions
-        peak_features['lag_1_hour_demand'] = random.randint(3, 28)
-        peak_features['lag_24_hour_demand'] = random.randint(3, 28)
-        peak_features['rolling_3_hour_avg_demand'] = random.randint(5, 25)
-        peak_features['rolling_6_hour_avg_demand'] = random.randint(5, 25)
-        
-        # Generate contextual message
-        message = generate_contextual_message(
-            stop.name,
-            peak_hour,
-            peak_passengers,
-            peak_features
-        )
-        
-        return {
-            'predicted_passengers': peak_passengers,
-            'peak_hour': peak_hour,
-            'confidence_score': 0.95,  # High confidence for demo
-            'is_school_dismissal': peak_features['is_school_dismissal_time'] == 1,
-            'is_high_tide': peak_features['is_hightide'] == 1,
-            'is_public_holiday': peak_features['is_public_holiday'] == 1,
-            'is_weekend': peak_features['is_weekend'] == 1,
-            'message': message
-        }
+        with track_phase(tracker, 'inference'):
+            hourly_demand = predict_hourly_demand(model, hourly_features)
+
+        return build_prediction_result(model, stop.name, prediction_date, hourly_demand)
         
     except Exception as e:
         logging.error(f"Error generating prediction for stop {stop.name}: {str(e)}")
@@ -331,8 +384,7 @@ def generate_contextual_message(stop_name: str, peak_hour: int, passengers: int,
 # Initialize model on startup
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    model_path = os.path.join(base_dir, 'passenger_forecasting_model.pkl')
+    model_path = get_model_path()
     # Check if model exists, if not train it
     if not os.path.exists(model_path):
         logging.info("Training initial model...")
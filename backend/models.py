@@ -2,6 +2,24 @@ from app import db
 from datetime import datetime
 from sqlalchemy import Text, JSON
 import json
+import struct
+
+# Hourly forecast curves are stored as 24 little-endian uint16 values (48 bytes)
+HOURLY_CURVE_FORMAT = struct.Struct('<24H')
+
+def pack_hourly_curve(values):
+    """Pack a 24-value passenger curve into bytes; returns None when no curve is given"""
+    if not values:
+        return None
+    if len(values) != 24:
+        raise ValueError(f"Hourly curve must have 24 values, got {len(values)}")
+    return HOURLY_CURVE_FORMAT.pack(*(min(max(int(v), 0), 0xFFFF) for v in values))
+
+def unpack_hourly_curve(blob):
+    """Inverse of pack_hourly_curve"""
+    if not blob:
+        return None
+    return list(HOURLY_CURVE_FORMAT.unpack(blob))
 
 class JeepneyStop(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -23,6 +41,13 @@ class JeepneyStop(db.Model):
         }
 
 class Prediction(db.Model):
+    __table_args__ = (
+        # One prediction per stop and day; also serves stop_id lookups
+        db.Index('uq_prediction_stop_date', 'stop_id', 'prediction_date', unique=True),
+        # Date-scoped lists and the unsent-predictions lookup of the send job
+        db.Index('ix_prediction_date_sent', 'prediction_date', 'is_sent'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     stop_id = db.Column(db.Integer, db.ForeignKey('jeepney_stop.id'), nullable=False)
     prediction_date = db.Column(db.Date, nullable=False)
@@ -39,6 +64,9 @@ class Prediction(db.Model):
     # Generated message
     message = db.Column(db.Text, nullable=False)
     
+    # Full 24-hour forecast, see pack_hourly_curve
+    hourly_curve = db.Column(db.LargeBinary)
+    
     # Status tracking
     is_sent = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -66,8 +94,10 @@ class UserNumber(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     phone_number = db.Column(db.String(20), nullable=False, unique=True)
     firebase_token = db.Column(db.String(500))
-    is_active = db.Column(db.Boolean, default=True)
+    is_active = db.Column(db.Boolean, default=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # When firebase_token was subscribed to the broadcast topic; NULL while pending
+    topic_subscribed_at = db.Column(db.DateTime)
     
     def to_dict(self):
         return {
@@ -77,7 +107,29 @@ class UserNumber(db.Model):
             'created_at': self.created_at.isoformat()
         }
 
+class StopSubscription(db.Model):
+    """A user's interest in a stop; the stop_id index serves the stop -> users lookup at send time"""
+    __table_args__ = (
+        db.Index('uq_stop_subscription_user_stop', 'user_id', 'stop_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user_number.id'), nullable=False)
+    stop_id = db.Column(db.Integer, db.ForeignKey('jeepney_stop.id'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class RetiredTopicToken(db.Model):
+    """A token replaced or deactivated while still subscribed to the broadcast topic;
+    the row is removed once the token has been unsubscribed"""
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(500), nullable=False, unique=True)
+    retired_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class ModelMetrics(db.Model):
+    __table_args__ = (
+        db.Index('ix_model_metrics_active_training', 'is_active', 'training_date'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     model_version = db.Column(db.String(50), nullable=False)
     r2_score = db.Column(db.Float, nullable=False)
@@ -97,6 +149,197 @@ class ModelMetrics(db.Model):
             'is_active': self.is_active
         }
 
+class StopObservation(db.Model):
+    """Passenger count reported at a stop; feeds the intraday nowcast lag features"""
+    id = db.Column(db.Integer, primary_key=True)
+    stop_id = db.Column(db.Integer, db.ForeignKey('jeepney_stop.id'), nullable=False, index=True)
+    passenger_count = db.Column(db.Integer, nullable=False)
+    observed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    source = db.Column(db.String(50))
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'stop_id': self.stop_id,
+            'passenger_count': self.passenger_count,
+            'observed_at': self.observed_at.isoformat(),
+            'source': self.source
+        }
+
+class ChangeLog(db.Model):
+    """Row-level change feed for delta sync; the id doubles as the monotonically increasing version.
+    AUTOINCREMENT keeps SQLite from reusing ids after old entries are pruned."""
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer)  # NULL for 'reset' entries written by bulk statements
+    op = db.Column(db.String(10), nullable=False)  # upsert, delete, reset
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class JobRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_name = db.Column(db.String(100), nullable=False)
+    trigger = db.Column(db.String(20), nullable=False, default='manual')  # scheduled, manual, startup
+    target_date = db.Column(db.Date)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, success, failed
+    error = db.Column(db.Text)
+    
+    # Timings in milliseconds, keyed by phase name
+    phase_timings = db.Column(JSON, default=dict)
+    row_counts = db.Column(JSON, default=dict)
+    peak_memory_kb = db.Column(db.Integer)
+    duration_ms = db.Column(db.Float)
+    
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_name': self.job_name,
+            'trigger': self.trigger,
+            'target_date': self.target_date.isoformat() if self.target_date else None,
+            'status': self.status,
+            'error': self.error,
+            'phase_timings': self.phase_timings or {},
+            'row_counts': self.row_counts or {},
+            'peak_memory_kb': self.peak_memory_kb,
+            'duration_ms': self.duration_ms,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class PredictionRollup(db.Model):
+    """Per-stop weekly or monthly summary of predictions moved out of the hot table"""
+    __table_args__ = (
+        db.Index('uq_prediction_rollup', 'stop_id', 'period', 'period_start', unique=True),
+        db.Index('ix_prediction_rollup_period', 'period', 'period_start'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    stop_id = db.Column(db.Integer, db.ForeignKey('jeepney_stop.id'), nullable=False)
+    period = db.Column(db.String(10), nullable=False)  # week, month
+    period_start = db.Column(db.Date, nullable=False)
+    period_end = db.Column(db.Date, nullable=False)
+    days = db.Column(db.Integer, nullable=False)
+    total_passengers = db.Column(db.Integer, nullable=False)
+    avg_passengers = db.Column(db.Float, nullable=False)
+    max_passengers = db.Column(db.Integer, nullable=False)
+    avg_confidence = db.Column(db.Float)
+    peak_hour = db.Column(db.Integer)  # most common daily peak hour
+    sent_count = db.Column(db.Integer, default=0)
+    school_dismissal_days = db.Column(db.Integer, default=0)
+    high_tide_days = db.Column(db.Integer, default=0)
+    public_holiday_days = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'stop_id': self.stop_id,
+            'period': self.period,
+            'period_start': self.period_start.isoformat(),
+            'period_end': self.period_end.isoformat(),
+            'days': self.days,
+            'total_passengers': self.total_passengers,
+            'avg_passengers': self.avg_passengers,
+            'max_passengers': self.max_passengers,
+            'avg_confidence': self.avg_confidence,
+            'peak_hour': self.peak_hour,
+            'sent_count': self.sent_count,
+            'school_dismissal_days': self.school_dismissal_days,
+            'high_tide_days': self.high_tide_days,
+            'public_holiday_days': self.public_holiday_days
+        }
+
+class PredictionArchive(db.Model):
+    """Raw predictions moved out of the hot table: one zlib-compressed JSON chunk per period"""
+    __table_args__ = (
+        db.Index('uq_prediction_archive_period', 'period', 'period_start', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(10), nullable=False)
+    period_start = db.Column(db.Date, nullable=False)
+    period_end = db.Column(db.Date, nullable=False, index=True)
+    row_count = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DeliveryBroadcast(db.Model):
+    """A queued notification broadcast or bulk SMS job; the states of its tasks checkpoint how far delivery got"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), default='predictions')  # predictions, sms
+    sender_name = db.Column(db.String(20))  # Semaphore sender name of sms jobs
+    prediction_date = db.Column(db.Date)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done
+    messages = db.Column(JSON, default=list)  # distinct message bodies, indexed by DeliveryTask.message_index
+    total = db.Column(db.Integer, nullable=False, default=0)
+    # Only the worker holding an unexpired lease delivers the broadcast
+    lease_owner = db.Column(db.String(100))
+    lease_until = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind or 'predictions',
+            'prediction_date': self.prediction_date.isoformat() if self.prediction_date else None,
+            'status': self.status,
+            'distinct_messages': len(self.messages or []),
+            'total': self.total,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class DeliveryTask(db.Model):
+    """One message of a broadcast to one recipient"""
+    __table_args__ = (
+        db.Index('uq_delivery_task_recipient', 'broadcast_id', 'channel', 'recipient', unique=True),
+        db.Index('ix_delivery_task_queue', 'broadcast_id', 'status', 'priority', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    broadcast_id = db.Column(db.Integer, db.ForeignKey('delivery_broadcast.id'), nullable=False)
+    channel = db.Column(db.String(10), nullable=False)  # fcm, sms, log
+    recipient = db.Column(db.String(500), nullable=False)  # FCM token or phone number
+    user_id = db.Column(db.Integer, db.ForeignKey('user_number.id'))
+    message_index = db.Column(db.Integer, nullable=False)
+    priority = db.Column(db.Integer, nullable=False, default=0)  # lower goes out first
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, failed, unconfirmed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error_code = db.Column(db.String(50))
+    sent_at = db.Column(db.DateTime)
+
+class AccountImportJob(db.Model):
+    """A bulk account import running in the background; rows holds one result per input row"""
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, done, failed
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    counts = db.Column(JSON, default=dict)  # rows by result: created, linked, duplicate, invalid, failed
+    rows = db.Column(JSON, default=list)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'counts': self.counts or {},
+            'rows': self.rows or [],
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
 # Initialize default data
 def initialize_default_data():
     """Initialize jeepney stops and other default data"""
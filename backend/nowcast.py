@@ -0,0 +1,169 @@
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, date, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+
+from app import app, db
+from models import JeepneyStop, Prediction, StopObservation, pack_hourly_curve
+from job_tracking import JobRunTracker
+
+try:
+    from ml_pipeline import load_forecasting_model, build_hourly_features, predict_hourly_demand, build_prediction_result  # type: ignore
+except Exception:
+    load_forecasting_model = None
+
+
+# Dirty-tracking state for this process:
+#  - the highest StopObservation id already folded into a nowcast
+#  - the (prediction id, lag/rolling features) each stop was last scored with
+_state_lock = threading.Lock()
+_last_observation_id = 0
+_scored_features: Dict[int, tuple] = {}
+
+
+def _hourly_buckets(observations: List[StopObservation], now: datetime) -> Dict[int, float]:
+    """Average observed counts per hour, keyed by hours-ago (0 = current hour)"""
+    sums = defaultdict(float)
+    counts = defaultdict(int)
+    current_hour = now.replace(minute=0, second=0, microsecond=0)
+    for obs in observations:
+        hours_ago = int((current_hour - obs.observed_at.replace(minute=0, second=0, microsecond=0)).total_seconds() // 3600)
+        if hours_ago < 0:
+            hours_ago = 0
+        sums[hours_ago] += obs.passenger_count
+        counts[hours_ago] += 1
+    return {h: sums[h] / counts[h] for h in sums}
+
+
+def compute_lag_features(observations: List[StopObservation], now: datetime) -> Optional[Dict[str, float]]:
+    """Derive the model's lag/rolling features from a stop's recent observations"""
+    buckets = _hourly_buckets(observations, now)
+    recent = [buckets[h] for h in sorted(buckets) if h < 24]
+    if not recent:
+        return None
+    lag_1 = recent[0]
+    return {
+        'lag_1_hour_demand': round(lag_1),
+        'lag_24_hour_demand': round(buckets.get(24, lag_1)),
+        'rolling_3_hour_avg_demand': round(sum(recent[:3]) / len(recent[:3]), 1),
+        'rolling_6_hour_avg_demand': round(sum(recent[:6]) / len(recent[:6]), 1),
+    }
+
+
+def find_dirty_stops(since_id: int, window_start: datetime) -> Dict[int, int]:
+    """Return {stop_id: newest observation id} for stops with observations newer than since_id"""
+    rows = (
+        db.session.query(StopObservation.stop_id, func.max(StopObservation.id))
+        .filter(StopObservation.id > since_id, StopObservation.observed_at >= window_start)
+        .group_by(StopObservation.stop_id)
+        .all()
+    )
+    return {stop_id: max_id for stop_id, max_id in rows}
+
+
+def run_nowcast(target_date: Optional[date] = None, trigger: str = 'scheduled') -> Dict:
+    """Re-score today's forecast for the stops whose observed inputs changed since the last run.
+    Updates the stored Prediction rows in place; untouched stops cost nothing.
+    """
+    global _last_observation_id
+    try:
+        with app.app_context():
+            # One instant for both clocks: predictions are keyed by the local date (like the
+            # daily job), observations are stored as naive UTC
+            instant = datetime.now(timezone.utc)
+            today = target_date or instant.astimezone().date()
+            now = instant.replace(tzinfo=None)
+            window_start = now - timedelta(hours=25)
+            with _state_lock:
+                dirty = find_dirty_stops(_last_observation_id, window_start)
+                if not dirty:
+                    return {'success': True, 'rescored': 0, 'dirty': 0}
+
+                with JobRunTracker('intraday_nowcast', trigger=trigger, target_date=today) as tracker:
+                    tracker.count('dirty_stops', len(dirty))
+                    with tracker.phase('model_load'):
+                        model = load_forecasting_model() if load_forecasting_model else None
+                    if model is None:
+                        tracker.fail('Forecasting model not available')
+                        return {'success': False, 'error': 'Forecasting model not available'}
+
+                    with tracker.phase('feature_build'):
+                        observations = (
+                            StopObservation.query
+                            .filter(StopObservation.stop_id.in_(list(dirty)))
+                            .filter(StopObservation.observed_at >= window_start)
+                            .all()
+                        )
+                        by_stop = defaultdict(list)
+                        for obs in observations:
+                            by_stop[obs.stop_id].append(obs)
+
+                        predictions = {
+                            p.stop_id: p for p in Prediction.query
+                            .filter(Prediction.prediction_date == today, Prediction.stop_id.in_(list(dirty)))
+                            .all()
+                        }
+                        stops = {s.id: s for s in JeepneyStop.query.filter(JeepneyStop.id.in_(list(dirty))).all()}
+
+                        to_score = []
+                        for stop_id in dirty:
+                            lag_features = compute_lag_features(by_stop.get(stop_id, []), now)
+                            if lag_features is None or stop_id not in predictions or stop_id not in stops:
+                                tracker.count('skipped_no_forecast')
+                                continue
+                            # Same inputs as the last scoring of this very row: nothing to do
+                            fingerprint = (predictions[stop_id].id, tuple(sorted(lag_features.items())))
+                            if _scored_features.get(stop_id) == fingerprint:
+                                tracker.count('skipped_unchanged')
+                                continue
+                            to_score.append((stop_id, lag_features, fingerprint))
+
+                    rescored = 0
+                    if to_score:
+                        with tracker.phase('feature_build'):
+                            features = []
+                            for stop_id, lag_features, _ in to_score:
+                                features.extend(build_hourly_features(model, stops[stop_id].name, today, lag_features))
+                        with tracker.phase('inference'):
+                            demand = predict_hourly_demand(model, features)
+                        with tracker.phase('db_write'):
+                            for i, (stop_id, _, fingerprint) in enumerate(to_score):
+                                result = build_prediction_result(model, stops[stop_id].name, today, demand[i * 24:(i + 1) * 24])
+                                prediction = predictions[stop_id]
+                                prediction.predicted_passengers = result['predicted_passengers']
+                                prediction.peak_hour = result['peak_hour']
+                                prediction.confidence_score = result['confidence_score']
+                                prediction.is_school_dismissal = result['is_school_dismissal']
+                                prediction.is_high_tide = result['is_high_tide']
+                                prediction.is_public_holiday = result['is_public_holiday']
+                                prediction.is_weekend = result['is_weekend']
+                                prediction.message = result['message']
+                                prediction.hourly_curve = pack_hourly_curve(result['hourly_demand'])
+                                rescored += 1
+                            db.session.commit()
+                        for stop_id, _, fingerprint in to_score:
+                            _scored_features[stop_id] = fingerprint
+
+                    _last_observation_id = max(dirty.values())
+                    tracker.count('predictions_updated', rescored)
+                    logging.info(f"Nowcast re-scored {rescored} of {len(dirty)} changed stops for {today}")
+                    return {'success': True, 'rescored': rescored, 'dirty': len(dirty), 'job_run_id': tracker.run_id}
+
+    except Exception as e:
+        logging.error(f"Error in run_nowcast: {str(e)}")
+        db.session.rollback()
+        return {'success': False, 'error': str(e)}
+
+
+def reset_nowcast_state():
+    """Forget the dirty-tracking state; the next run re-scores every stop with new observations"""
+    global _last_observation_id
+    with _state_lock:
+        _last_observation_id = 0
+        _scored_features.clear()
+
+
+__all__ = ['run_nowcast', 'compute_lag_features', 'reset_nowcast_state']
@@ -0,0 +1,170 @@
+import base64
+from datetime import datetime, date
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+from app import db
+from models import JeepneyStop, Prediction
+from serialization import IsoStrings
+
+# Columns selected for prediction list endpoints; the stop name comes from the
+# same SELECT so serializing a row never triggers a lazy load of Prediction.stop
+PREDICTION_COLUMNS = (
+    Prediction.id,
+    JeepneyStop.name.label('stop_name'),
+    Prediction.prediction_date,
+    Prediction.predicted_passengers,
+    Prediction.peak_hour,
+    Prediction.confidence_score,
+    Prediction.is_school_dismissal,
+    Prediction.is_high_tide,
+    Prediction.is_public_holiday,
+    Prediction.is_weekend,
+    Prediction.message,
+    Prediction.is_sent,
+    Prediction.created_at,
+    Prediction.sent_at,
+)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class QueryParamError(ValueError):
+    """Raised for malformed list filters or cursors; routes turn it into a 400"""
+
+
+def row_to_dict(row, iso=None) -> Dict:
+    """Serialize a PREDICTION_COLUMNS row with the same keys as Prediction.to_dict().
+    Pass a shared IsoStrings as iso when serializing many rows.
+    """
+    iso = iso or IsoStrings()
+    return {
+        'id': row.id,
+        'stop_name': row.stop_name,
+        'prediction_date': iso(row.prediction_date),
+        'predicted_passengers': row.predicted_passengers,
+        'peak_hour': row.peak_hour,
+        'confidence_score': row.confidence_score,
+        'is_school_dismissal': row.is_school_dismissal,
+        'is_high_tide': row.is_high_tide,
+        'is_public_holiday': row.is_public_holiday,
+        'is_weekend': row.is_weekend,
+        'message': row.message,
+        'is_sent': row.is_sent,
+        'created_at': iso(row.created_at),
+        'sent_at': iso(row.sent_at)
+    }
+
+
+def rows_to_dicts(rows) -> List[Dict]:
+    iso = IsoStrings()
+    return [row_to_dict(row, iso) for row in rows]
+
+
+def encode_cursor(prediction_date: date, prediction_id: int) -> str:
+    raw = f"{prediction_date.isoformat()}|{prediction_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[date, int]:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_part, id_part = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.strptime(date_part, '%Y-%m-%d').date(), int(id_part)
+    except Exception:
+        raise QueryParamError('Invalid cursor')
+
+
+def _parse_date(value: str, name: str) -> date:
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise QueryParamError(f'Invalid {name}. Use YYYY-MM-DD')
+
+
+def parse_prediction_filters(args) -> Dict:
+    """Read list filters from request args: stop_id=1,2  from=YYYY-MM-DD  to=YYYY-MM-DD  is_sent=true|false"""
+    filters = {}
+    if args.get('stop_id'):
+        try:
+            filters['stop_ids'] = [int(v) for v in args['stop_id'].split(',') if v.strip()]
+        except ValueError:
+            raise QueryParamError('stop_id must be a comma separated list of integers')
+    if args.get('from'):
+        filters['date_from'] = _parse_date(args['from'], 'from')
+    if args.get('to'):
+        filters['date_to'] = _parse_date(args['to'], 'to')
+    if args.get('is_sent') is not None:
+        filters['is_sent'] = args['is_sent'].lower() in ('1', 'true', 'yes')
+    return filters
+
+
+def parse_page_args(args, default_limit: int = DEFAULT_PAGE_SIZE) -> Tuple[int, Optional[Tuple[date, int]]]:
+    """Read limit and cursor from request args"""
+    try:
+        limit = int(args.get('limit', default_limit))
+    except ValueError:
+        raise QueryParamError('limit must be an integer')
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    cursor = decode_cursor(args['cursor']) if args.get('cursor') else None
+    return limit, cursor
+
+
+def prediction_page(filters: Dict, limit: int, cursor: Optional[Tuple[date, int]] = None,
+                    prediction_date: Optional[date] = None) -> Tuple[List, Optional[str]]:
+    """Fetch one page of prediction rows, newest date first and by id within a date.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    query = (
+        db.select(*PREDICTION_COLUMNS)
+        .join(JeepneyStop, JeepneyStop.id == Prediction.stop_id)
+    )
+    if prediction_date is not None:
+        query = query.where(Prediction.prediction_date == prediction_date)
+    if filters.get('stop_ids'):
+        query = query.where(Prediction.stop_id.in_(filters['stop_ids']))
+    if filters.get('date_from'):
+        query = query.where(Prediction.prediction_date >= filters['date_from'])
+    if filters.get('date_to'):
+        query = query.where(Prediction.prediction_date <= filters['date_to'])
+    if 'is_sent' in filters:
+        query = query.where(Prediction.is_sent == filters['is_sent'])
+    if cursor is not None:
+        cursor_date, cursor_id = cursor
+        query = query.where(or_(
+            Prediction.prediction_date < cursor_date,
+            and_(Prediction.prediction_date == cursor_date, Prediction.id > cursor_id)
+        ))
+    query = query.order_by(Prediction.prediction_date.desc(), Prediction.id.asc()).limit(limit + 1)
+
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.prediction_date, last.id)
+    return rows, next_cursor
+
+
+def iter_prediction_batches(filters: Dict, batch_size: int = MAX_PAGE_SIZE, prediction_date: Optional[date] = None):
+    """Yield lists of prediction rows, one short keyset query per batch.
+    Memory stays bounded by batch_size and no read transaction is held between batches.
+    """
+    cursor = None
+    while True:
+        rows, next_cursor = prediction_page(filters, batch_size, cursor, prediction_date)
+        # End the read transaction so writers are not blocked while the batch is sent
+        db.session.commit()
+        if rows:
+            yield rows
+        if next_cursor is None:
+            return
+        cursor = (rows[-1].prediction_date, rows[-1].id)
+
+
+__all__ = [
+    'PREDICTION_COLUMNS', 'QueryParamError', 'row_to_dict', 'rows_to_dicts', 'parse_prediction_filters',
+    'parse_page_args', 'prediction_page', 'iter_prediction_batches', 'encode_cursor', 'decode_cursor'
+]
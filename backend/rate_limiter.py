@@ -0,0 +1,148 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app import DATA_DIR
+
+# 'sqlite' shares limits between the worker processes of a host; 'memory' keeps them per process
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'sqlite').lower()
+RATE_LIMIT_DB = os.environ.get('RATE_LIMIT_DB', os.path.join(DATA_DIR, 'rate_limits.db'))
+# Keys the in-memory store keeps before evicting the least recently used one
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+# The SQLite store drops idle keys once every this many checks
+_SQLITE_PURGE_EVERY = 1000
+
+
+def gcra(tat: Optional[float], now: float, limit: int, window: float) -> Tuple[bool, float, float]:
+    """Generic cell rate algorithm: `limit` requests per `window` seconds, bursts included.
+    The whole state of a key is its theoretical arrival time (tat); a key whose tat is in
+    the past is idle and equivalent to a new one.
+    Returns (allowed, new tat, seconds until the next request would be allowed).
+    """
+    interval = window / limit
+    new_tat = max(tat or now, now) + interval
+    if new_tat - now > window:
+        return False, tat, new_tat - window - now
+    return True, new_tat, 0.0
+
+
+class MemoryRateLimitStore:
+    """Per-process store: one float per key in an LRU dict capped at `max_keys`"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self.evicted = 0
+        self._tats: 'OrderedDict[str, float]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        with self._lock:
+            now = time.monotonic()
+            allowed, tat, retry_after = gcra(self._tats.get(key), now, limit, window)
+            self._tats[key] = tat
+            self._tats.move_to_end(key)
+            # Least recently used first: drop idle keys at the front, then anything over the cap
+            while self._tats and (len(self._tats) > self.max_keys or next(iter(self._tats.values())) <= now):
+                self._tats.popitem(last=False)
+                self.evicted += 1
+            return allowed, retry_after
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': 'memory', 'keys': len(self._tats), 'max_keys': self.max_keys, 'evicted': self.evicted}
+
+
+class SqliteRateLimitStore:
+    """Store shared by every process on the host: one row per key in a small SQLite file.
+    Each check is a single-row read and upsert inside an immediate transaction.
+    """
+
+    def __init__(self, path: str = RATE_LIMIT_DB):
+        self.path = path
+        self.evicted = 0
+        self._checks = 0
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS rate_limit (key TEXT PRIMARY KEY, tat REAL NOT NULL)')
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tat FROM rate_limit WHERE key = ?', (key,)).fetchone()
+            allowed, tat, retry_after = gcra(row[0] if row else None, now, limit, window)
+            if allowed:
+                conn.execute('INSERT INTO rate_limit (key, tat) VALUES (?, ?) '
+                             'ON CONFLICT(key) DO UPDATE SET tat = excluded.tat', (key, tat))
+            self._checks += 1
+            if self._checks % _SQLITE_PURGE_EVERY == 0:
+                self.evicted += conn.execute('DELETE FROM rate_limit WHERE tat <= ?', (now,)).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, retry_after
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            keys = self._connection().execute('SELECT COUNT(*) FROM rate_limit').fetchone()[0]
+        except sqlite3.Error:
+            keys = None
+        return {'backend': 'sqlite', 'path': self.path, 'keys': keys, 'evicted': self.evicted}
+
+
+class RateLimiter:
+    """Request limiter over a pluggable store. check() does constant work per request.
+    If the shared store fails, requests are let through rather than rejected.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.allowed = 0
+        self.rejected = 0
+        self.store_errors = 0
+
+    def check(self, key: str, max_requests: int, window_seconds: float) -> Tuple[bool, int]:
+        """(allowed, whole seconds until the next request is allowed)"""
+        try:
+            allowed, retry_after = self.store.hit(key, max_requests, window_seconds)
+        except sqlite3.Error as e:
+            self.store_errors += 1
+            logging.error(f"Rate limit store error, allowing request: {str(e)}")
+            return True, 0
+        if allowed:
+            self.allowed += 1
+        else:
+            self.rejected += 1
+        return allowed, int(retry_after) + (retry_after % 1 > 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.store.stats(), 'allowed': self.allowed, 'rejected': self.rejected,
+                'store_errors': self.store_errors}
+
+
+def create_rate_limiter(backend: str = RATE_LIMIT_BACKEND) -> RateLimiter:
+    if backend == 'memory':
+        return RateLimiter(MemoryRateLimitStore())
+    if backend != 'sqlite':
+        logging.warning(f"Unknown RATE_LIMIT_BACKEND '{backend}', using sqlite")
+    return RateLimiter(SqliteRateLimitStore())
+
+
+api_rate_limiter = create_rate_limiter()
+
+
+__all__ = ['RateLimiter', 'MemoryRateLimitStore', 'SqliteRateLimitStore', 'gcra', 'create_rate_limiter', 'api_rate_limiter']
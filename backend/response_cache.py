@@ -0,0 +1,158 @@
+import gzip
+import os
+import threading
+import time
+from datetime import date
+from collections import OrderedDict
+from functools import wraps
+from typing import Dict, Optional, Tuple
+
+from flask import request
+
+from app import app
+from change_tracking import get_version
+
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '300'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '256'))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+# Bodies smaller than this are not worth compressing
+_GZIP_MIN_BYTES = 512
+
+
+class _Entry:
+    __slots__ = ('expires', 'versions', 'tables', 'body', 'gzipped', 'mimetype', 'headers', 'size')
+
+    def __init__(self, expires, versions, tables, body, gzipped, mimetype, headers):
+        self.expires = expires
+        self.versions = versions
+        self.tables = tables
+        self.body = body
+        self.gzipped = gzipped
+        self.mimetype = mimetype
+        self.headers = headers
+        self.size = len(body) + (len(gzipped) if gzipped else 0)
+
+
+class ResponseCache:
+    """Thread-safe LRU of serialized (and gzipped) response bodies with a TTL and a byte budget.
+
+    Each entry remembers the change versions of the tables it was built from, so a
+    write committed by any worker process makes the entry stale on its next lookup.
+    invalidate() additionally drops entries right away in the worker that wrote.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 ttl: int = RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: 'OrderedDict[Tuple, _Entry]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Tuple, versions: Tuple) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.versions != versions or entry.expires < time.monotonic():
+                self._remove(key)
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Tuple, versions: Tuple, tables: Tuple, body: bytes, mimetype: str,
+            headers: Optional[list] = None, ttl: Optional[int] = None) -> _Entry:
+        gzipped = gzip.compress(body, compresslevel=6) if len(body) >= _GZIP_MIN_BYTES else None
+        entry = _Entry(time.monotonic() + (ttl or self.ttl), versions, tables, body, gzipped, mimetype, headers or [])
+        if entry.size > self.max_bytes:
+            return entry
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, *tables: str):
+        """Drop every entry built from any of the given tables (all entries when none given)"""
+        with self._lock:
+            doomed = [k for k, e in self._entries.items() if not tables or set(tables) & set(e.tables)]
+            for key in doomed:
+                self._remove(key)
+            self.invalidations += len(doomed)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'pid': os.getpid(),
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+
+response_cache = ResponseCache()
+
+
+# Response headers that are rebuilt for every response rather than replayed from the cache
+_UNCACHED_HEADERS = {'content-type', 'content-length', 'content-encoding', 'vary'}
+
+
+def cached_response(*tables: str, ttl: Optional[int] = None, per_day: bool = False):
+    """Decorator serving a GET view's 200 body from response_cache.
+    The cache key is the full URL (plus today's date when per_day is set); the entry
+    is reused only while the change versions of the given tables are unchanged and
+    its TTL has not expired.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            key = (request.endpoint, request.full_path, date.today() if per_day else None)
+            versions = tuple(get_version(t) for t in tables)
+            entry = response_cache.get(key, versions)
+            if entry is None:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed or response.headers.get('Content-Encoding'):
+                    return response
+                headers = [(k, v) for k, v in response.headers.items() if k.lower() not in _UNCACHED_HEADERS]
+                entry = response_cache.put(key, versions, tables, response.get_data(), response.mimetype, headers, ttl)
+
+            accepts_gzip = entry.gzipped is not None and 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+            response = app.response_class(entry.gzipped if accepts_gzip else entry.body, mimetype=entry.mimetype,
+                                          headers=entry.headers)
+            if accepts_gzip:
+                response.headers['Content-Encoding'] = 'gzip'
+            response.vary.add('Accept-Encoding')
+            return response
+        return decorated_function
+    return decorator
+
+
+__all__ = ['ResponseCache', 'response_cache', 'cached_response']
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Retention for the Prediction table.
+
+Predictions older than the retention window are moved out of the hot table one
+whole period (week or month) at a time: the raw rows, hourly curves included,
+go into a zlib-compressed PredictionArchive chunk and each stop gets a
+PredictionRollup summary row for the period. Both stay queryable through
+/api/predictions/archive and /api/predictions/rollups. Old change_log entries
+are pruned as well; sync clients older than the log fall back to a snapshot.
+
+Usage (from backend/):
+    python retention.py                 # apply the configured windows
+    python retention.py --dry-run       # only report what would be archived
+    python retention.py --retention-days 90 --period week
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import zlib
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete
+
+if __name__ == '__main__':
+    # No scheduler threads or startup prediction run in the CLI
+    os.environ.setdefault('DISABLE_SCHEDULER', '1')
+
+from app import app, db
+from models import (JeepneyStop, Prediction, PredictionArchive, PredictionRollup, ChangeLog,
+                    unpack_hourly_curve)
+from job_tracking import JobRunTracker
+from change_tracking import log_row_changes
+from serialization import dumps
+from response_cache import response_cache
+
+# Days of predictions kept in the hot table (rounded down to a whole period)
+PREDICTION_RETENTION_DAYS = int(os.environ.get('PREDICTION_RETENTION_DAYS', '180'))
+PREDICTION_ROLLUP_PERIOD = os.environ.get('PREDICTION_ROLLUP_PERIOD', 'month')
+CHANGE_LOG_RETENTION_DAYS = int(os.environ.get('CHANGE_LOG_RETENTION_DAYS', '30'))
+
+PERIODS = ('week', 'month')
+
+# Column order of the rows stored in an archive chunk
+ARCHIVE_FIELDS = ['id', 'stop_id', 'prediction_date', 'predicted_passengers', 'peak_hour', 'confidence_score',
+                  'is_school_dismissal', 'is_high_tide', 'is_public_holiday', 'is_weekend', 'message',
+                  'is_sent', 'created_at', 'sent_at', 'hourly_demand']
+
+# Keeps IN (...) lists under SQLite's bound parameter limit
+_DELETE_BATCH = 500
+
+
+def period_bounds(day: date, period: str) -> Tuple[date, date]:
+    """First and last day of the week (Monday based) or month containing day"""
+    if period == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    start = day.replace(day=1)
+    next_month = (start + timedelta(days=32)).replace(day=1)
+    return start, next_month - timedelta(days=1)
+
+
+def retention_cutoff(today: date, retention_days: int, period: str) -> date:
+    """Predictions dated before the cutoff are archived; only whole periods are moved"""
+    return period_bounds(today - timedelta(days=retention_days), period)[0]
+
+
+def encode_archive(rows: List[Dict]) -> bytes:
+    return zlib.compress(dumps({'fields': ARCHIVE_FIELDS, 'rows': [[r[f] for f in ARCHIVE_FIELDS] for r in rows]}), 9)
+
+
+def decode_archive(payload: bytes) -> List[Dict]:
+    data = json.loads(zlib.decompress(payload))
+    fields = data['fields']
+    return [dict(zip(fields, row)) for row in data['rows']]
+
+
+def _hot_rows(start: date, end: date) -> List[Dict]:
+    rows = db.session.execute(
+        db.select(Prediction.id, Prediction.stop_id, Prediction.prediction_date, Prediction.predicted_passengers,
+                  Prediction.peak_hour, Prediction.confidence_score, Prediction.is_school_dismissal,
+                  Prediction.is_high_tide, Prediction.is_public_holiday, Prediction.is_weekend, Prediction.message,
+                  Prediction.is_sent, Prediction.created_at, Prediction.sent_at, Prediction.hourly_curve)
+        .where(Prediction.prediction_date >= start, Prediction.prediction_date <= end)
+        .order_by(Prediction.prediction_date, Prediction.stop_id)
+    ).all()
+    result = []
+    for row in rows:
+        item = dict(zip(ARCHIVE_FIELDS[:-1], row[:-1]))
+        item['prediction_date'] = item['prediction_date'].isoformat()
+        item['created_at'] = item['created_at'].isoformat() if item['created_at'] else None
+        item['sent_at'] = item['sent_at'].isoformat() if item['sent_at'] else None
+        item['hourly_demand'] = unpack_hourly_curve(row[-1])
+        result.append(item)
+    return result
+
+
+def _summarize(rows: List[Dict]) -> Dict:
+    passengers = [r['predicted_passengers'] for r in rows]
+    confidences = [r['confidence_score'] for r in rows if r['confidence_score'] is not None]
+    return {
+        'days': len(rows),
+        'total_passengers': sum(passengers),
+        'avg_passengers': round(sum(passengers) / len(rows), 2),
+        'max_passengers': max(passengers),
+        'avg_confidence': round(sum(confidences) / len(confidences), 4) if confidences else None,
+        'peak_hour': Counter(r['peak_hour'] for r in rows).most_common(1)[0][0],
+        'sent_count': sum(1 for r in rows if r['is_sent']),
+        'school_dismissal_days': sum(1 for r in rows if r['is_school_dismissal']),
+        'high_tide_days': sum(1 for r in rows if r['is_high_tide']),
+        'public_holiday_days': sum(1 for r in rows if r['is_public_holiday']),
+    }
+
+
+def archive_period(period: str, start: date, end: date, tracker=None) -> int:
+    """Move one period of hot predictions into its archive chunk and rebuild its rollups.
+    Runs in a single transaction; returns the number of predictions moved.
+    """
+    hot = _hot_rows(start, end)
+    if not hot:
+        return 0
+
+    chunk = PredictionArchive.query.filter_by(period=period, period_start=start).first()
+    # Rows archived by an earlier run are kept unless the hot table has a newer one for the same stop and day
+    replaced = {(r['stop_id'], r['prediction_date']) for r in hot}
+    rows = [r for r in (decode_archive(chunk.payload) if chunk else [])
+            if (r['stop_id'], r['prediction_date']) not in replaced] + hot
+    rows.sort(key=lambda r: (r['prediction_date'], r['stop_id']))
+
+    if chunk is None:
+        chunk = PredictionArchive(period=period, period_start=start, period_end=end, row_count=0, payload=b'')
+        db.session.add(chunk)
+    chunk.payload = encode_archive(rows)
+    chunk.row_count = len(rows)
+    chunk.created_at = datetime.utcnow()
+
+    by_stop = defaultdict(list)
+    for row in rows:
+        by_stop[row['stop_id']].append(row)
+    db.session.execute(delete(PredictionRollup).where(PredictionRollup.period == period,
+                                                      PredictionRollup.period_start == start))
+    for stop_id, stop_rows in by_stop.items():
+        db.session.add(PredictionRollup(stop_id=stop_id, period=period, period_start=start, period_end=end,
+                                        **_summarize(stop_rows)))
+
+    ids = [r['id'] for r in hot]
+    for i in range(0, len(ids), _DELETE_BATCH):
+        batch = ids[i:i + _DELETE_BATCH]
+        db.session.execute(delete(Prediction).where(Prediction.id.in_(batch))
+                           .execution_options(skip_change_log=True))
+        log_row_changes(db.session, 'prediction', batch, 'delete')
+    db.session.commit()
+
+    if tracker is not None:
+        tracker.count('predictions_archived', len(hot))
+        tracker.count('rollups_written', len(by_stop))
+        tracker.count('archive_bytes', len(chunk.payload))
+    return len(hot)
+
+
+def prune_change_log(days: int) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    result = db.session.execute(delete(ChangeLog).where(ChangeLog.changed_at < cutoff))
+    db.session.commit()
+    return result.rowcount or 0
+
+
+def run_retention(retention_days: Optional[int] = None, period: Optional[str] = None,
+                  dry_run: bool = False, trigger: str = 'manual') -> Dict:
+    """Archive and roll up predictions older than the retention window, then prune the change log"""
+    retention_days = PREDICTION_RETENTION_DAYS if retention_days is None else retention_days
+    period = period or PREDICTION_ROLLUP_PERIOD
+    if period not in PERIODS:
+        return {'success': False, 'error': f'period must be one of {", ".join(PERIODS)}'}
+    try:
+        with app.app_context():
+            cutoff = retention_cutoff(date.today(), retention_days, period)
+            old_dates = [d for (d,) in db.session.execute(
+                db.select(Prediction.prediction_date).where(Prediction.prediction_date < cutoff).distinct()
+            ).all()]
+            periods = sorted({period_bounds(d, period) for d in old_dates})
+            if dry_run:
+                count = db.session.query(Prediction).filter(Prediction.prediction_date < cutoff).count()
+                return {'success': True, 'dry_run': True, 'cutoff': cutoff.isoformat(), 'periods': len(periods),
+                        'predictions': count}
+
+            with JobRunTracker('retention', trigger=trigger, target_date=cutoff) as tracker:
+                archived = 0
+                with tracker.phase('archive'):
+                    for start, end in periods:
+                        try:
+                            archived += archive_period(period, start, end, tracker)
+                        except Exception:
+                            # Earlier periods stay committed; this one is retried on the next run
+                            db.session.rollback()
+                            logging.error(f"Retention failed for the {period} starting {start}")
+                            raise
+                with tracker.phase('prune_change_log'):
+                    pruned = prune_change_log(CHANGE_LOG_RETENTION_DAYS)
+                    tracker.count('change_log_pruned', pruned)
+            if archived:
+                response_cache.invalidate('prediction')
+            logging.info(f"Retention archived {archived} predictions in {len(periods)} {period}(s) before {cutoff}")
+            return {'success': True, 'cutoff': cutoff.isoformat(), 'periods': len(periods), 'archived': archived,
+                    'change_log_pruned': pruned, 'job_run_id': tracker.run_id}
+    except Exception as e:
+        logging.error(f"Error in run_retention: {str(e)}")
+        return {'success': False, 'error': str(e)}
+
+
+def query_archive(date_from: date, date_to: date, stop_ids: Optional[List[int]] = None) -> List[Dict]:
+    """Archived predictions in a date range, with the keys of Prediction.to_dict() plus stop_id and hourly_demand"""
+    chunks = db.session.execute(
+        db.select(PredictionArchive.payload)
+        .where(PredictionArchive.period_start <= date_to, PredictionArchive.period_end >= date_from)
+        .order_by(PredictionArchive.period_start)
+    ).scalars().all()
+    stop_names = dict(db.session.execute(db.select(JeepneyStop.id, JeepneyStop.name)).all())
+    wanted = set(stop_ids) if stop_ids else None
+    first, last = date_from.isoformat(), date_to.isoformat()
+    rows = []
+    for payload in chunks:
+        for row in decode_archive(payload):
+            if not (first <= row['prediction_date'] <= last):
+                continue
+            if wanted is not None and row['stop_id'] not in wanted:
+                continue
+            row['stop_name'] = stop_names.get(row['stop_id'])
+            rows.append(row)
+    rows.sort(key=lambda r: (r['prediction_date'], r['stop_id']), reverse=True)
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Archive and roll up old predictions')
+    parser.add_argument('--retention-days', type=int, default=None,
+                        help=f'days kept in the hot table (default {PREDICTION_RETENTION_DAYS})')
+    parser.add_argument('--period', choices=PERIODS, default=None,
+                        help=f'rollup and archive period (default {PREDICTION_ROLLUP_PERIOD})')
+    parser.add_argument('--dry-run', action='store_true', help='report what would be archived')
+    args = parser.parse_args(argv)
+    result = run_retention(args.retention_days, args.period, args.dry_run)
+    print(result)
+    return 0 if result.get('success') else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
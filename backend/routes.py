@@ -1,91 +1,95 @@
-from flask import render_template, request, jsonify, redirect, url_for, flash, send_from_directory
+from flask import render_template, request, jsonify, redirect, url_for, flash, send_from_directory, Response, stream_with_context
 import os
 from app import app, db
-from models import JeepneyStop, Prediction, UserNumber, ModelMetrics, initialize_default_data
-from firebase_service import send_predictions_to_all_users, write_user_profile, write_role_profile, create_user_and_profiles, update_user_fields
+from models import JeepneyStop, Prediction, UserNumber, ModelMetrics, JobRun, StopObservation, PredictionRollup, StopSubscription, DeliveryBroadcast, AccountImportJob, initialize_default_data, unpack_hourly_curve
+from change_tracking import get_version, version_timestamp
+from response_cache import response_cache, cached_response
+from dashboard_service import get_dashboard_summary, SUMMARY_TABLES
+from serialization import dumps, json_response, IsoStrings
+from delivery_scheduler import enqueue_broadcast, enqueue_sms, start_broadcast, broadcast_status
+from sms_sender import sms_sender, normalize_number
+from http_clients import CircuitOpenError, client_stats
+from rate_limiter import api_rate_limiter
+from prediction_queries import QueryParamError, MAX_PAGE_SIZE, row_to_dict, rows_to_dicts, parse_prediction_filters, parse_page_args, prediction_page, iter_prediction_batches
+from firebase_service import send_predictions_to_all_users, FCM_DELIVERY_MODE, retire_topic_token, schedule_topic_subscription, profile_paths, write_profiles, create_user_and_profiles, update_user_fields
 from datetime import datetime, date
 import traceback
 import logging
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, timedelta, timezone
 import traceback
 import logging
 from functools import wraps
-from collections import defaultdict
-import threading
 from werkzeug.utils import secure_filename
-import requests
 from flask import request, jsonify
 import os
+import csv
+import io
+import zlib
 
 SEMAPHORE_API_KEY = os.environ.get('SEMAPHORE_API_KEY', '')
-SEMAPHORE_API_URL = 'https://api.semaphore.co/api/v4/messages'
 
 UPLOADS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'public', 'uploads'))
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 
-# Rate limiter for SMS endpoints
-class SimpleRateLimiter:
-    def __init__(self):
-        self.requests = defaultdict(list)
-        self.lock = threading.Lock()
-    
-    def is_allowed(self, key, max_requests=10, window_seconds=60):
-        """Check if request is allowed based on rate limit"""
-        with self.lock:
-            now = datetime.now()
-            window_start = now - timedelta(seconds=window_seconds)
-            
-            # Clean old requests
-            self.requests[key] = [
-                req_time for req_time in self.requests[key]
-                if req_time > window_start
-            ]
-            
-            # Check if under limit
-            if len(self.requests[key]) >= max_requests:
-                return False
-            
-            # Record this request
-            self.requests[key].append(now)
-            return True
-    
-    def get_retry_after(self, key, window_seconds=60):
-        """Get seconds until rate limit resets"""
-        with self.lock:
-            if not self.requests[key]:
-                return 0
-            
-            oldest_request = min(self.requests[key])
-            reset_time = oldest_request + timedelta(seconds=window_seconds)
-            now = datetime.now()
-            
-            if reset_time > now:
-                return int((reset_time - now).total_seconds())
-            return 0
-
-# Create global rate limiter instance
-sms_rate_limiter = SimpleRateLimiter()
-
 def rate_limit(max_requests=10, window_seconds=60):
-    """Decorator for rate limiting endpoints"""
+    """Decorator for rate limiting endpoints per client IP; limits are shared by all workers"""
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            # Use IP address as rate limit key
-            client_ip = request.remote_addr
-            
-            if not sms_rate_limiter.is_allowed(client_ip, max_requests, window_seconds):
-                retry_after = sms_rate_limiter.get_retry_after(client_ip, window_seconds)
+            # Each endpoint has its own budget per IP address
+            allowed, retry_after = api_rate_limiter.check(f'{f.__name__}:{request.remote_addr}',
+                                                          max_requests, window_seconds)
+            if not allowed:
                 return jsonify({
                     'success': False,
                     'error': f'Rate limit exceeded. Try again in {retry_after} seconds.',
                     'retry_after': retry_after
-                }), 429
+                }), 429, {'Retry-After': str(retry_after)}
             
             return f(*args, **kwargs)
         return decorated_function
     return decorator
 
+def conditional_get(*tables, per_day=False):
+    """Decorator adding ETag/Last-Modified headers derived from the change versions
+    of the given tables; the ETag also covers the path and query string. A matching
+    If-None-Match / If-Modified-Since gets a 304 before the view (and the database)
+    is touched. per_day=True folds today's date into the ETag for views whose result
+    also changes at midnight.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            versions = [get_version(t) for t in tables]
+            tag = '-'.join(format(v, 'x') for v in versions)
+            if per_day:
+                tag += '-' + date.today().strftime('%Y%m%d')
+            # Different filters, cursors or dates of one route must never share a tag
+            tag += '-' + format(zlib.crc32(request.full_path.encode('utf-8')), '08x')
+            etag = f'"{tag}"'
+            last_modified = max(version_timestamp(v) for v in versions)
+            if per_day:
+                midnight = datetime.combine(date.today(), datetime.min.time()).astimezone()
+                last_modified = max(last_modified, midnight)
+            
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(tag)
+            else:
+                since = request.if_modified_since
+                not_modified = since is not None and int(last_modified.timestamp()) <= int(since.timestamp())
+            if not_modified:
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.headers['ETag'] = etag
+            response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return decorated_function
+    return decorator
+
 # Initialize default data on first run
 with app.app_context():
     initialize_default_data()
@@ -93,32 +97,59 @@ with app.app_context():
 @app.route('/')
 def dashboard():
     """Main admin dashboard"""
-    # Get today's predictions
     today = date.today()
-    predictions = Prediction.query.filter_by(prediction_date=today).all()
-    
-    # Get registered users count
-    users_count = UserNumber.query.filter_by(is_active=True).count()
-    
-    # Get model metrics
-    model_metrics = ModelMetrics.query.filter_by(is_active=True).first()
-    
-    # Get total predictions sent today
-    sent_count = Prediction.query.filter_by(prediction_date=today, is_sent=True).count()
+    # Predictions (with stop names), user count, active metrics and sent count in one cached summary
+    summary = get_dashboard_summary(today)
     
     return render_template('dashboard.html', 
-                         predictions=predictions,
-                         users_count=users_count,
-                         model_metrics=model_metrics,
-                         sent_count=sent_count,
+                         predictions=summary['predictions'],
+                         users_count=summary['users_count'],
+                         model_metrics=summary['model_metrics'],
+                         sent_count=summary['sent_count'],
                          today=today)
 
+@app.route('/api/dashboard/summary')
+@conditional_get(*SUMMARY_TABLES, per_day=True)
+def get_dashboard_summary_api():
+    """Dashboard counters, active model metrics and the day's predictions.
+    Optional query param: date=YYYY-MM-DD (default today)
+    """
+    summary_date = None
+    if request.args.get('date'):
+        try:
+            summary_date = datetime.strptime(request.args['date'], '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+    return json_response(get_dashboard_summary(summary_date))
+
+def prediction_list_response(prediction_date=None, default_limit=MAX_PAGE_SIZE):
+    """Serve one keyset page of predictions as a JSON list.
+    Supports stop_id, from, to, is_sent, limit and cursor query params; when more rows
+    exist the cursor for the next page is returned in the X-Next-Cursor and Link headers.
+    """
+    try:
+        filters = parse_prediction_filters(request.args)
+        limit, cursor = parse_page_args(request.args, default_limit)
+    except QueryParamError as e:
+        return jsonify({'error': str(e)}), 400
+    rows, next_cursor = prediction_page(filters, limit, cursor, prediction_date)
+    response = json_response(rows_to_dicts(rows))
+    if next_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        args['limit'] = limit
+        response.headers['X-Next-Cursor'] = next_cursor
+        # Path parameters win over a same-named query parameter
+        args.update(request.view_args or {})
+        response.headers['Link'] = f'<{url_for(request.endpoint, **args)}>; rel="next"'
+    return response
+
 @app.route('/api/predictions/today')
+@conditional_get('prediction', 'jeepney_stop', per_day=True)
+@cached_response('prediction', 'jeepney_stop', per_day=True)
 def get_today_predictions():
     """API endpoint to get today's predictions"""
-    today = date.today()
-    predictions = Prediction.query.filter_by(prediction_date=today).all()
-    return jsonify([p.to_dict() for p in predictions])
+    return prediction_list_response(date.today())
 
 @app.route('/api/predictions/send', methods=['POST'])
 def send_predictions():
@@ -130,7 +161,27 @@ def send_predictions():
         if not predictions:
             return jsonify({'error': 'No unsent predictions found for today'}), 400
         
-        # Send via Firebase
+        if FCM_DELIVERY_MODE != 'topic':
+            # Queue one task per recipient; delivery is paced in the background
+            broadcast = enqueue_broadcast(predictions, today)
+            if broadcast is None:
+                db.session.rollback()
+                return jsonify({'error': 'No active users found'}), 500
+            for prediction in predictions:
+                prediction.is_sent = True
+                prediction.sent_at = datetime.utcnow()
+            db.session.commit()
+            response_cache.invalidate('prediction')
+            start_broadcast(broadcast.id)
+            
+            return jsonify({
+                'success': True,
+                'broadcast_id': broadcast.id,
+                'queued': broadcast.total,
+                'message': f'Queued {len(predictions)} predictions for {broadcast.total} recipients'
+            })
+        
+        # Topic delivery is a handful of publishes; send it right away
         result = send_predictions_to_all_users(predictions)
         
         if result['success']:
@@ -139,6 +190,7 @@ def send_predictions():
                 prediction.is_sent = True
                 prediction.sent_at = datetime.utcnow()
             db.session.commit()
+            response_cache.invalidate('prediction')
             
             return jsonify({
                 'success': True,
@@ -151,11 +203,41 @@ def send_predictions():
         logging.error(f"Error sending predictions: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/deliveries')
+def get_deliveries():
+    """Most recent notification broadcasts with their delivery progress"""
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    broadcasts = DeliveryBroadcast.query.order_by(DeliveryBroadcast.id.desc()).limit(limit).all()
+    return jsonify([broadcast_status(b) for b in broadcasts])
+
+@app.route('/api/deliveries/<int:broadcast_id>')
+def get_delivery(broadcast_id):
+    """Delivery progress of one broadcast"""
+    return jsonify(broadcast_status(DeliveryBroadcast.query.get_or_404(broadcast_id)))
+
+@app.route('/api/deliveries/<int:broadcast_id>/resume', methods=['POST'])
+def resume_delivery(broadcast_id):
+    """Continue an interrupted broadcast; tasks already sent or in flight are not sent again"""
+    broadcast = DeliveryBroadcast.query.get_or_404(broadcast_id)
+    if broadcast.status == 'done':
+        return jsonify({'error': 'Broadcast is already delivered'}), 400
+    start_broadcast(broadcast_id)
+    return jsonify({'success': True, 'broadcast_id': broadcast_id})
+
 @app.route('/api/users')
+@cached_response('user_number')
 def get_users():
     """Get all registered users"""
-    users = UserNumber.query.filter_by(is_active=True).all()
-    return jsonify([u.to_dict() for u in users])
+    # Column-only select with the same keys as UserNumber.to_dict()
+    rows = db.session.execute(
+        db.select(UserNumber.id, UserNumber.phone_number, UserNumber.is_active, UserNumber.created_at)
+        .where(UserNumber.is_active == True)  # noqa: E712
+    ).all()
+    iso = IsoStrings()
+    return json_response([
+        {'id': user_id, 'phone_number': phone_number, 'is_active': is_active, 'created_at': iso(created_at)}
+        for user_id, phone_number, is_active, created_at in rows
+    ])
 
 @app.route('/api/users', methods=['POST'])
 def add_user():
@@ -175,11 +257,13 @@ def add_user():
              else:
                 existing_user.is_active = True
                 db.session.commit()
+                response_cache.invalidate('user_number')
                 return jsonify({'success': True, 'user': existing_user.to_dict(), 'message': 'User reactivated'})
         
         user = UserNumber(phone_number=phone_number)
         db.session.add(user)
         db.session.commit()
+        response_cache.invalidate('user_number')
         
         return jsonify({'success': True, 'user': user.to_dict()})
         
@@ -193,7 +277,12 @@ def delete_user(user_id):
     try:
         user = UserNumber.query.get_or_404(user_id)
         user.is_active = False
+        # Stop topic broadcasts reaching the deactivated user's device
+        retire_topic_token(user)
         db.session.commit()
+        response_cache.invalidate('user_number')
+        if FCM_DELIVERY_MODE == 'topic':
+            schedule_topic_subscription()
         
         return jsonify({'success': True, 'message': 'User deactivated successfully'})
         
@@ -201,18 +290,114 @@ def delete_user(user_id):
         logging.error(f"Error deleting user: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/users/<int:user_id>/stops')
+def get_user_stops(user_id):
+    """Stops a user receives forecasts for; an empty list means the default selection"""
+    UserNumber.query.get_or_404(user_id)
+    stop_ids = db.session.execute(
+        db.select(StopSubscription.stop_id).where(StopSubscription.user_id == user_id).order_by(StopSubscription.stop_id)
+    ).scalars().all()
+    return jsonify({'user_id': user_id, 'stop_ids': stop_ids})
+
+@app.route('/api/users/<int:user_id>/stops', methods=['PUT'])
+def set_user_stops(user_id):
+    """Replace a user's stop subscriptions: { "stop_ids": [1, 2] }"""
+    UserNumber.query.get_or_404(user_id)
+    try:
+        data = request.get_json(silent=True) or {}
+        stop_ids = data.get('stop_ids')
+        if not isinstance(stop_ids, list) or not all(isinstance(s, int) and not isinstance(s, bool) for s in stop_ids):
+            return jsonify({'error': 'stop_ids must be a list of stop ids'}), 400
+        stop_ids = sorted(set(stop_ids))
+        known = set(db.session.execute(db.select(JeepneyStop.id).where(JeepneyStop.id.in_(stop_ids))).scalars())
+        unknown = [s for s in stop_ids if s not in known]
+        if unknown:
+            return jsonify({'error': f'Unknown stop ids: {unknown}'}), 400
+        
+        db.session.execute(db.delete(StopSubscription).where(StopSubscription.user_id == user_id))
+        db.session.add_all([StopSubscription(user_id=user_id, stop_id=stop_id) for stop_id in stop_ids])
+        db.session.commit()
+        return jsonify({'success': True, 'user_id': user_id, 'stop_ids': stop_ids})
+        
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error updating stop subscriptions: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/stops')
+@conditional_get('jeepney_stop')
+@cached_response('jeepney_stop')
 def get_stops():
     """Get all jeepney stops"""
-    stops = JeepneyStop.query.all()
-    return jsonify([s.to_dict() for s in stops])
+    rows = db.session.execute(
+        db.select(JeepneyStop.id, JeepneyStop.name, JeepneyStop.latitude, JeepneyStop.longitude, JeepneyStop.description)
+    ).all()
+    return json_response([
+        {'id': stop_id, 'name': name, 'latitude': latitude, 'longitude': longitude, 'description': description}
+        for stop_id, name, latitude, longitude, description in rows
+    ])
 
 @app.route('/api/model/metrics')
+@cached_response('model_metrics')
 def get_model_metrics():
     """Get current model metrics"""
     metrics = ModelMetrics.query.filter_by(is_active=True).first()
     return jsonify(metrics.to_dict() if metrics else {})
 
+@app.route('/api/jobs/runs')
+def get_job_runs():
+    """Get recent scheduled/manual job runs, newest first.
+    Optional query params: job=<job_name>, status=<status>, limit=<n> (default 50, max 500)
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    query = JobRun.query
+    job_name = request.args.get('job')
+    if job_name:
+        query = query.filter_by(job_name=job_name)
+    status = request.args.get('status')
+    if status:
+        query = query.filter_by(status=status)
+    runs = query.order_by(JobRun.started_at.desc(), JobRun.id.desc()).limit(limit).all()
+    return jsonify([r.to_dict() for r in runs])
+
+@app.route('/api/cache/stats')
+def get_cache_stats():
+    """Hit rate and size of this worker's response cache"""
+    return jsonify(response_cache.stats())
+
+@app.route('/api/notifications/stats')
+def get_notification_stats():
+    """OAuth token cache, dead token pruning, provider pacing and delivery mode counters of this worker"""
+    from firebase_service import access_token_cache, token_pruning_stats, fcm_rate_limiter, FCM_DELIVERY_MODE, FCM_BROADCAST_TOPIC
+    from sms_sender import semaphore_rate_limiter
+    return jsonify({'fcm_token': access_token_cache.stats(), 'token_pruning': token_pruning_stats,
+                    'rate_limits': {'fcm': fcm_rate_limiter.stats(), 'semaphore': semaphore_rate_limiter.stats()},
+                    'api_rate_limits': api_rate_limiter.stats(),
+                    'delivery_mode': FCM_DELIVERY_MODE,
+                    'broadcast_topic': FCM_BROADCAST_TOPIC if FCM_DELIVERY_MODE == 'topic' else None})
+
+@app.route('/api/clients/stats')
+def get_client_stats():
+    """Circuit state, cache hits and per-endpoint latency of this worker's external API clients"""
+    return jsonify(client_stats())
+
+@app.route('/api/events')
+def event_stream():
+    """Server-sent events with compact diffs of today's predictions and the stops.
+    Optional query param: topics=predictions,stops (default both)
+    """
+    from events import TOPICS, stream_events
+    requested = {t.strip() for t in request.args.get('topics', ','.join(TOPICS)).split(',') if t.strip()}
+    if not requested or not requested <= set(TOPICS):
+        return jsonify({'error': f'topics must be a subset of {",".join(TOPICS)}'}), 400
+    return Response(stream_events(requested), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/predictions/generate', methods=['POST'])
 def generate_predictions():
     """Manually trigger prediction generation.
@@ -238,12 +423,63 @@ def generate_predictions():
                     pass
         result = generate_daily_predictions(req_date)
         if result.get('success'):
-            return jsonify({'success': True, 'count': result.get('count', 0), 'message': f"Generated {result.get('count', 0)} predictions successfully"})
+            return jsonify({'success': True, 'count': result.get('count', 0), 'job_run_id': result.get('job_run_id'), 'message': f"Generated {result.get('count', 0)} predictions successfully"})
         return jsonify({'error': result.get('error', 'Generation failed')}), 500
     except Exception as e:
         logging.error("Error generating predictions:\n" + traceback.format_exc())
         return jsonify({'error': str(e), 'trace': traceback.format_exc()}), 500
 
+@app.route('/api/observations', methods=['POST'])
+def add_observations():
+    """Record observed passenger counts at stops for the intraday nowcast.
+    Body: { stop_id, passenger_count, observed_at?, source? } or a list of those
+    """
+    try:
+        data = request.get_json(silent=True)
+        items = data if isinstance(data, list) else [data] if data else []
+        if not items:
+            return jsonify({'error': 'No observations provided'}), 400
+        
+        stop_ids = {s.id for s in JeepneyStop.query.with_entities(JeepneyStop.id).all()}
+        observations = []
+        for item in items:
+            if not isinstance(item, dict):
+                return jsonify({'error': f'Invalid observation: {item}'}), 400
+            stop_id = item.get('stop_id')
+            count = item.get('passenger_count')
+            # bool is a subclass of int; true/false are not counts or ids
+            if (isinstance(stop_id, bool) or stop_id not in stop_ids or isinstance(count, bool)
+                    or not isinstance(count, int) or count < 0):
+                return jsonify({'error': f'Invalid observation: {item}'}), 400
+            observed_at = datetime.utcnow()
+            if item.get('observed_at'):
+                try:
+                    observed_at = datetime.fromisoformat(str(item['observed_at']))
+                except ValueError:
+                    return jsonify({'error': 'observed_at must be an ISO 8601 datetime (UTC)'}), 400
+                if observed_at.tzinfo is not None:
+                    # Stored as naive UTC like every other timestamp
+                    observed_at = observed_at.astimezone(timezone.utc).replace(tzinfo=None)
+            observations.append(StopObservation(stop_id=stop_id, passenger_count=count,
+                                                observed_at=observed_at, source=item.get('source')))
+        db.session.add_all(observations)
+        db.session.commit()
+        return jsonify({'success': True, 'count': len(observations)})
+        
+    except Exception as e:
+        logging.error(f"Error adding observations: {str(e)}")
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/predictions/nowcast', methods=['POST'])
+def trigger_nowcast():
+    """Manually re-score today's forecast for stops with new observations"""
+    from nowcast import run_nowcast
+    result = run_nowcast(trigger='manual')
+    if result.get('success'):
+        return jsonify(result)
+    return jsonify({'error': result.get('error', 'Nowcast failed')}), 500
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Not found'}), 404
@@ -254,19 +490,172 @@ def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 @app.route('/api/predictions')
 def get_all_predictions():
-    """Get all predictions"""
-    predictions = Prediction.query.all()
-    return jsonify([p.to_dict() for p in predictions])
+    """Get prediction history, newest first, 100 per page by default"""
+    return prediction_list_response(default_limit=100)
+
+EXPORT_COLUMNS = [
+    'id', 'stop_name', 'prediction_date', 'predicted_passengers', 'peak_hour', 'confidence_score',
+    'is_school_dismissal', 'is_high_tide', 'is_public_holiday', 'is_weekend', 'message',
+    'is_sent', 'created_at', 'sent_at'
+]
+
+@app.route('/api/predictions/export')
+def export_predictions():
+    """Stream the prediction history as NDJSON (default) or CSV.
+    Query params: format=ndjson|csv, gzip=1, plus the stop_id/from/to/is_sent list filters.
+    Rows are read in fixed-size keyset batches and sent as they are produced.
+    """
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    try:
+        filters = parse_prediction_filters(request.args)
+    except QueryParamError as e:
+        return jsonify({'error': str(e)}), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    
+    def encode_batches():
+        if export_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            yield buffer.getvalue().encode('utf-8')
+            for rows in iter_prediction_batches(filters):
+                buffer.seek(0)
+                buffer.truncate()
+                iso = IsoStrings()
+                for row in rows:
+                    item = row_to_dict(row, iso)
+                    writer.writerow([item[c] for c in EXPORT_COLUMNS])
+                yield buffer.getvalue().encode('utf-8')
+        else:
+            for rows in iter_prediction_batches(filters):
+                yield b''.join(dumps(item) + b'\n' for item in rows_to_dicts(rows))
+    
+    def generate():
+        if not compress:
+            yield from encode_batches()
+            return
+        # gzip container, flushed per batch so the client receives data immediately
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in encode_batches():
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    headers = {'Content-Disposition': f'attachment; filename=predictions.{export_format}'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+@app.route('/api/predictions/curves')
+def get_prediction_curves():
+    """Get the 24-hour forecast curve of many stops in one response.
+    Query params: date=YYYY-MM-DD (default today), stop_id=1,2,3 (default all stops)
+    """
+    try:
+        prediction_date = date.today()
+        if request.args.get('date'):
+            prediction_date = datetime.strptime(request.args['date'], '%Y-%m-%d').date()
+        stop_ids = [int(v) for v in request.args.get('stop_id', '').split(',') if v.strip()]
+    except ValueError:
+        return jsonify({'error': 'Invalid parameters. Use date=YYYY-MM-DD and stop_id=1,2,3'}), 400
+    
+    # Column-only select: rows come back as tuples, no Prediction objects are built
+    query = (
+        db.select(Prediction.stop_id, JeepneyStop.name, Prediction.peak_hour, Prediction.hourly_curve)
+        .join(JeepneyStop, JeepneyStop.id == Prediction.stop_id)
+        .where(Prediction.prediction_date == prediction_date)
+        .order_by(Prediction.stop_id)
+    )
+    if stop_ids:
+        query = query.where(Prediction.stop_id.in_(stop_ids))
+    rows = db.session.execute(query).all()
+    return jsonify({
+        'date': prediction_date.isoformat(),
+        'curves': [
+            {'stop_id': stop_id, 'stop_name': name, 'peak_hour': peak_hour, 'hourly': unpack_hourly_curve(curve)}
+            for stop_id, name, peak_hour, curve in rows
+        ]
+    })
+
+@app.route('/api/predictions/archive')
+def get_archived_predictions():
+    """Predictions moved out of the hot table by the retention job.
+    Query params: from=YYYY-MM-DD, to=YYYY-MM-DD (default the last 31 days, at most 366 days), stop_id=1,2
+    """
+    from retention import query_archive
+    try:
+        filters = parse_prediction_filters(request.args)
+    except QueryParamError as e:
+        return jsonify({'error': str(e)}), 400
+    date_to = filters.get('date_to') or date.today()
+    date_from = filters.get('date_from') or date_to - timedelta(days=31)
+    if date_from > date_to or (date_to - date_from).days > 366:
+        return jsonify({'error': 'from must be before to and the range at most 366 days'}), 400
+    return json_response(query_archive(date_from, date_to, filters.get('stop_ids')))
+
+@app.route('/api/predictions/rollups')
+def get_prediction_rollups():
+    """Per-stop weekly or monthly summaries of archived predictions.
+    Query params: period=week|month (default month), from=YYYY-MM-DD, to=YYYY-MM-DD, stop_id=1,2
+    """
+    try:
+        filters = parse_prediction_filters(request.args)
+    except QueryParamError as e:
+        return jsonify({'error': str(e)}), 400
+    period = request.args.get('period', 'month')
+    if period not in ('week', 'month'):
+        return jsonify({'error': 'period must be week or month'}), 400
+    query = (
+        db.select(PredictionRollup, JeepneyStop.name)
+        .join(JeepneyStop, JeepneyStop.id == PredictionRollup.stop_id)
+        .where(PredictionRollup.period == period)
+        .order_by(PredictionRollup.period_start.desc(), PredictionRollup.stop_id)
+    )
+    if filters.get('stop_ids'):
+        query = query.where(PredictionRollup.stop_id.in_(filters['stop_ids']))
+    if filters.get('date_from'):
+        query = query.where(PredictionRollup.period_end >= filters['date_from'])
+    if filters.get('date_to'):
+        query = query.where(PredictionRollup.period_start <= filters['date_to'])
+    rollups = []
+    for rollup, stop_name in db.session.execute(query).all():
+        item = rollup.to_dict()
+        item['stop_name'] = stop_name
+        rollups.append(item)
+    return json_response(rollups)
+
+@app.route('/api/sync')
+def delta_sync():
+    """Changes to stops and predictions since a change version, for mobile/offline clients.
+    Query params: since=<version> (0 or omitted for a full snapshot),
+    from=YYYY-MM-DD (oldest prediction date to include, default today).
+    Call again with the returned version while more is true.
+    """
+    from delta_sync import build_sync_payload
+    try:
+        since = int(request.args.get('since', 0))
+        since_date = date.today()
+        if request.args.get('from'):
+            since_date = datetime.strptime(request.args['from'], '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Invalid parameters. Use since=<integer version> and from=YYYY-MM-DD'}), 400
+    try:
+        return json_response(build_sync_payload(since, since_date))
+    except Exception as e:
+        logging.error(f"Error building sync payload: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/predictions/<date>')
+@conditional_get('prediction', 'jeepney_stop')
 def get_predictions_by_date(date):
     """Get predictions for specific date"""
     try:
         prediction_date = datetime.strptime(date, '%Y-%m-%d').date()
-        predictions = Prediction.query.filter_by(prediction_date=prediction_date).all()
-        return jsonify([p.to_dict() for p in predictions])
     except ValueError:
         return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+    return prediction_list_response(prediction_date)
 
 # Removed duplicate definition above
 
@@ -280,9 +669,8 @@ def api_admin_create_profile():
         profile = data.get('profile') or {}
         if not uid or role not in ('driver','passenger'):
             return jsonify({'success': False, 'error': 'uid and valid role required'}), 400
-        # write both all_users and role-specific node
-        write_user_profile(uid, profile)
-        write_role_profile(role, uid, profile)
+        # write both all_users and role-specific node in one multi-path update
+        write_profiles(profile_paths(role, uid, profile))
         return jsonify({'success': True})
     except Exception as e:
         logging.error('api_admin_create_profile failed: %s', e)
@@ -308,6 +696,60 @@ def api_admin_create_account():
         logging.error('api_admin_create_account failed: %s', e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/admin/import_accounts', methods=['POST'])
+def api_admin_import_accounts():
+    """Bulk create or link drivers/passengers and upsert their RTDB profiles.
+    Accepts a multipart 'file' (.csv or .json), a text/csv body, or a JSON body
+    (a list of accounts or { accounts: [...] }). Columns/keys: name, email, password?,
+    role?, phone?, notes?, route?, plate?; ?role=driver|passenger sets the default role.
+    Runs in the background: returns 202 with a job id for GET /api/admin/import_accounts/<id>,
+    which gives a result per row: created, linked, duplicate, invalid or failed.
+    """
+    from account_import import ImportFormatError, ACCOUNT_IMPORT_MAX_ROWS, parse_accounts, start_import
+    try:
+        upload = request.files.get('file')
+        if upload:
+            fmt = 'json' if upload.filename.lower().endswith('.json') else 'csv'
+            content = upload.read().decode('utf-8-sig')
+        elif request.is_json:
+            fmt, content = 'json', request.get_data(as_text=True)
+        else:
+            fmt, content = 'csv', request.get_data(as_text=True)
+        rows = parse_accounts(content, fmt)
+    except (ImportFormatError, UnicodeDecodeError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if not rows:
+        return jsonify({'success': False, 'error': 'No accounts provided'}), 400
+    if len(rows) > ACCOUNT_IMPORT_MAX_ROWS:
+        return jsonify({'success': False, 'error': f'At most {ACCOUNT_IMPORT_MAX_ROWS} rows per import'}), 400
+    
+    default_role = request.values.get('role')
+    if default_role and default_role not in ('driver', 'passenger'):
+        return jsonify({'success': False, 'error': 'role must be driver or passenger'}), 400
+    try:
+        result = start_import(rows, default_role)
+        if not result.get('success'):
+            return jsonify(result), 500
+        job = result['job']
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'total': job.total,
+            'status': job.status,
+            'status_url': f'/api/admin/import_accounts/{job.id}',
+            'message': f'Import queued for {job.total} row(s)'
+        }), 202
+    except Exception as e:
+        db.session.rollback()
+        logging.error('api_admin_import_accounts failed: %s', e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/admin/import_accounts/<int:job_id>', methods=['GET'])
+def api_admin_import_job(job_id):
+    """Progress of a bulk account import: processed rows, counts by result and, per row, its result"""
+    job = AccountImportJob.query.get_or_404(job_id)
+    return jsonify({'success': True, **job.to_dict()})
+
 # --- Serve favicon for dev server to avoid 404 spam ---
 @app.route('/favicon.ico')
 def favicon():
@@ -332,30 +774,37 @@ def serve_uploads(subpath):
 @rate_limit(max_requests=10, window_seconds=60)  # Add this line
 def send_sms():
     """
-    Send SMS via Semaphore API
-    Accepts phone numbers from request or fetches from Firebase
-    Keeps API key secure on server side
+    Queue a bulk SMS job via Semaphore API
+    Accepts phone numbers from request and/or "audience": "all_active_users"
+    Keeps API key secure on server side; returns a job id for GET /api/sms/jobs/<id>
     """
     try:
         # Check if API key is configured
-        if not SEMAPHORE_API_KEY:
+        if not sms_sender.configured:
             return jsonify({
                 'success': False,
                 'error': 'Semaphore API key not configured. Set SEMAPHORE_API_KEY in environment variables.'
             }), 500
         
         # Get request data
-        data = request.get_json()
+        data = request.get_json(silent=True)
         
         if not data:
             return jsonify({'success': False, 'error': 'No data provided'}), 400
         
-        numbers = data.get('numbers', [])
+        numbers = data.get('numbers') or []
+        audience = data.get('audience')
         message = data.get('message', '')
         sender_name = data.get('sender_name', os.environ.get('SEMAPHORE_SENDER_NAME', 'JEEPNI'))
         
         # Validate inputs
-        if not numbers or len(numbers) == 0:
+        if not isinstance(numbers, list):
+            return jsonify({'success': False, 'error': 'numbers must be a list'}), 400
+        
+        if audience not in (None, 'all_active_users'):
+            return jsonify({'success': False, 'error': 'audience must be "all_active_users"'}), 400
+        
+        if not numbers and audience is None:
             return jsonify({'success': False, 'error': 'No phone numbers provided'}), 400
         
         if not message or len(message.strip()) == 0:
@@ -375,125 +824,41 @@ def send_sms():
                 'error': f'Message exceeds 160 characters (current: {len(message.strip())}). Please shorten your message.'
             }), 400
         
-        # Limit recipients per API call (Semaphore allows up to 1000)
-        if len(numbers) > 1000:
-            return jsonify({
-                'success': False,
-                'error': 'Maximum 1000 recipients per request'
-            }), 400
-        
-        # Validate phone number format (Philippine numbers)
-        validated_numbers = []
-        invalid_numbers = []
-        
-        for number in numbers:
-            cleaned = ''.join(filter(str.isdigit, str(number)))
-            
-            # Philippine mobile format: 639XXXXXXXXX (12 digits)
-            if len(cleaned) == 12 and cleaned.startswith('639'):
-                validated_numbers.append(cleaned)
-            elif len(cleaned) == 11 and cleaned.startswith('09'):
-                # Convert 09XX to 639XX
-                validated_numbers.append('63' + cleaned[1:])
-            elif len(cleaned) == 10 and cleaned.startswith('9'):
-                # Convert 9XX to 639XX
-                validated_numbers.append('63' + cleaned)
-            else:
-                invalid_numbers.append(number)
-        
+        # Explicit numbers must all be valid; stored user numbers that are not are skipped
+        invalid_numbers = [n for n in numbers if normalize_number(n) is None]
         if invalid_numbers:
+            shown = ", ".join(str(n) for n in invalid_numbers[:20])
             return jsonify({
                 'success': False,
-                'error': f'Invalid phone number format: {", ".join(invalid_numbers)}. Use format: 639XXXXXXXXX'
+                'error': f'Invalid phone number format: {shown}. Use format: 639XXXXXXXXX'
             }), 400
         
-        if not validated_numbers:
+        job = enqueue_sms(numbers, message.strip(), sender_name, include_active_users=audience == 'all_active_users')
+        if not job['total']:
+            db.session.rollback()
             return jsonify({
                 'success': False,
                 'error': 'No valid phone numbers after validation'
             }), 400
+        db.session.commit()
         
-        # Prepare Semaphore API request
-        # Join numbers with commas as per Semaphore API documentation
-        numbers_string = ','.join(validated_numbers)
-        
-        semaphore_data = {
-            'apikey': SEMAPHORE_API_KEY,
-            'number': numbers_string,
-            'message': message.strip(),
-            'sendername': sender_name
-        }
-        
-        # Log the request (excluding sensitive data)
-        logging.info(f"Sending SMS to {len(validated_numbers)} recipient(s) via Semaphore API")
-        
-        # Make request to Semaphore API
-        response = requests.post(
-            SEMAPHORE_API_URL,
-            data=semaphore_data,
-            timeout=30
-        )
-        
-        # Parse response
-        response_data = response.json()
-        
-        # Check if request was successful
-        if response.status_code != 200:
-            error_message = 'Failed to send SMS'
-            if isinstance(response_data, list) and len(response_data) > 0:
-                # Semaphore returns array of results
-                first_result = response_data[0]
-                if 'status' in first_result and first_result['status'] == 'Failed':
-                    error_message = f"SMS failed: {first_result.get('message', 'Unknown error')}"
-            
-            logging.error(f"Semaphore API error: {response.status_code} - {response_data}")
-            return jsonify({
-                'success': False,
-                'error': error_message,
-                'details': response_data
-            }), response.status_code
-        
-        # Count successful and failed sends
-        successful = 0
-        failed = 0
-        
-        if isinstance(response_data, list):
-            for result in response_data:
-                status = result.get('status', '').lower()
-                if status in ['queued', 'pending', 'sent']:
-                    successful += 1
-                else:
-                    failed += 1
-        else:
-            # Single message response
-            successful = len(validated_numbers)
-        
-        logging.info(f"SMS sent: {successful} succeeded, {failed} failed")
+        broadcast_id = job['broadcast'].id
+        start_broadcast(broadcast_id)
+        logging.info(f"Queued SMS job {broadcast_id} for {job['total']} recipient(s) "
+                     f"({job['duplicates']} duplicates, {len(job['invalid'])} invalid skipped)")
         
         return jsonify({
             'success': True,
-            'successful': successful,
-            'failed': failed,
-            'total': len(validated_numbers),
-            'message': f'SMS sent to {successful} recipient(s)',
-            'details': response_data
-        })
-        
-    except requests.exceptions.Timeout:
-        logging.error("Semaphore API request timed out")
-        return jsonify({
-            'success': False,
-            'error': 'Request timed out. Please try again.'
-        }), 504
-        
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Semaphore API request error: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': f'Network error: {str(e)}'
-        }), 500
+            'job_id': broadcast_id,
+            'total': job['total'],
+            'duplicates': job['duplicates'],
+            'invalid_skipped': len(job['invalid']),
+            'status_url': f'/api/sms/jobs/{broadcast_id}',
+            'message': f'SMS queued for {job["total"]} recipient(s)'
+        }), 202
         
     except Exception as e:
+        db.session.rollback()
         logging.error(f"Error sending SMS: {str(e)}")
         logging.error(traceback.format_exc())
         return jsonify({
@@ -502,6 +867,15 @@ def send_sms():
         }), 500
 
 
+@app.route('/api/sms/jobs/<int:job_id>', methods=['GET'])
+def get_sms_job(job_id):
+    """Progress of a bulk SMS job: task counts by status (sent, failed, unconfirmed, pending)"""
+    broadcast = DeliveryBroadcast.query.get_or_404(job_id)
+    if broadcast.kind != 'sms':
+        return jsonify({'success': False, 'error': 'Not an SMS job'}), 404
+    return jsonify(broadcast_status(broadcast))
+
+
 @app.route('/api/sms/balance', methods=['GET'])
 @rate_limit(max_requests=30, window_seconds=60)  # Add this line
 def get_sms_balance():
@@ -515,20 +889,21 @@ def get_sms_balance():
                 'error': 'Semaphore API key not configured'
             }), 500
         
-        # Make request to Semaphore account API
-        response = requests.get(
-            'https://api.semaphore.co/api/v4/account',
-            params={'apikey': SEMAPHORE_API_KEY},
-            timeout=10
-        )
+        # Pooled and cached for SEMAPHORE_ACCOUNT_TTL seconds, so dashboard refreshes rarely reach Semaphore
+        try:
+            status_code, account_data = sms_sender.account()
+        except CircuitOpenError:
+            return jsonify({
+                'success': False,
+                'error': 'SMS provider unavailable'
+            }), 503
         
-        if response.status_code != 200:
+        if status_code != 200:
             return jsonify({
                 'success': False,
                 'error': 'Failed to fetch account balance'
-            }), response.status_code
+            }), status_code
         
-        account_data = response.json()
         
         return jsonify({
             'success': True,
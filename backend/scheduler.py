@@ -4,19 +4,27 @@ import os
 import threading
 from datetime import datetime, date, timedelta, time
 from app import app, db
-from models import JeepneyStop, Prediction, ModelMetrics
+from models import JeepneyStop, Prediction, ModelMetrics, pack_hourly_curve
 from data_generator import PassengerDataGenerator
 # Lazy import ML pipeline; it may not be available in some environments
 try:
-    from ml_pipeline import generate_prediction_for_stop  # type: ignore
+    from ml_pipeline import generate_prediction_for_stop, load_forecasting_model  # type: ignore
 except Exception:
     def generate_prediction_for_stop(*args, **kwargs):
         return None
+
+    def load_forecasting_model():
+        return None
+from job_tracking import JobRunTracker
+from response_cache import response_cache
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 import random
 
 
-DATASET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'passenger_demand_data.csv')
+NOWCAST_INTERVAL_MINUTES = int(os.environ.get('NOWCAST_INTERVAL_MINUTES', '5'))
+DELIVERY_RESUME_INTERVAL_SECONDS = int(os.environ.get('DELIVERY_RESUME_INTERVAL_SECONDS', '60'))
+DATASET_FILE = os.environ.get('DATASET_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'passenger_demand_data.csv')
 _DATASET_COLUMNS = [
     'datetime', 'stop_name', 'latitude', 'longitude', 'stop_type', 'passenger_count',
     'hour_of_day', 'day_of_week', 'is_weekend', 'is_public_holiday', 'is_school_dismissal_time',
@@ -88,68 +96,101 @@ def _heuristic_prediction(stop_name: str, prediction_date: date):
     except Exception:
         return None
 
-def generate_daily_predictions(target_date=None):
+def generate_daily_predictions(target_date=None, trigger='manual'):
     """Generate predictions for all stops for a specific date (default: today).
     Uses ML model when available, falls back to a heuristic to avoid hard failures.
+    Each run is recorded as a JobRun with per-phase timings.
     """
     try:
         with app.app_context():
             today = target_date or date.today()
-            
-            # Check if predictions already exist for today
-            existing_predictions = Prediction.query.filter_by(prediction_date=today).all()
-            if existing_predictions:
-                logging.info(f"Deleting {len(existing_predictions)} existing predictions for {today}")
-                # Delete existing predictions to regenerate fresh ones
-                for prediction in existing_predictions:
-                    db.session.delete(prediction)
-                db.session.commit()
-            
-            # Get all stops
-            stops = JeepneyStop.query.all()
-            predictions_created = 0
-            
-            for stop in stops:
+            with JobRunTracker('daily_predictions', trigger=trigger, target_date=today) as tracker:
                 try:
-                    # Generate prediction for this stop
-                    prediction_data = generate_prediction_for_stop(stop, today)
-                    # Fallback when ML path is unavailable or errors
-                    if not prediction_data:
-                        prediction_data = _heuristic_prediction(stop.name, today)
-                    
-                    if prediction_data:
-                        # Create prediction record
-                        prediction = Prediction(
-                            stop_id=stop.id,
-                            prediction_date=today,
-                            predicted_passengers=prediction_data['predicted_passengers'],
-                            peak_hour=prediction_data['peak_hour'],
-                            confidence_score=prediction_data['confidence_score'],
-                            is_school_dismissal=prediction_data['is_school_dismissal'],
-                            is_high_tide=prediction_data['is_high_tide'],
-                            is_public_holiday=prediction_data['is_public_holiday'],
-                            is_weekend=prediction_data['is_weekend'],
-                            message=prediction_data['message']
-                        )
-                        
-                        db.session.add(prediction)
-                        predictions_created += 1
-                        _append_prediction_to_dataset(stop, today, prediction_data)
-                        
+                    return _generate_predictions_for_date(today, tracker)
                 except Exception as e:
-                    logging.error(f"Error generating prediction for stop {stop.name}: {str(e)}")
-                    continue
-            
-            db.session.commit()
-            logging.info(f"Generated {predictions_created} predictions for {today}")
-            
-            return {'success': True, 'count': predictions_created}
+                    tracker.fail(str(e))
+                    raise
             
     except Exception as e:
         logging.error(f"Error in generate_daily_predictions: {str(e)}")
         db.session.rollback()
         return {'success': False, 'error': str(e)}
 
+def _generate_predictions_for_date(today, tracker):
+    """Replace the stored predictions for one date, timing each phase on the tracker"""
+    # Check if predictions already exist for today
+    with tracker.phase('db_write'):
+        existing_predictions = Prediction.query.filter_by(prediction_date=today).all()
+        if existing_predictions:
+            logging.info(f"Deleting {len(existing_predictions)} existing predictions for {today}")
+            # Delete existing predictions to regenerate fresh ones
+            for prediction in existing_predictions:
+                db.session.delete(prediction)
+            db.session.commit()
+            tracker.count('predictions_deleted', len(existing_predictions))
+    
+    # Get all stops
+    stops = JeepneyStop.query.all()
+    tracker.count('stops', len(stops))
+    predictions_created = 0
+    
+    # Load the model once for the whole run instead of once per stop
+    with tracker.phase('model_load'):
+        try:
+            model = load_forecasting_model()
+        except Exception as e:
+            # e.g. a corrupt pickle: every stop falls back to the heuristic below
+            logging.error(f"Error loading forecasting model, using heuristic predictions: {str(e)}")
+            model = None
+    
+    for stop in stops:
+        try:
+            # Generate prediction for this stop
+            prediction_data = None
+            if model is not None:
+                prediction_data = generate_prediction_for_stop(stop, today, model=model, tracker=tracker)
+            # Fallback when ML path is unavailable or errors
+            if not prediction_data:
+                with tracker.phase('inference'):
+                    prediction_data = _heuristic_prediction(stop.name, today)
+                tracker.count('heuristic_fallbacks')
+            
+            if prediction_data:
+                # Create prediction record
+                with tracker.phase('db_write'):
+                    prediction = Prediction(
+                        stop_id=stop.id,
+                        prediction_date=today,
+                        predicted_passengers=prediction_data['predicted_passengers'],
+                        peak_hour=prediction_data['peak_hour'],
+                        confidence_score=prediction_data['confidence_score'],
+                        is_school_dismissal=prediction_data['is_school_dismissal'],
+                        is_high_tide=prediction_data['is_high_tide'],
+                        is_public_holiday=prediction_data['is_public_holiday'],
+                        is_weekend=prediction_data['is_weekend'],
+                        message=prediction_data['message'],
+                        hourly_curve=pack_hourly_curve(prediction_data.get('hourly_demand'))
+                    )
+                    
+                    db.session.add(prediction)
+                predictions_created += 1
+                with tracker.phase('dataset_append'):
+                    _append_prediction_to_dataset(stop, today, prediction_data)
+                tracker.count('dataset_rows_appended')
+                
+        except Exception as e:
+            logging.error(f"Error generating prediction for stop {stop.name}: {str(e)}")
+            tracker.count('stop_errors')
+            continue
+    
+    with tracker.phase('db_write'):
+        db.session.commit()
+    response_cache.invalidate('prediction')
+    tracker.count('predictions_created', predictions_created)
+    logging.info(f"Generated {predictions_created} predictions for {today}")
+    
+    return {'success': True, 'count': predictions_created, 'job_run_id': tracker.run_id}
+
 def setup_daily_prediction_job(scheduler):
     """Setup the daily prediction generation job"""
     try:
@@ -157,6 +198,7 @@ def setup_daily_prediction_job(scheduler):
         scheduler.add_job(
             func=generate_daily_predictions,
             trigger=CronTrigger(hour=6, minute=0),
+            kwargs={'trigger': 'scheduled'},
             id='daily_predictions',
             name='Generate Daily Predictions',
             replace_existing=True
@@ -164,13 +206,52 @@ def setup_daily_prediction_job(scheduler):
         
         logging.info("Daily prediction job scheduled for 6:00 AM")
         
+        # Re-score stops with fresh observations every few minutes
+        from nowcast import run_nowcast
+        scheduler.add_job(
+            func=run_nowcast,
+            trigger=IntervalTrigger(minutes=NOWCAST_INTERVAL_MINUTES),
+            id='intraday_nowcast',
+            name='Intraday Nowcast',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
+        logging.info(f"Intraday nowcast job scheduled every {NOWCAST_INTERVAL_MINUTES} minutes")
+        
+        # Move predictions past the retention window into the archive, nightly
+        from retention import run_retention
+        scheduler.add_job(
+            func=run_retention,
+            trigger=CronTrigger(hour=3, minute=30),
+            kwargs={'trigger': 'scheduled'},
+            id='prediction_retention',
+            name='Prediction Retention',
+            replace_existing=True,
+            max_instances=1
+        )
+        logging.info("Prediction retention job scheduled for 3:30 AM")
+        
+        # Pick up broadcasts whose worker stopped before finishing
+        from delivery_scheduler import resume_broadcasts
+        scheduler.add_job(
+            func=resume_broadcasts,
+            trigger=IntervalTrigger(seconds=DELIVERY_RESUME_INTERVAL_SECONDS),
+            id='delivery_resume',
+            name='Resume Notification Deliveries',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
+        logging.info(f"Delivery resume job scheduled every {DELIVERY_RESUME_INTERVAL_SECONDS} seconds")
+        
         # Also generate predictions for today if none exist
         with app.app_context():
             today = date.today()
             existing_predictions = Prediction.query.filter_by(prediction_date=today).count()
             if existing_predictions == 0:
                 logging.info("No predictions found for today, generating now...")
-                generate_daily_predictions()
+                generate_daily_predictions(trigger='startup')
         
     except Exception as e:
         logging.error(f"Error setting up daily prediction job: {str(e)}")
@@ -0,0 +1,54 @@
+import json
+import logging
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    logging.warning("orjson not available, falling back to the json module. Install with: pip install orjson")
+
+from app import app
+
+
+def _default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode obj as compact UTF-8 JSON (orjson when installed)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=_default).encode('utf-8')
+
+
+def json_response(obj: Any, status: int = 200, headers: Optional[Dict] = None):
+    """Drop-in for jsonify() on hot list endpoints"""
+    return app.response_class(dumps(obj), status=status, mimetype='application/json', headers=headers)
+
+
+class IsoStrings:
+    """Memoized isoformat() for the dates and timestamps of one result set.
+    List rows share a handful of prediction dates and batch-written created_at
+    values, so most lookups are a dict hit instead of a new string.
+    """
+
+    __slots__ = ('_cache',)
+
+    def __init__(self):
+        self._cache: Dict[Any, str] = {}
+
+    def __call__(self, value) -> Optional[str]:
+        if value is None:
+            return None
+        text = self._cache.get(value)
+        if text is None:
+            text = self._cache[value] = value.isoformat()
+        return text
+
+
+__all__ = ['dumps', 'json_response', 'IsoStrings', 'ORJSON_AVAILABLE']
@@ -0,0 +1,164 @@
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from http_clients import CircuitOpenError, ServiceClient, get_client
+from token_bucket import TokenBucket
+
+SEMAPHORE_API_URL = os.environ.get('SEMAPHORE_API_URL', 'https://api.semaphore.co/api/v4/messages')
+SEMAPHORE_ACCOUNT_URL = os.environ.get('SEMAPHORE_ACCOUNT_URL', 'https://api.semaphore.co/api/v4/account')
+# Seconds the account balance is served from cache
+SEMAPHORE_ACCOUNT_TTL = float(os.environ.get('SEMAPHORE_ACCOUNT_TTL', '30'))
+# Semaphore accepts up to 1000 comma separated recipients per call
+SEMAPHORE_MAX_RECIPIENTS = 1000
+# The messages endpoint allows 120 calls per minute per account
+SEMAPHORE_CALLS_PER_MINUTE = float(os.environ.get('SEMAPHORE_CALLS_PER_MINUTE', '120'))
+# Chunks in flight at once, and the connection pool sized to match
+SMS_MAX_WORKERS = int(os.environ.get('SMS_MAX_WORKERS', '4'))
+
+_ACCEPTED_STATUSES = {'queued', 'pending', 'sent'}
+
+
+def normalize_number(number) -> Optional[str]:
+    """Philippine mobile number as 639XXXXXXXXX, or None when it is not one"""
+    cleaned = ''.join(filter(str.isdigit, str(number)))
+    if len(cleaned) == 12 and cleaned.startswith('639'):
+        return cleaned
+    if len(cleaned) == 11 and cleaned.startswith('09'):
+        return '63' + cleaned[1:]
+    if len(cleaned) == 10 and cleaned.startswith('9'):
+        return '63' + cleaned
+    return None
+
+
+def prepare_recipients(numbers: Iterable) -> Tuple[List[str], List, int]:
+    """Normalize and dedupe in one pass; returns (numbers in first-seen order, invalid inputs, duplicates)"""
+    seen = set()
+    valid, invalid = [], []
+    duplicates = 0
+    for raw in numbers:
+        number = normalize_number(raw)
+        if number is None:
+            invalid.append(raw)
+        elif number in seen:
+            duplicates += 1
+        else:
+            seen.add(number)
+            valid.append(number)
+    return valid, invalid, duplicates
+
+
+class _UncachedResponse(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(status_code)
+        self.status_code = status_code
+
+
+class SemaphoreSender:
+    """Sends SMS through the Semaphore messages API over one pooled session.
+
+    send() posts one call for up to SEMAPHORE_MAX_RECIPIENTS numbers and returns
+    {'ok', 'status', 'error', 'accepted', 'rejected', 'unconfirmed', 'deferred', 'details'}.
+    When the call times out or the connection drops, Semaphore may still have
+    queued the messages, so those numbers are reported as unconfirmed rather
+    than failed and are never resent automatically. While Semaphore's circuit is
+    open nothing is sent and the numbers come back as deferred.
+    """
+
+    def __init__(self, api_url: str = SEMAPHORE_API_URL, api_key: Optional[str] = None,
+                 limiter: Optional[TokenBucket] = None, timeout=(3, 30), client: Optional[ServiceClient] = None):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.limiter = limiter
+        self.timeout = timeout
+        self.client = client or ServiceClient('semaphore', pool_size=SMS_MAX_WORKERS, timeout=timeout)
+
+    @property
+    def configured(self) -> bool:
+        return bool(self._api_key())
+
+    def _api_key(self) -> str:
+        return self.api_key if self.api_key is not None else os.environ.get('SEMAPHORE_API_KEY', '')
+
+    @property
+    def session(self) -> requests.Session:
+        return self.client.session
+
+    def account(self) -> Tuple[int, Optional[Dict]]:
+        """(status code, account JSON) of the Semaphore account, cached for SEMAPHORE_ACCOUNT_TTL seconds.
+        Failed lookups are not cached; raises requests.RequestException (CircuitOpenError included).
+        """
+        def load():
+            response = self.client.get(SEMAPHORE_ACCOUNT_URL, endpoint='account', params={'apikey': self._api_key()},
+                                       timeout=(3, 10))
+            if response.status_code != 200:
+                raise _UncachedResponse(response.status_code)
+            return response.status_code, response.json()
+
+        try:
+            return self.client.cached('account', SEMAPHORE_ACCOUNT_TTL, load)
+        except _UncachedResponse as e:
+            return e.status_code, None
+
+    def send(self, numbers: List[str], message: str, sender_name: Optional[str] = None) -> Dict:
+        result = {'ok': False, 'status': None, 'error': None, 'accepted': [], 'rejected': [],
+                  'unconfirmed': [], 'deferred': [], 'details': None}
+        if len(numbers) > SEMAPHORE_MAX_RECIPIENTS:
+            raise ValueError(f'At most {SEMAPHORE_MAX_RECIPIENTS} recipients per call')
+        if self.limiter is not None:
+            self.limiter.acquire()
+        try:
+            response = self.client.post(self.api_url, endpoint='messages', timeout=self.timeout, data={
+                'apikey': self._api_key(),
+                'number': ','.join(numbers),
+                'message': message,
+                'sendername': sender_name or os.environ.get('SEMAPHORE_SENDER_NAME', 'JEEPNI')
+            })
+        except CircuitOpenError:
+            result['error'] = 'CIRCUIT_OPEN'
+            result['deferred'] = list(numbers)
+            return result
+        except requests.RequestException as e:
+            logging.error(f"Semaphore API request error: {str(e)}")
+            result['error'] = type(e).__name__
+            result['unconfirmed'] = list(numbers)
+            return result
+
+        result['status'] = response.status_code
+        try:
+            details = response.json()
+        except ValueError:
+            details = None
+        result['details'] = details
+        if response.status_code != 200:
+            logging.error(f"Semaphore API error: {response.status_code} - {details}")
+            result['error'] = f'HTTP {response.status_code}'
+            result['rejected'] = list(numbers)
+            return result
+
+        result['ok'] = True
+        if isinstance(details, list):
+            by_number = {}
+            for item in details:
+                recipient = normalize_number(item.get('recipient', '')) if isinstance(item, dict) else None
+                if recipient:
+                    by_number[recipient] = str(item.get('status', '')).lower()
+            for number in numbers:
+                # Numbers missing from the answer were accepted with the call
+                if by_number.get(number, 'queued') in _ACCEPTED_STATUSES:
+                    result['accepted'].append(number)
+                else:
+                    result['rejected'].append(number)
+        else:
+            result['accepted'] = list(numbers)
+        return result
+
+
+semaphore_rate_limiter = TokenBucket(SEMAPHORE_CALLS_PER_MINUTE / 60, 1)
+sms_sender = SemaphoreSender(limiter=semaphore_rate_limiter,
+                             client=get_client('semaphore', pool_size=SMS_MAX_WORKERS, timeout=(3, 30)))
+
+
+__all__ = ['SemaphoreSender', 'normalize_number', 'prepare_recipients', 'SMS_MAX_WORKERS', 'sms_sender', 'semaphore_rate_limiter', 'SEMAPHORE_MAX_RECIPIENTS']
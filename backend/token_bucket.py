@@ -0,0 +1,48 @@
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Thread-safe token bucket pacing calls to an external provider.
+
+    Holds up to `capacity` tokens and refills `rate` tokens per second. acquire()
+    reserves tokens right away and sleeps off any deficit, so concurrent callers
+    are served in arrival order without polling. A rate of 0 disables pacing.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(self.rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.waited_seconds = 0.0
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Take tokens, blocking until the bucket can cover them; returns the seconds waited"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.acquired += tokens
+            self.waited_seconds += wait
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def stats(self):
+        return {
+            'rate_per_s': self.rate,
+            'capacity': self.capacity,
+            'acquired': self.acquired,
+            'waited_seconds': round(self.waited_seconds, 3)
+        }
+
+
+__all__ = ['TokenBucket']
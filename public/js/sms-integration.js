@@ -116,11 +116,12 @@ export function isValidPhoneNumber(phone) {
 }
 
 /**
- * Send SMS via backend proxy (routes.py)
+ * Queue an SMS job via backend proxy (routes.py)
+ * The backend answers 202 right away; poll the job with waitForSMSJob() for the outcome.
  * @param {Array<string>} phoneNumbers - Array of phone numbers
  * @param {string} message - Message content (max 160 chars)
  * @param {string} senderName - Sender name (default: JEEPNI)
- * @returns {Promise<Object>} Response from API
+ * @returns {Promise<Object>} { success, job_id, status_url, total, duplicates, invalid_skipped }
  */
 export async function sendSMS(phoneNumbers, message, senderName = 'JEEPNI') {
   try {
@@ -209,6 +210,44 @@ export async function getSMSBalance() {
   }
 }
 
+/**
+ * Get the progress of a queued SMS job
+ * @param {number} jobId - job_id returned by sendSMS()
+ * @returns {Promise<Object>} { id, status, total, progress, counts: { sent, failed, unconfirmed, pending, ... } }
+ */
+export async function getSMSJob(jobId) {
+  const API_BASE = window.API_BASE ?? (
+    (location.hostname === 'localhost' || location.hostname === '127.0.0.1') && 
+    location.port !== '5000' ? 'http://localhost:5000' : ''
+  );
+
+  const response = await fetch(`${API_BASE}/api/sms/jobs/${jobId}`);
+  const result = await response.json();
+
+  if (!response.ok) {
+    throw new Error(result.error || `HTTP ${response.status}`);
+  }
+
+  return result;
+}
+
+/**
+ * Poll an SMS job until it is done or the timeout passes
+ * @param {number} jobId - job_id returned by sendSMS()
+ * @param {Object} options - { intervalMs (default 2000), timeoutMs (default 120000), onProgress(job) }
+ * @returns {Promise<Object>} The last job status; check job.status === 'done'
+ */
+export async function waitForSMSJob(jobId, { intervalMs = 2000, timeoutMs = 120000, onProgress } = {}) {
+  const deadline = Date.now() + timeoutMs;
+  let job = await getSMSJob(jobId);
+  while (job.status !== 'done' && Date.now() < deadline) {
+    if (onProgress) onProgress(job);
+    await new Promise(resolve => setTimeout(resolve, intervalMs));
+    job = await getSMSJob(jobId);
+  }
+  return job;
+}
+
 /**
  * Get SMS character count and message info
  * @param {string} message - Message content
@@ -305,6 +344,8 @@ export default {
   formatPhoneNumber,
   isValidPhoneNumber,
   sendSMS,
+  getSMSJob,
+  waitForSMSJob,
   getSMSBalance,
   getSMSInfo,
   renderRecipientsTable,